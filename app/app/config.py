@@ -16,7 +16,7 @@ API_DESCRIPTION = """
     
     ## Usage
     
-    1. Use the `/process` endpoint to upload and process facture files
+    1. Use the `/process` endpoint to upload and process facture files, then `/jobs/{job_id}` to get the result
     2. Use the `/factures`, `/clients`, `/achats`, and `/produits` endpoints to retrieve data from the database
     3. Use the `/clustering/rfm` and `/clustering/kmeans` endpoints to get clustering data
     4. Use the `/metrics` endpoints to monitor API performance
@@ -29,3 +29,8 @@ API_DESCRIPTION = """
 HOST = "0.0.0.0"
 PORT = 8000
 RELOAD = True
+
+# CPU budget: number of cores of the server (0: the available cores), split between the processes.
+# It sets the OCR threads, OMP_THREAD_LIMIT (Tesseract), the OpenCV threads and the BLAS threads (scikit-learn)
+CPU_BUDGET = int(os.getenv("CPU_BUDGET", 0)) or None
+CPU_BUDGET_PROCESSES = int(os.getenv("CPU_BUDGET_PROCESSES", 1))
@@ -16,7 +16,7 @@ API_DESCRIPTION = """
     
     ## Usage
     
-    1. Use the `/process` endpoint to upload and process facture files
+    1. Use the `/process` endpoint to upload and process facture files, then `/jobs/{job_id}` to get the result
     2. Use the `/factures`, `/clients`, `/achats`, and `/produits` endpoints to retrieve data from the database
     3. Use the `/clustering/rfm` and `/clustering/kmeans` endpoints to get clustering data
     4. Use the `/metrics` endpoints to monitor API performance
@@ -32,4 +32,8 @@ PORT = int(os.getenv("PORT", 8000))
 RELOAD = False
 WORKERS = int(os.getenv("WORKER", 1))
 
+# CPU budget: number of cores of the server (0: the available cores), split between the uvicorn workers.
+# It sets the OCR threads, OMP_THREAD_LIMIT (Tesseract), the OpenCV threads and the BLAS threads (scikit-learn)
+CPU_BUDGET = int(os.getenv("CPU_BUDGET", 0)) or None
+
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
@@ -7,6 +7,11 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import app.app.config as config
+from app.app.utils.cpu_budget import apply_cpu_budget
+# Avant les imports d'OpenCV, de Tesseract et de scikit-learn, et avant la création du pool OCR
+apply_cpu_budget(config.CPU_BUDGET, config.CPU_BUDGET_PROCESSES)
+# Cache des résultats OCR, activé par défaut pour l'API uniquement
+os.environ.setdefault("OCR_CACHE", "1")
 from app.app.utils.database import engine
 from sqlalchemy.orm import sessionmaker
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -72,6 +77,16 @@ async def monitoring_middleware(request: Request, call_next):
         response = await call_next(request)
         duration = time.time() - start_time
 
+        # Streamed responses (NDJSON of /process/batch) are not buffered
+        if not response.headers.get("content-type", "").startswith("application/json"):
+            monitor.record_request(
+                method=method,
+                path=path,
+                status_code=response.status_code,
+                duration=duration
+            )
+            return response
+
         # Access the response content
         response_body = b""
         async for chunk in response.body_iterator:
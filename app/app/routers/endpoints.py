@@ -1,22 +1,34 @@
 from email.policy import HTTP
+import asyncio
+import json
+import os
 from fastapi import APIRouter, HTTPException, Depends, Query, UploadFile, File, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Annotated, Dict, Any, List
 from datetime import timedelta
 
 from fastapi.security import OAuth2PasswordRequestForm
 from app.app.auth.auth import authenticate_user, create_access_token, get_current_active_user, get_current_user
 from app.app.auth.models import Token, User
-from app.app.utils.helpers import save_uploaded_file, extract_data_from_file, add_data_to_database, convert_dataframes_to_json
+from app.app.utils.helpers import read_uploaded_file, process_uploaded_file, iter_uploaded_files, extract_data_from_bytes, add_batch_to_database, convert_dataframes_to_json
 from app.app.utils.database import Facture, Log, SessionLocal, get_all_factures, get_facture_by_id, get_all_clients, get_client_by_id, get_all_achats, get_achat_by_id, get_all_produits, get_produit_by_id, get_factures_summary_data
 from app.app.utils.clustering import RFMClustering, KmeansClustering
-from app.app.utils.monitoring import monitor
+from app.app.utils.monitoring import monitor, stage_timers
+from app.app.utils.jobs import job_manager, QueueFullError
+from app.app.utils.ocr_cache import get_cache
+from app.app.utils.qr_decoding import qr_stats
+from app.app.utils.extract_data import cascade_stats
+from app.app.utils.cpu_budget import get_cpu_allocation
+from app.app.utils.ocr_backends import get_backend
 import pandas as pd
 from sqlalchemy import create_engine
 from app.app.utils.database import engine
 
 router = APIRouter()
 
+# Nombre de factures d'un lot enregistrées ensemble en base
+BATCH_DB_GROUP = int(os.getenv("BATCH_DB_GROUP", 50))
+
 rfm_model = RFMClustering()
 rfm_model.classify()
 
@@ -73,33 +85,147 @@ async def read_users_me(
 @router.post(
     "/process",
     summary="Process uploaded file",
-    description="Endpoint to process the uploaded file, extract data, and add it to the database.",
+    description="Endpoint to process the uploaded file, extract data, and add it to the database. "
+                "The file is processed by the OCR workers: the endpoint returns a job id at once, "
+                "the result is then read on `/jobs/{job_id}`. With `wait=true`, the endpoint waits for the result. "
+                "With `validate_only=true`, only the list of the errors of the invoice is returned.",
     tags=["OCR"],
 )
 async def create_item(
     file: UploadFile = File(...),
+    wait: bool = Query(False, description="Wait for the result instead of returning the job id"),
+    timeout: float = Query(60, ge=0, le=300, description="Maximum waiting time in seconds with wait=true"),
+    validate_only: bool = Query(False, description="Only check the invoice and return the list of its errors, without adding it to the database"),
     current_user: bool = Depends(get_current_user)
 ):
     """
     Process the uploaded file and extract data.
     """
     try:
-        file_location = await save_uploaded_file(file)
-        extract_result = extract_data_from_file(file_location)
-
-        # Check if the extraction result contains an error
-        if "erreur" in extract_result and extract_result["erreur"]:
-            return {"status": "error", "erreur": extract_result["erreur"], "data": None}
-
-        # Add data to the database and convert to JSON
-        add_data_to_database(engine, extract_result)
-        data = convert_dataframes_to_json(extract_result)
-
-        return {"status": "success", "erreur": None, "data": data}
+        content = await read_uploaded_file(file)
+        job_id = job_manager.submit(process_uploaded_file, engine, content, file.filename, validate_only)
+    except QueueFullError as e:
+        return JSONResponse(content={"status": "error", "erreur": str(e), "data": None}, status_code=503)
+    except HTTPException as e:
+        return JSONResponse(content={"status": "error", "erreur": e.detail, "data": None}, status_code=e.status_code)
     except Exception as e:
         # Return a JSON response for unexpected errors
         return JSONResponse(content={"status": "error", "erreur": str(e), "data": None})
 
+    if wait:
+        job = await job_manager.wait(job_id, timeout)
+        if job["status"] not in ("pending", "running"):
+            return job
+    else:
+        job = job_manager.get(job_id)
+    return JSONResponse(content=job, status_code=status.HTTP_202_ACCEPTED)
+
+@router.post(
+    "/process/batch",
+    summary="Process uploaded files",
+    description="Endpoint to process several uploaded files, or zip archives of invoices. "
+                "The invoices are processed concurrently by the OCR workers and the results are streamed "
+                "as NDJSON, one line per invoice as soon as it is processed. The data is added to the database by groups of invoices.",
+    tags=["OCR"],
+)
+async def create_items(
+    files: List[UploadFile] = File(...),
+    current_user: bool = Depends(get_current_user)
+):
+    """
+    Process the uploaded files and stream the extracted data.
+    """
+    async def stream_results():
+        max_in_flight = job_manager.workers * 2
+        in_flight = set()
+        to_save = []
+
+        def result_line(extract_result):
+            if extract_result["status"] == "success":
+                to_save.append(extract_result)
+            line = {
+                "fichier": extract_result["fichier"],
+                "status": extract_result["status"],
+                "erreur": extract_result["erreur"],
+                "data": convert_dataframes_to_json(extract_result),
+            }
+            return json.dumps(line, default=str) + "\n"
+
+        async def save_group():
+            group = to_save[:]
+            to_save.clear()
+            try:
+                await asyncio.to_thread(add_batch_to_database, engine, group)
+            except Exception as e:
+                return json.dumps({"fichier": None, "status": "error", "erreur": f"Erreur d'enregistrement en base : {e}", "data": None}) + "\n"
+
+        async def next_results():
+            nonlocal in_flight
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            lines = [result_line(task.result()) for task in done]
+            if len(to_save) >= BATCH_DB_GROUP:
+                lines.append(await save_group())
+            return [line for line in lines if line]
+
+        # Les fichiers sont lus au fur et à mesure : au plus max_in_flight factures en mémoire
+        try:
+            for filename, content in iter_uploaded_files(files):
+                if len(in_flight) >= max_in_flight:
+                    for line in await next_results():
+                        yield line
+                while True:
+                    try:
+                        in_flight.add(job_manager.run(extract_data_from_bytes, content, filename))
+                        break
+                    except QueueFullError as e:
+                        # File d'attente partagée pleine : le lot attend la fin de ses propres factures
+                        if not in_flight:
+                            yield json.dumps({"fichier": filename, "status": "error", "erreur": str(e), "data": None}) + "\n"
+                            break
+                        for line in await next_results():
+                            yield line
+        except HTTPException as e:
+            # Limite de taille ou de nombre de fichiers : les factures déjà lues sont tout de même traitées
+            yield json.dumps({"fichier": None, "status": "error", "erreur": e.detail, "data": None}) + "\n"
+        except Exception as e:
+            # Archive illisible : les factures déjà lues sont tout de même traitées
+            yield json.dumps({"fichier": None, "status": "error", "erreur": str(e), "data": None}) + "\n"
+        while in_flight:
+            for line in await next_results():
+                yield line
+        if to_save:
+            line = await save_group()
+            if line:
+                yield line
+
+    if job_manager.get_statistics()["pending"] >= job_manager.max_pending:
+        return JSONResponse(content={"status": "error", "erreur": "Trop de traitements en attente, réessayez plus tard", "data": None}, status_code=503)
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@router.get(
+    "/jobs/{job_id}",
+    summary="Read processing job",
+    description="Endpoint to retrieve the state and the result of a processing job. "
+                "With `wait`, the request waits up to `wait` seconds for the end of the job (long polling).",
+    tags=["OCR"],
+    responses={
+        200: {"description": "Job retrieved successfully"},
+        404: {"description": "Job not found"},
+    }
+)
+async def read_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Maximum waiting time in seconds"),
+    current_user: bool = Depends(get_current_user)
+):
+    """
+    Retrieve a processing job, waiting for its end if requested.
+    """
+    job = await job_manager.wait(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @router.get(
     "/factures",
     summary="Read all factures",
@@ -360,8 +486,25 @@ async def metrics():
     - Total requests
     - Error rate
     - Endpoint-specific metrics
+    - OCR cache hits and misses
+    - Qrcode decoding steps
+    - OCR workers
+    - Time of each stage of the OCR pipeline
+    - Escalations of the preprocessing cascade
+    - CPU budget and size of the thread pools
     """
-    return monitor.get_statistics()
+    stats = monitor.get_statistics()
+    cache = get_cache()
+    stats["ocr_cache"] = cache.stats() if cache else None
+    stats["qrcode_ladder"] = qr_stats.get_statistics()
+    stats["ocr_jobs"] = job_manager.get_statistics()
+    stats["stages"] = stage_timers.get_statistics()
+    stats["preprocessing_cascade"] = cascade_stats.get_statistics()
+    stats["cpu_budget"] = get_cpu_allocation()
+    stats["cpu_budget"]["effective"]["ocr_workers"] = job_manager.workers
+    # Moteurs tesserocr réellement créés (les autres moteurs n'ont pas de pool)
+    stats["cpu_budget"]["effective"]["ocr_engine_pool"] = getattr(get_backend(), "pool_size", None)
+    return stats
 
 @router.get(
     "/metrics/requests",
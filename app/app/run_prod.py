@@ -8,7 +8,12 @@ def run_production_server():
     """Run the API server in production mode"""
     # Import the production config
     import app.app.config_prod as config
-    
+
+    # Chaque worker uvicorn applique sa part du budget CPU au démarrage (app.app.main)
+    if config.CPU_BUDGET:
+        os.environ["CPU_BUDGET"] = str(config.CPU_BUDGET)
+    os.environ["CPU_BUDGET_PROCESSES"] = str(config.WORKERS)
+
     # Run the server
     uvicorn.run(
         "app.app.main:app",
@@ -0,0 +1,271 @@
+"""
+Batch extraction of the invoices, with a pool of OCR processes.
+
+Usage:
+    python -m app.app.utils.batch [--workers 8] [--max-in-flight 16] [--max-tasks-per-child 200]
+                                  [--manifest data/manifest.sqlite] [--rescan] [--retry-failed | --only-failed]
+                                  [--skip-known] [--files "scans/*.pdf"] [--threads]
+
+The progress is recorded in the manifest, so an interrupted run resumes where it stopped.
+The invoices can be images or PDF, one invoice per page.
+With --threads, the workers are the threads of one process: the deep-learning engines
+(OCR_BACKEND=doctr or easyocr) then recognize the regions of several invoices in each batch.
+"""
+import argparse
+import datetime
+import glob
+import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import sys
+import time
+import pandas as pd
+from dotenv import load_dotenv # type: ignore
+from sqlalchemy import create_engine
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils.cpu_budget import apply_cpu_budget
+from app.app.utils.extract_data import extraire_donnees
+from app.app.utils.get_all_files import get_all_files
+from app.app.utils.image_context import ImageContext
+from app.app.utils.manifest import Manifest
+from app.app.utils.pdf import file_digest, is_pdf
+
+
+def file_path(filename, data_dir="data/files"):
+    """
+    Get the local path of an invoice of the archive.
+
+    Args:
+        filename (str): the name of the invoice, like FAC_2018_0001-654.png.
+        data_dir (str): the folder of the archive.
+
+    Returns:
+        str: the path of the invoice.
+    """
+    return f"{data_dir}/{filename.split('_')[1]}/{filename}"
+
+
+# Identifiants des factures déjà en base, partagés avec chaque processus à son démarrage
+_known_ids = None
+
+
+def _init_worker(known_ids):
+    global _known_ids
+    _known_ids = known_ids
+
+
+def process_file(task):
+    """
+    Extract one invoice, in a worker process.
+
+    Args:
+        task (tuple): the name and the path of the invoice.
+
+    Returns:
+        dict: the result of extraire_donnees, with the name, the hash of the file and the duration.
+    """
+    filename, chemin = task
+    start = time.perf_counter()
+    sha256 = None
+    try:
+        if is_pdf(chemin):
+            # Les pages sont rastérisées une à une par extraire_donnees
+            sha256 = file_digest(chemin)
+            extract = extraire_donnees(chemin, known_ids=_known_ids)
+        else:
+            context = ImageContext.from_path(chemin)
+            sha256 = context.digest
+            extract = extraire_donnees(context, known_ids=_known_ids)
+    except Exception as e:
+        extract = {"status": "error", "fichier": chemin, "data": None, "erreur": str(e)}
+    extract["filename"] = filename
+    extract["sha256"] = sha256
+    extract["duration"] = time.perf_counter() - start
+    return extract
+
+
+def iter_results(tasks, workers, max_in_flight, max_tasks_per_child, known_ids=None, threads=False):
+    """
+    Extract the invoices in a pool of processes, as they are completed.
+
+    Args:
+        tasks (iterable): the (filename, path) of the invoices.
+        workers (int): the number of OCR processes.
+        max_in_flight (int): the maximum number of invoices submitted and not yet consumed.
+        max_tasks_per_child (int): the number of invoices after which a worker is replaced, to cap its memory.
+        known_ids (set): the ids of the invoices already in the database, skipped without OCR.
+        threads (bool): use `workers` threads of the current process instead of processes,
+            so they share one OCR engine (and its batches).
+
+    Yields:
+        dict: the result of process_file for each invoice, in completion order.
+    """
+    if threads:
+        pool = multiprocessing.pool.ThreadPool(workers, initializer=_init_worker, initargs=(known_ids,))
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(known_ids,), maxtasksperchild=max_tasks_per_child)
+    # Les tâches sont soumises depuis ce thread : si le consommateur s'arrête (erreur, Ctrl-C),
+    # aucun thread du pool n'est bloqué et la sortie du `with` termine les processus
+    done = queue.Queue()
+    tasks = iter(tasks)
+    pending = 0
+    with pool:
+        while True:
+            while pending < max_in_flight:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pool.apply_async(process_file, (task,), callback=done.put, error_callback=done.put)
+                pending += 1
+            if not pending:
+                break
+            result = done.get()
+            pending -= 1
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+
+
+def save_result(engine, extract):
+    """
+    Add the data of an extracted invoice to the database.
+
+    Args:
+        engine (engine): the engine to connect to the database.
+        extract (dict): the result of the extraction.
+    """
+    from app.app.utils.database import add_data
+    df_client, df_facture, df_produit, df_achat = extract["data"]
+    add_data(engine, "client", df_client)
+    add_data(engine, "facture", df_facture)
+    add_data(engine, "produit", df_produit)
+    add_data(engine, "achat", df_achat)
+
+
+def save_errors(engine, errors):
+    """
+    Add the errors of the extraction to the log table.
+
+    Args:
+        engine (engine): the engine to connect to the database.
+        errors (list): the errors, one dict (time, fichier, erreur) per failed invoice.
+    """
+    from app.app.utils.database import add_data
+    if errors:
+        add_data(engine, "log", pd.DataFrame(errors))
+
+
+def run_batch(tasks, engine, manifest, workers, max_in_flight, max_tasks_per_child, known_ids=None, progress_every=100, threads=False):
+    """
+    Extract the given invoices, add them to the database and record their status in the manifest.
+
+    Args:
+        tasks (list): the (filename, path) of the invoices.
+        engine (engine): the engine to connect to the database.
+        manifest (Manifest): the manifest of the run.
+        workers (int): the number of OCR processes.
+        max_in_flight (int): the maximum number of invoices submitted and not yet saved.
+        max_tasks_per_child (int): the number of invoices after which a worker is replaced.
+        known_ids (set): the ids of the invoices already in the database, skipped without OCR.
+        progress_every (int): the number of invoices between two progress messages (and error log flushes).
+        threads (bool): use threads of the current process instead of processes.
+
+    Returns:
+        int: the number of failed invoices.
+    """
+    start_time = time.time()
+    errors = []
+    nb_errors = 0
+    nb_duplicates = 0
+
+    for i, extract in enumerate(iter_results(tasks, workers, max_in_flight, max_tasks_per_child, known_ids, threads), start=1):
+        if extract["erreur"]:
+            print(f"Echec du fichier : {extract['fichier']}, erreur : {extract['erreur']}")
+            errors.append({
+                "time": datetime.datetime.now(),
+                "fichier": extract["filename"],
+                "erreur": extract["erreur"]
+            })
+            nb_errors += 1
+        if extract["status"] == "duplicate":
+            nb_duplicates += 1
+        if extract["data"]:
+            save_result(engine, extract)
+        manifest.record(extract["filename"], extract["status"], extract["sha256"], extract["duration"], extract["erreur"])
+
+        if i % progress_every == 0:
+            save_errors(engine, errors)
+            errors = []
+            elapsed_time = time.time() - start_time
+            print(f"{i} fichiers traités en {elapsed_time:.2f} secondes ({i / elapsed_time:.2f} fichiers/s)")
+
+    save_errors(engine, errors)
+    elapsed_time = time.time() - start_time
+    total = len(tasks)
+    print(f"\nTraitement terminé : {total} fichiers en {elapsed_time:.2f} secondes ({total / elapsed_time if elapsed_time else 0:.2f} fichiers/s)")
+    if known_ids is not None:
+        print(f"Factures déjà en base ignorées : {nb_duplicates}")
+    return nb_errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extraction des factures en parallèle")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="nombre de processus OCR")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="nombre maximum de factures en cours (défaut : 2 x workers)")
+    parser.add_argument("--max-tasks-per-child", type=int, default=200, help="nombre de factures avant le remplacement d'un processus")
+    parser.add_argument("--data-dir", default="data/files", help="dossier des factures téléchargées")
+    parser.add_argument("--manifest", default="data/manifest.sqlite", help="fichier de suivi du traitement")
+    parser.add_argument("--rescan", action="store_true", help="relister les factures de l'archive pour ajouter les nouvelles au suivi")
+    failed = parser.add_mutually_exclusive_group()
+    failed.add_argument("--retry-failed", action="store_true", help="traiter aussi les factures en échec")
+    failed.add_argument("--only-failed", action="store_true", help="ne traiter que les factures en échec")
+    parser.add_argument("--skip-known", action="store_true", help="lire d'abord le QR code et ignorer sans OCR les factures déjà en base")
+    parser.add_argument("--files", nargs="+", help="motifs de fichiers locaux (images ou PDF) à ajouter au suivi")
+    parser.add_argument("--threads", action="store_true", help="threads d'un seul processus au lieu de processus (moteurs OCR par lots)")
+    args = parser.parse_args()
+    load_dotenv()
+    # Avant la création des moteurs OCR et des pools de threads : les processus de traitement se partagent
+    # les cœurs, un thread par appel Tesseract ou OpenCV (les bibliothèques déjà chargées sont réglées à chaud)
+    apply_cpu_budget(processes=1 if args.threads else args.workers)
+    os.environ.setdefault("OCR_CACHE", "1")
+    blob_keys = os.getenv("AZURE_BLOB_KEYS")
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable not set")
+    engine = create_engine(database_url)
+
+    manifest = Manifest(args.manifest)
+    if args.files:
+        paths = sorted({path for pattern in args.files for path in glob.glob(pattern)})
+        new_files = manifest.add_files((os.path.basename(path), path) for path in paths)
+        print(f"{new_files} nouveaux fichiers locaux ajoutés au suivi")
+    elif args.rescan or not manifest.summary():
+        all_files = get_all_files(blob_keys)
+        new_files = manifest.add_files((filename, file_path(filename, args.data_dir)) for filename in all_files)
+        print(f"{new_files} nouveaux fichiers ajoutés au suivi")
+    tasks = manifest.files_to_process(retry_failed=args.retry_failed, only_failed=args.only_failed)
+    known_ids = None
+    if args.skip_known:
+        from app.app.utils.database import get_known_facture_ids
+        known_ids = get_known_facture_ids(engine)
+        print(f"{len(known_ids)} factures déjà en base")
+
+    print(f"Début du traitement : {len(tasks)} fichiers ({args.workers} {'threads' if args.threads else 'processus'})")
+    nb_errors = run_batch(
+        tasks,
+        engine,
+        manifest,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight or 2 * args.workers,
+        max_tasks_per_child=args.max_tasks_per_child,
+        known_ids=known_ids,
+        threads=args.threads,
+    )
+    print(f"Nombre d'erreurs : {nb_errors}")
+    print(f"Suivi : {manifest.summary()}")
+    manifest.close()
+
+
+if __name__ == "__main__":
+    main()
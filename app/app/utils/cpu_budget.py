@@ -0,0 +1,125 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+try:
+    from threadpoolctl import threadpool_info, threadpool_limits # type: ignore
+except ImportError:  # pragma: no cover - installé avec scikit-learn
+    threadpool_info = threadpool_limits = None
+
+# Variables des bibliothèques de calcul lues au chargement de la bibliothèque :
+# elles doivent être définies avant les imports de numpy, OpenCV, tesserocr et scikit-learn
+BLAS_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+_allocation = None
+
+
+def available_cpus():
+    """
+    Get the number of cores the current process may run on (its CPU affinity, e.g. a container cpuset).
+
+    Returns:
+        int: the number of cores.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - pas d'affinité sous macOS et Windows
+        return os.cpu_count() or 1
+
+
+def plan_cpu_budget(cpus, processes=1, region_threads=0):
+    """
+    Split a CPU budget between the processes of the server and, in each process, between its thread pools.
+    The parallelism comes from the OCR threads (one invoice per thread and per core): each Tesseract
+    call and each OpenCV operation runs on one thread, instead of spawning its own pool on every core.
+    The cores of a process are shared by the OCR threads, the region threads (OCR_REGION_THREADS,
+    at most half of the cores) and the PDF page threads (a quarter of the rest), each pool keeping
+    at least one thread. Each of these threads gets its own Tesseract engine (OCR_ENGINE_POOL).
+
+    Args:
+        cpus (int): the number of cores given to the whole server.
+        processes (int): the number of processes sharing the budget (uvicorn workers, batch processes).
+        region_threads (int): the number of threads requested to read the regions of one invoice, 0 if disabled.
+
+    Returns:
+        dict: the number of cores per process and the size of each thread pool of a process.
+    """
+    per_process = max(1, cpus // max(1, processes))
+    region_threads = min(region_threads, per_process // 2)
+    pdf_page_workers = max(1, (per_process - region_threads) // 4)
+    ocr_workers = max(1, per_process - region_threads - pdf_page_workers)
+    return {
+        "cpus": cpus,
+        "processes": processes,
+        "cpus_per_process": per_process,
+        "ocr_workers": ocr_workers,
+        "ocr_region_threads": region_threads,
+        "pdf_page_workers": pdf_page_workers,
+        # Un moteur tesserocr par thread qui peut lancer l'OCR : aucun thread n'attend un moteur libre
+        "ocr_engine_pool": ocr_workers + region_threads + pdf_page_workers,
+        "omp_thread_limit": 1,
+        "opencv_threads": 1,
+        # Le clustering n'est lancé qu'à la demande : il peut utiliser tous les cœurs du processus
+        "blas_threads": per_process,
+    }
+
+
+def apply_cpu_budget(cpus=None, processes=1):
+    """
+    Apply the CPU budget to the current process. The environment variables already set are kept,
+    so a single pool can still be tuned by hand. The processes started afterwards (the Tesseract
+    processes of pytesseract, the batch workers) inherit the variables.
+
+    Args:
+        cpus (int): the number of cores given to the whole server, defaults to the available cores.
+        processes (int): the number of processes sharing the budget.
+
+    Returns:
+        dict: the planned allocation.
+    """
+    global _allocation
+    plan = plan_cpu_budget(cpus or available_cpus(), processes, int(os.getenv("OCR_REGION_THREADS", 0)))
+    os.environ.setdefault("OMP_THREAD_LIMIT", str(plan["omp_thread_limit"]))
+    os.environ.setdefault("OCR_WORKERS", str(plan["ocr_workers"]))
+    os.environ.setdefault("PDF_PAGE_WORKERS", str(plan["pdf_page_workers"]))
+    # Tailles effectives des pools, réglages à la main compris
+    os.environ.setdefault("OCR_ENGINE_POOL", str(
+        int(os.environ["OCR_WORKERS"]) + int(os.getenv("OCR_REGION_THREADS", 0)) + int(os.environ["PDF_PAGE_WORKERS"])
+    ))
+    for variable in BLAS_VARIABLES:
+        os.environ.setdefault(variable, str(plan["blas_threads"]))
+
+    import cv2
+    cv2.setNumThreads(plan["opencv_threads"])
+    if threadpool_limits is not None:
+        # Bibliothèques déjà chargées avant ce réglage
+        threadpool_limits(int(os.environ["OPENBLAS_NUM_THREADS"]), user_api="blas")
+        threadpool_limits(int(os.environ["OMP_NUM_THREADS"]), user_api="openmp")
+    _allocation = plan
+    logger.info(f"Budget CPU : {plan}")
+    return plan
+
+
+def get_cpu_allocation():
+    """
+    Get the planned CPU budget and the effective size of the thread pools of the current process.
+
+    Returns:
+        dict: the planned allocation (None if the budget was not applied) and the effective values.
+    """
+    import cv2
+    effective = {
+        "omp_thread_limit": os.getenv("OMP_THREAD_LIMIT"),
+        "opencv_threads": cv2.getNumThreads(),
+        "ocr_workers": os.getenv("OCR_WORKERS"),
+        "ocr_region_threads": int(os.getenv("OCR_REGION_THREADS", 0)),
+        "pdf_page_workers": int(os.getenv("PDF_PAGE_WORKERS", 2)),
+        "ocr_engine_pool": int(os.getenv("OCR_ENGINE_POOL", 1)),
+    }
+    effective.update({variable.lower(): os.getenv(variable) for variable in BLAS_VARIABLES})
+    if threadpool_info is not None:
+        effective["threadpools"] = [
+            {"library": pool["internal_api"], "threads": pool["num_threads"]} for pool in threadpool_info()
+        ]
+    return {"planned": _allocation, "effective": effective}
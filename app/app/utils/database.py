@@ -227,6 +227,20 @@ def add_log(time, file, error):
         session.add(log)
         session.commit()
 
+def get_known_facture_ids(engine):
+    """
+    Get the ids of all the factures already in the database.
+
+    Args:
+        engine (engine): the engine to connect to the database
+
+    Returns:
+        set: the ids of the factures.
+    """
+    with engine.connect() as connection:
+        result = connection.execute(text("SELECT id_facture FROM melody.\"facture\""))
+        return {row[0] for row in result}
+
 def get_all_factures():
     with SessionLocal() as session:
         return session.query(Facture).all()
@@ -0,0 +1,36 @@
+import datetime
+from functools import lru_cache
+from dateparser import parse
+from app.app.utils.monitoring import stage_timers
+
+# Formats rencontrés sur les factures : "Issue date 2019-03-03", "DATE:2019-03-03 20:16:00" et "birth 1985-01-16"
+DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+)
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text):
+    """
+    Parse a date of an invoice. The known formats are tried first, dateparser is only used
+    for the other texts. The results are memoized (birthdates and dates repeat a lot).
+
+    Args:
+        text (str): the text of the date.
+
+    Returns:
+        datetime.datetime: the date, None if the text is not a valid date.
+    """
+    if text is None:
+        return None
+    # Seules les dates non mémorisées sont chronométrées
+    with stage_timers.time("dates"):
+        text = text.strip()
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(text, date_format)
+            except ValueError:
+                pass
+        return parse(text, languages=["fr", "en"])
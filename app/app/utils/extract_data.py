@@ -1,105 +1,390 @@
-import datetime
-import numpy as np
 import pandas as pd
-from dotenv import load_dotenv # type: ignore
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from app.app.utils.get_all_files import get_all_files
-from dateparser import parse
+from app.app.utils.dates import parse_date
+from app.app.utils.image_context import ImageContext, get_clahe, scratch_buffer
+from app.app.utils.monitoring import stage_timers
+from app.app.utils.ocr_backends import get_backend, reserve_engines
+from app.app.utils.ocr_cache import OCRCache, get_cache
+from app.app.utils.pdf import is_pdf, map_pages
+from app.app.utils.qr_decoding import decode_ladder
+from app.app.utils.templates import DEFAULT_TEMPLATE, InvoiceTemplate, RegionSpec, get_template
 import cv2
-import pytesseract
-import time
-from sqlalchemy import create_engine
 import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import replace
 
-def decode_qrcode(img_path):
+def decode_qrcode(img_path, box=DEFAULT_TEMPLATE.qrcode_box):
     """
     Extract the text from the qrcode in the given image
 
     Args:
-        img_path (str): the path of the image
+        img_path (str | ImageContext): the path of the image or its already decoded context
+        box (tuple): the region (x, y, w, h) of the qrcode
 
     Returns:
         tupple: the genre, birthdate, datetime and name fac of the client in the qrcode
     """
-    scale_factor = 3
-    img = cv2.imread(img_path)
-    (x, y, w, h) = (530, 5, 180, 180)
-    top_left = (x, y)
-    bottom_right = (x + w, y + h)
-    roi = img[y:y+h, x:x+w]
-    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(10,10))
-    enhanced = clahe.apply(gray)
-    new_size = int(img.shape[1] * scale_factor), int(img.shape[0] * scale_factor)
-    img_large = cv2.resize(enhanced, new_size, interpolation=cv2.INTER_LINEAR_EXACT)
-    detector = cv2.QRCodeDetector()
-    data, bbox, straight_qrcode = detector.detectAndDecode(img_large)
-    if not data:
-        roi = img[y:y+h, x:x+w]
-        new_size = int(roi.shape[1] * scale_factor), int(roi.shape[0] * scale_factor)
-        img_large = cv2.resize(img_large, new_size, interpolation=cv2.INTER_LINEAR_EXACT)
-        data, bbox, straight_qrcode = detector.detectAndDecode(img_large)
+    context = ImageContext.ensure(img_path)
+    # Le QR code n'est décodé qu'une fois par facture, même s'il est lu en premier pour le dédoublonnage
+    if box not in context.qrcodes:
+        context.qrcodes[box] = _decode_qrcode(context, box)
+    return context.qrcodes[box]
+
+def _decode_qrcode(context, box):
+    with stage_timers.time("qrcode"):
+        data, rung = decode_ladder(context.roi(box), context.shape)
     if data:
         data = data.split("\n")
         datetime = data[1].split("DATE:")[1]
-        birthdate = parse(data[2].split(", birth ")[1], languages=["fr", "en"])
+        birthdate = parse_date(data[2].split(", birth ")[1])
         genre = data[2].split(",")[0].split(":")[1]
         fac = data[0].replace("INVOICE:FAC/","").replace("/","-")
         return genre, birthdate, datetime, fac
     return None, None, None, None
 
-def process_image(input_img_path, regions, scale_factor=2):
+def _clahe(image, region, scratch=True):
+    clahe = get_clahe(region.clahe_clip_limit, region.clahe_tile_grid_size)
+    return clahe.apply(image, dst=scratch_buffer(f"{region.name}:clahe", image.shape) if scratch else None)
+
+def _otsu(image, region, scratch=True):
+    dst = scratch_buffer(f"{region.name}:otsu", image.shape) if scratch else None
+    _, thresholded = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)
+    return thresholded
+
+def _denoise(image, region, scratch=True):
+    return cv2.fastNlMeansDenoising(image, h=10)
+
+def _deskew(image, region, scratch=True):
+    # Angle du plus petit rectangle contenant l'encre : les régions sont des blocs de lignes de texte
+    _, ink = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    points = cv2.findNonZero(ink)
+    if points is None:
+        return image
+    angle = cv2.minAreaRect(points)[-1]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    if abs(angle) < 0.1 or abs(angle) > 10:
+        return image
+    height, width = image.shape
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(image, rotation, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+# Étapes de prétraitement utilisables dans les modèles de facture
+PREPROCESSING_STEPS = {
+    "clahe": _clahe,
+    "otsu": _otsu,
+    "denoise": _denoise,
+    "deskew": _deskew,
+}
+
+# Régions relues au niveau suivant de la cascade quand les contrôles d'une étape échouent
+CASCADE_STAGES = {
+    "header": ("bloc",),
+    "items": ("Products", "Quantities_and_prices"),
+}
+# Régions lues par les contrôles, dans l'ordre des étapes : la région du QR code est décodée, pas lue par l'OCR
+READ_REGIONS = CASCADE_STAGES["header"] + CASCADE_STAGES["items"]
+
+
+class CascadeStats:
+    """Count, for each stage and level of the preprocessing cascade, the attempts and the failed checks"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = Counter()
+        self.failures = Counter()
+
+    def record(self, stage, level, failed):
+        """
+        Record the checks of a stage at one level.
+
+        Args:
+            stage (str): the name of the stage ("header" or "items").
+            level (str): the name of the level.
+            failed (bool): True if the checks failed (the regions go to the next level, if any).
+        """
+        with self.lock:
+            self.attempts[stage, level] += 1
+            if failed:
+                self.failures[stage, level] += 1
+
+    def get_statistics(self):
+        """
+        Get the statistics of the cascade.
+
+        Returns:
+            dict: for each stage and level, the attempts, the failures and the escalation rate
+            (at the last level, a failure rejects the invoice).
+        """
+        with self.lock:
+            stats = {}
+            for (stage, level), attempts in self.attempts.items():
+                stats.setdefault(stage, {})[level] = {
+                    "attempts": attempts,
+                    "failures": self.failures[stage, level],
+                    "escalation_rate": self.failures[stage, level] / attempts,
+                }
+            return stats
+
+
+cascade_stats = CascadeStats()
+
+def preprocess_region(context, region, scratch=True):
     """
-    Extract the data from the differents region of the given image
+    Apply the preprocessing chain of a region.
 
     Args:
-        input_img_path (str): the path of the image
-        regions (dict): the regions of the image
-        scale_factor (int): the scale factor of the image.
+        context (ImageContext): the decoded invoice.
+        region (RegionSpec): the region to preprocess.
+        scratch (bool): reuse the scratch buffers of the region, False to allocate new images.
 
     Returns:
-        dict: the extracted data from the image
+        np.ndarray: the preprocessed region, ready for the OCR, None for an empty autocrop region.
+    """
+    with stage_timers.time("preprocessing"):
+        box = region.box
+        if region.autocrop:
+            # Recadrage sur l'encre avant l'agrandissement : le temps de Tesseract suit le nombre de pixels
+            box = context.ink_box(box)
+            if box is None:
+                return None
+        # Agrandir la région pour améliorer la reconnaissance des caractères
+        image = context.scaled_roi(box, region.scale, key=f"{region.name}:scaled" if scratch else None)
+        for step in region.preprocessing:
+            image = PREPROCESSING_STEPS[step](image, region, scratch)
+    return image
+
+def ocr_region(context, region, backend=None):
+    """
+    OCR one region of the invoice. The text is kept in the context, so a region is
+    never sent twice to the OCR engine for the same invoice.
+
+    Args:
+        context (ImageContext): the decoded invoice.
+        region (RegionSpec): the region to OCR.
+        backend (OCRBackend): the OCR engine to use, defaults to the engine of the process.
+
+    Returns:
+        str: the text of the region.
+    """
+    if region not in context.ocr_texts:
+        image = preprocess_region(context, region)
+        if image is None:
+            context.ocr_texts[region] = ""
+            return ""
+        with stage_timers.time(f"ocr:{region.name}"):
+            text = (backend or get_backend()).image_to_string(image, psm=region.psm, whitelist=region.whitelist)
+        context.ocr_calls += 1
+        context.ocr_texts[region] = text.strip()
+    return context.ocr_texts[region]
+
+def ocr_regions(context, regions, backend=None, scratch=True):
+    """
+    OCR several regions of the invoice. The engines that recognize by batches (doctr, easyocr) get
+    all the regions in one call (timed as ocr:batch); Tesseract reads each region with its own call
+    (timed as ocr:<region>), at the same time on the thread pool of the context if any.
+    The regions already recognized are skipped.
+
+    Args:
+        context (ImageContext): the decoded invoice.
+        regions (list): the RegionSpec to OCR.
+        backend (OCRBackend): the OCR engine to use, defaults to the engine of the process.
+        scratch (bool): reuse the scratch buffers of the regions, False when several regions share a name.
     """
-    img = cv2.imread(input_img_path)
-    
-    # Agrandir l'image pour améliorer la reconnaissance des caractères
-    new_size = (int(img.shape[1] * scale_factor), int(img.shape[0] * scale_factor))
-    img = cv2.resize(img, new_size, interpolation=cv2.INTER_LINEAR)
-    
-    extracted_texts = {}
+    missing = [region for region in regions if region not in context.ocr_texts]
+    if not missing:
+        return
+    backend = backend or get_backend()
+    # Les régions d'un lot partagent leurs paramètres Tesseract
+    groups = {}
+    for region in missing:
+        groups.setdefault((region.psm, region.whitelist), []).append(region)
+    for (psm, whitelist), group in groups.items():
+        images = [preprocess_region(context, region, scratch) for region in group]
+        # Régions sans encre : pas d'OCR
+        for region, image in zip(group, images):
+            if image is None:
+                context.ocr_texts[region] = ""
+        group = [region for region, image in zip(group, images) if image is not None]
+        images = [image for image in images if image is not None]
+        if not group:
+            continue
+        if backend.batching:
+            with stage_timers.time("ocr:batch"):
+                texts = backend.recognize_batch(images, psm=psm, whitelist=whitelist)
+        else:
+            # Un appel par région : le temps de chaque région reste mesuré (ocr:<région>)
+            def recognize(item):
+                region, image = item
+                with stage_timers.time(f"ocr:{region.name}"):
+                    return backend.image_to_string(image, psm=psm, whitelist=whitelist)
+            items = list(zip(group, images))
+            if context.executor is not None and len(items) > 1:
+                texts = list(context.executor.map(recognize, items))
+            else:
+                texts = [recognize(item) for item in items]
+        context.ocr_calls += len(group)
+        for region, text in zip(group, texts):
+            context.ocr_texts[region] = text.strip()
 
-    for region_name, (x, y, w, h) in regions.items():
-        # Ajuster les coordonnées des régions à l'échelle
-        x, y, w, h = int(x * scale_factor), int(y * scale_factor), int(w * scale_factor), int(h * scale_factor)
-        
-        roi = img[y:y+h, x:x+w]
+# Marge verticale des lignes des articles, inférieure à l'espace entre deux lignes
+LINE_MARGIN = 2
 
-        # Convertir en niveaux de gris
-        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+def ocr_line_items(context, template, backend=None):
+    """
+    OCR the item columns of the template line by line. The lines are found once on all the
+    columns, and the cells of every line are sent together to the engine, each one as a single
+    line. The text of each column is then rebuilt with one line per line of the table, so the
+    n-th product is always on the same line as its quantity and price. A line with text only in
+    the first column continues the product of the previous line.
+
+    Args:
+        context (ImageContext): the decoded invoice.
+        template (InvoiceTemplate): the layout of the invoice, with its line_items columns.
+        backend (OCRBackend): the OCR engine to use, defaults to the engine of the process.
+    """
+    columns = [template.region(name) for name in template.line_items]
+    if all(column in context.ocr_texts for column in columns):
+        return
+    lines = context.ink_rows([column.box for column in columns])
+    cells = []
+    for top, bottom in lines:
+        # Petite marge blanche au-dessus et en dessous de la ligne, sans déborder de la colonne
+        y0 = max(top - LINE_MARGIN, columns[0].box[1])
+        y1 = min(bottom + LINE_MARGIN, columns[0].box[1] + columns[0].box[3])
+        row = []
+        for column in columns:
+            box = context.ink_box((column.box[0], y0, column.box[2], y1 - y0))
+            row.append(replace(column, box=box, psm=template.line_psm, autocrop=False) if box else None)
+        cells.append(row)
+    # Les cellules d'une colonne portent son nom : pas de buffers de prétraitement, qui seraient
+    # partagés par toutes les cellules préparées avant l'OCR
+    ocr_regions(context, [cell for row in cells for cell in row if cell], backend, scratch=False)
+
+    table = []
+    for row in cells:
+        texts = [context.ocr_texts[cell] if cell else "" for cell in row]
+        if not any(texts):
+            continue
+        if table and texts[0] and not any(texts[1:]):
+            table[-1][0] = f"{table[-1][0]} {texts[0]}"
+        else:
+            table.append(texts)
+    for position, column in enumerate(columns):
+        context.ocr_texts[column] = "\n".join(texts[position] for texts in table)
 
-        # Amélioration du contraste (CLAHE)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(10,10))
-        enhanced = clahe.apply(gray)
+def words_in_box(words, box):
+    """
+    Select the words whose center is inside a region.
 
-        # Binarisation (Otsu)
-        _, thresholded = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    Args:
+        words (list): the OCRWord of the page, with boxes in pixels of the original image.
+        box (tuple): the region (x, y, w, h).
 
-        if region_name == "Quantities_and_prices":
-            text = pytesseract.image_to_string(thresholded, config="psm 6 --tessedit_char_whitelist 0123456789Eurox.")
-        text = pytesseract.image_to_string(thresholded, config="--psm 6")
-        extracted_texts[region_name] = text.strip()
+    Returns:
+        list: the words of the region.
+    """
+    x, y, w, h = box
+    return [
+        word for word in words
+        if x <= word.box[0] + word.box[2] / 2 < x + w and y <= word.box[1] + word.box[3] / 2 < y + h
+    ]
 
-    return extracted_texts
+def words_to_text(words):
+    """
+    Rebuild the text of a region from its words: one line of text per line of Tesseract,
+    from top to bottom, and the words of a line from left to right.
+
+    Args:
+        words (list): the OCRWord of the region.
+
+    Returns:
+        str: the text of the region.
+    """
+    lines = {}
+    for word in words:
+        lines.setdefault(word.line, []).append(word)
+    ordered = sorted(lines.values(), key=lambda line: min(word.box[1] for word in line))
+    return "\n".join(" ".join(word.text for word in sorted(line, key=lambda word: word.box[0])) for line in ordered)
+
+def ocr_page(context, template, backend=None):
+    """
+    OCR the whole page once ("layout" mode) and assign the recognized words to the regions of the
+    template by their boxes. The texts are kept in the context like those of ocr_region, and the
+    words with their confidences in context.ocr_words.
+
+    Args:
+        context (ImageContext): the decoded invoice.
+        template (InvoiceTemplate): the layout of the invoice.
+        backend (OCRBackend): the OCR engine to use, defaults to the engine of the process.
+    """
+    if context.page_words is None:
+        height, width = context.shape[:2]
+        page = RegionSpec("page", (0, 0, width, height), psm=template.layout_psm)
+        image = preprocess_region(context, page)
+        with stage_timers.time("ocr:page"):
+            words = (backend or get_backend()).image_to_data(image, psm=page.psm)
+        context.ocr_calls += 1
+        # Boîtes des mots dans les coordonnées de l'image d'origine, comme celles des régions
+        context.page_words = [replace(word, box=tuple(value / page.scale for value in word.box)) for word in words]
+    for region in template.regions:
+        if region not in context.ocr_texts:
+            context.ocr_words[region] = words_in_box(context.page_words, region.box)
+            context.ocr_texts[region] = words_to_text(context.ocr_words[region])
+
+def ocr_template_region(context, template, name, backend=None):
+    """
+    Get the text of one region of the template, with the OCR mode of the template.
+
+    Args:
+        context (ImageContext): the decoded invoice.
+        template (InvoiceTemplate): the layout of the invoice.
+        name (str): the name of the region.
+        backend (OCRBackend): the OCR engine to use, defaults to the engine of the process.
+
+    Returns:
+        str: the text of the region.
+    """
+    if template.mode == "layout":
+        ocr_page(context, template, backend)
+    return ocr_region(context, template.region(name), backend)
+
+def process_image(input_img_path, regions, scale_factor=2, backend=None, names=None):
+    """
+    Extract the data from the differents region of the given image
+
+    Args:
+        input_img_path (str | ImageContext): the path of the image or its already decoded context
+        regions (InvoiceTemplate | dict): the template of the invoice, or the boxes of the regions
+        scale_factor (int): the scale factor of the image, when the regions are given as boxes.
+        backend (OCRBackend): the OCR engine to use, defaults to the engine of the process.
+        names (tuple): the names of the regions to read, defaults to all the regions.
+
+    Returns:
+        dict: the extracted data from the image
+    """
+    context = ImageContext.ensure(input_img_path)
+    if isinstance(regions, InvoiceTemplate):
+        if regions.mode == "layout":
+            ocr_page(context, regions, backend)
+        elif regions.line_items:
+            ocr_line_items(context, regions, backend)
+        specs = regions.regions
+    else:
+        specs = [RegionSpec(name, tuple(box), scale=scale_factor) for name, box in regions.items()]
+    if names is not None:
+        specs = [region for region in specs if region.name in names]
+    ocr_regions(context, specs, backend)
+    return {region.name: context.ocr_texts[region] for region in specs}
 
 # Définition des blocs
-predefined_regions = {
-    "Products": (20, 180, 420, 900),
-    "Quantities_and_prices": (510, 180, 280, 900),
-    "Qrcode": (530, 5, 180, 180),
-    "bloc": (10, 10, 520, 180)
-}
+predefined_regions = DEFAULT_TEMPLATE.boxes
 
 def nettoyer_total(total):
     """
@@ -115,100 +400,332 @@ def nettoyer_total(total):
         return None
     return total.replace(" Euro", "")
 
-def extract_data_raw(file):
+def _reject(context, file, erreurs):
+    return {"status": "error", "fichier": file, "data": None, "erreur": ', '.join(erreurs), "erreurs": erreurs, "variables": None, "ocr_calls": context.ocr_calls}
+
+def _read_header(context, template, datetime_qr, fac):
     """
-    Extract the raw data from the image.
+    OCR the "bloc" header and check it against the QR code.
 
     Args:
-        file (str): the path of the file to extract the data from.
+        context (ImageContext): the decoded invoice.
+        template (InvoiceTemplate): the layout of the invoice.
+        datetime_qr (str): the date of the invoice in the QR code.
+        fac (str): the id of the invoice in the QR code.
 
     Returns:
-        dict: the data extracted from the image, including status, filename, error, and a dictionary of extracted variables.
+        tuple: the values read in the header and the errors of its checks.
     """
     erreurs = []
+    bloc = ocr_template_region(context, template, "bloc")
+    invoice_line = next((line for line in bloc.split('\n') if line.strip().startswith('INVOICE FAC')), '') if bloc else ''
+    file_date = '-'.join(part.strip() for part in invoice_line.split('/')[-2:]).replace(" ","") if invoice_line else None
+    date_facturation = re.search(r'Issue date (\d{4}-\d{2}-\d{2})', bloc) if bloc else None
+    date_facturation = parse_date(date_facturation.group(1)) if date_facturation else None
+    nom_client = re.search(r'Bill to (.+)', bloc) if bloc else None
+    nom_client = nom_client.group(1).strip() if nom_client else None
+    mail_client = re.search(r'Email (.+@.+\..+)', bloc) if bloc else None
+    mail_client = mail_client.group(1) if mail_client else None
+    adresse = bloc.split("Address ")[1].replace("\n", " ").strip() if bloc else None
+
+    if datetime_qr and date_facturation:
+        if parse_date(datetime_qr).date() == date_facturation.date(): # type: ignore
+            date_facturation = parse_date(datetime_qr)
+        else:
+            erreurs.append("Dates non correspondantes")
+
+    if not file_date == fac and fac: erreurs.append("Identifiants de fichiers non correspondants")
+    if not nom_client: erreurs.append("Nom non détecté")
+    if not mail_client: erreurs.append("Mail non détecté")
+    if not date_facturation: erreurs.append("Date non détectée")
+    if not adresse: erreurs.append("Adresse non détectée")
+    header = {
+        "nom_client": nom_client,
+        "mail_client": mail_client,
+        "adresse": adresse,
+        "date_facturation": date_facturation,
+        "file_date": file_date,
+    }
+    return header, erreurs
+
+def _read_items(context, template):
+    """
+    OCR the item regions and check the total. The texts of the header, already read, are kept
+    with them in the extracted texts.
+
+    Args:
+        context (ImageContext): the decoded invoice.
+        template (InvoiceTemplate): the layout of the invoice.
+
+    Returns:
+        tuple: the values read in the items and the errors of their checks.
+    """
+    erreurs = []
+    extracted_texts = process_image(context, template, names=READ_REGIONS)
+    products = [product for product in extracted_texts["Products"].split('\n') if product != "TOTAL"]
+    quantities = [quantity.split("x")[0].strip() for quantity in extracted_texts["Quantities_and_prices"].split('\n')[:-1]]
+    prices = [price.split("x")[1].strip().replace(" Euro", "") for price in extracted_texts["Quantities_and_prices"].replace("\n\n", "\n").split('\n')[:-1]]
+    total = extracted_texts["Quantities_and_prices"].split('\n')[-1].replace(" Euro", "").replace("Furo", "")
+
+    if not products: erreurs.append("Produits non détectés")
+    if not quantities: erreurs.append("Quantités non détectées")
+    if not prices: erreurs.append("Prix non détectés")
+    if total is None: erreurs.append("Total mal détecté")
 
     try:
-        extracted_texts = process_image(file, predefined_regions)
-        genre, birthdate, datetime_qr, fac = decode_qrcode(file)
-        bloc = extracted_texts["bloc"]
-        invoice_line = next((line for line in bloc.split('\n') if line.strip().startswith('INVOICE FAC')), '') if bloc else ''
-        file_date = '-'.join(part.strip() for part in invoice_line.split('/')[-2:]).replace(" ","") if invoice_line else None
-        date_facturation = re.search(r'Issue date (\d{4}-\d{2}-\d{2})', bloc) if bloc else None
-        date_facturation = parse(date_facturation.group(1), languages=["fr", "en"]) if date_facturation else None
-        nom_client = re.search(r'Bill to (.+)', bloc) if bloc else None
-        nom_client = nom_client.group(1).strip() if nom_client else None
-        mail_client = re.search(r'Email (.+@.+\..+)', bloc) if bloc else None
-        mail_client = mail_client.group(1) if mail_client else None
-        adresse = bloc.split("Address ")[1].replace("\n", " ").strip() if bloc else None
-
-        if datetime_qr and date_facturation:
-            if parse(datetime_qr, languages=["fr", "en"]).date() == date_facturation.date(): # type: ignore
-                date_facturation = parse(datetime_qr, languages=["fr", "en"])
-            else:
-                erreurs.append("Dates non correspondantes")
-
-        products = [product for product in extracted_texts["Products"].split('\n') if product != "TOTAL"]
-        quantities = [quantity.split("x")[0].strip() for quantity in extracted_texts["Quantities_and_prices"].split('\n')[:-1]]
-        prices = [price.split("x")[1].strip().replace(" Euro", "") for price in extracted_texts["Quantities_and_prices"].replace("\n\n", "\n").split('\n')[:-1]]
-        total = extracted_texts["Quantities_and_prices"].split('\n')[-1].replace(" Euro", "").replace("Furo", "")
-
-        if not file_date == fac and fac: erreurs.append("Identifiants de fichiers non correspondants")
-        if not nom_client: erreurs.append("Nom non détecté")
-        if not mail_client: erreurs.append("Mail non détecté")
-        if not date_facturation: erreurs.append("Date non détectée")
-        if not products: erreurs.append("Produits non détectés")
-        if not quantities: erreurs.append("Quantités non détectées")
-        if not prices: erreurs.append("Prix non détectés")
-        if not birthdate: erreurs.append("Date de naissance non détectée")
-        if not genre: erreurs.append("Genre non détecté")
-        if not adresse: erreurs.append("Adresse non détectée")
-        if total is None: erreurs.append("Total mal détecté")
+        total_calcule = sum(float(price) * int(quantity) for price, quantity in zip(prices, quantities))
+        total_calcule = round(total_calcule, 2)
+        total_from_invoice = round(float(total.replace(',', '.')), 2)
+        if total_from_invoice != total_calcule:
+            erreurs.append("Total non correct")
+    except Exception as e:
+        erreurs.append(f"Erreur lors du calcul du total : {str(e)}")
+    items = {
+        "total": total,
+        "products": products,
+        "quantities": quantities,
+        "prices": prices,
+        "extracted_texts": extracted_texts,
+    }
+    return items, erreurs
+
+def _escalate(template, stage, read):
+    """
+    Read a stage, moving its regions up the preprocessing cascade of the template while its checks fail.
+    Without cascade, the stage is read once with the template.
 
+    Args:
+        template (InvoiceTemplate): the template, with the levels kept by the previous stages.
+        stage (str): the name of the stage, key of CASCADE_STAGES.
+        read (callable): the reading of the stage, from a template to its values and errors.
+
+    Returns:
+        tuple: the template of the last level read, the values and the errors of the stage.
+    """
+    if not template.cascade or template.mode != "regions":
+        return (template, *read(template))
+    for level in template.cascade:
+        current = template.with_level(level, CASCADE_STAGES[stage])
         try:
-            total_calcule = sum(float(price) * int(quantity) for price, quantity in zip(prices, quantities))
-            total_calcule = round(total_calcule, 2)
-            total_from_invoice = round(float(total.replace(',', '.')), 2)
-            if total_from_invoice != total_calcule:
-                erreurs.append("Total non correct")
+            values, erreurs = read(current)
         except Exception as e:
-            erreurs.append(f"Erreur lors du calcul du total : {str(e)}")
-        
-        if erreurs:
-            return {"status": "error", "fichier": file, "data": None,"erreur": ', '.join(erreurs), "variables": None}
-
-        variables = {
-            "nom_client": nom_client,
-            "mail_client": mail_client,
-            "adresse": adresse,
-            "birthdate": birthdate,
-            "genre": genre,
-            "date_facturation": date_facturation,
-            "total": total,
-            "products": products,
-            "quantities": quantities,
-            "prices": prices,
-            "fac": fac,
-            "file_date": file_date,
-            "extracted_texts": extracted_texts
-        }
-
-        return {"status": "success", "fichier": file, "data": None, "erreur": None, "variables": variables}
+            # Texte illisible à ce niveau : seule l'erreur du dernier niveau est remontée
+            if level is template.cascade[-1]:
+                raise
+            values, erreurs = None, [str(e)]
+        cascade_stats.record(stage, level.name, failed=bool(erreurs))
+        if not erreurs:
+            break
+    return current, values, erreurs
+
+# Pool partagé par les factures du processus pour lire leurs régions en même temps : sa taille
+# fixe borne le nombre d'appels OCR simultanés, quel que soit le nombre de factures en cours
+_region_executors = {}
+_region_executors_lock = threading.Lock()
+
+def get_region_executor():
+    """
+    Get the thread pool of the concurrent region OCR of the current process, sized by the
+    OCR_REGION_THREADS environment variable (0 by default: the regions are OCR-ed one after the other).
+    The OCR engines of the process get one more engine per thread of the pool.
+
+    Returns:
+        ThreadPoolExecutor: the thread pool, None if the concurrent mode is disabled.
+    """
+    threads = int(os.getenv("OCR_REGION_THREADS", 0))
+    if threads <= 0:
+        return None
+    with _region_executors_lock:
+        executor = _region_executors.get(os.getpid())
+        if executor is None:
+            executor = _region_executors[os.getpid()] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="region")
+            # Un moteur Tesseract par thread : sinon les régions attendent un moteur libre, l'une après l'autre
+            reserve_engines("region", threads)
+    return executor
+
+def _prefetch(context, template):
+    """
+    Decode the QR code and OCR the regions read by the checks at the same time, on the pool of the
+    context, so the latency is close to that of the slowest region. The checks then read the cached
+    results; the OCR saved by an early rejection is not saved any more.
+
+    Args:
+        context (ImageContext): the decoded invoice, with its executor.
+        template (InvoiceTemplate): the layout of the invoice.
+    """
+    qrcode = context.executor.submit(decode_qrcode, context, template.qrcode_box)
+    try:
+        process_image(context, template, names=READ_REGIONS)
+    finally:
+        # Une erreur du QR code est remontée par la lecture normale, qui le décode à nouveau
+        wait([qrcode])
+
+def _extract_from_context(context, file, template):
+    """
+    Run the OCR and the checks on a decoded invoice. Unexpected errors are raised.
+    The stages go from the cheapest to the most expensive: QR code, then the "bloc" header, then
+    the items. The checks of a stage run as soon as its data is read, and a rejected invoice
+    stops there, without the OCR of the next stages. With a preprocessing cascade, the regions
+    start with the cheapest level and only those of a failed stage are read again at the next one.
+    When the context has an executor, the QR code and the regions are first read all at the same time.
+
+    Args:
+        context (ImageContext): the decoded invoice.
+        file (str): the path of the file, reported in the result.
+        template (InvoiceTemplate): the layout of the invoice.
+
+    Returns:
+        dict: the data extracted from the image, as returned by extract_data_raw.
+    """
+    erreurs = []
+    if template.cascade and template.mode == "regions":
+        template = template.with_level(template.cascade[0])
+    if context.executor is not None:
+        _prefetch(context, template)
+
+    # 1. QR code : pas d'OCR
+    genre, birthdate, datetime_qr, fac = decode_qrcode(context, template.qrcode_box)
+    if not birthdate: erreurs.append("Date de naissance non détectée")
+    if not genre: erreurs.append("Genre non détecté")
+    if erreurs:
+        return _reject(context, file, erreurs)
+
+    # 2. En-tête : une seule région
+    template, header, erreurs = _escalate(template, "header", lambda current: _read_header(context, current, datetime_qr, fac))
+    if erreurs:
+        return _reject(context, file, erreurs)
+
+    # 3. Articles : les autres régions (l'en-tête déjà reconnu n'est pas refait)
+    template, items, erreurs = _escalate(template, "items", lambda current: _read_items(context, current))
+    if erreurs:
+        return _reject(context, file, erreurs)
+
+    variables = {
+        **header,
+        **items,
+        "birthdate": birthdate,
+        "genre": genre,
+        "fac": fac,
+        # Confiance moyenne de chaque région (mode "layout" uniquement)
+        "confidences": {
+            region.name: sum(word.confidence for word in words) / len(words)
+            for region, words in context.ocr_words.items() if words
+        } or None,
+    }
+
+    return {"status": "success", "fichier": file, "data": None, "erreur": None, "variables": variables, "ocr_calls": context.ocr_calls}
+
+def extract_data_raw(file, template=None, use_cache=True, known_ids=None, concurrent=False):
+    """
+    Extract the raw data from the image.
+
+    Args:
+        file (str | ImageContext): the path of the file to extract the data from, or its already decoded context.
+        template (InvoiceTemplate): the layout of the invoice, defaults to the configured template.
+        use_cache (bool): whether to reuse the stored result of an identical image.
+        known_ids (set): the ids of the invoices already in the database. When given, the qrcode is
+            decoded first and a known invoice is returned with the "duplicate" status, without any OCR.
+        concurrent (bool): read the QR code and the regions at the same time on the shared pool of
+            get_region_executor (if enabled), for the latency of a single invoice.
+
+    Returns:
+        dict: the data extracted from the image, including status, filename, error, the number of OCR calls and a dictionary of extracted variables.
+    """
+    context = file if isinstance(file, ImageContext) else None
+    if context is not None:
+        file = context.source
+
+    try:
+        # L'image n'est décodée qu'une fois pour l'OCR et le QR code
+        if context is None:
+            context = ImageContext.from_path(file)
+        template = template or get_template()
+        if concurrent:
+            context.executor = get_region_executor()
+
+        if known_ids is not None:
+            fac = decode_qrcode(context, template.qrcode_box)[3]
+            if fac in known_ids:
+                return {"status": "duplicate", "fichier": file, "data": None, "erreur": None, "variables": {"fac": fac}, "ocr_calls": 0}
+
+        # Une image déjà traitée (même contenu, même modèle, même moteur) ne repasse pas par l'OCR
+        cache = get_cache() if use_cache and context.digest else None
+        key = OCRCache.make_key(context.digest, template, get_backend()) if cache else None
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            return dict(cached, fichier=file, ocr_calls=0)
+
+        with stage_timers.time("extraction"):
+            result = _extract_from_context(context, file, template)
+        if cache:
+            cache.put(key, {name: value for name, value in result.items() if name != "fichier"})
+        return result
 
     except Exception as e:
-        return {"status": "error", "fichier": file,"data": None, "erreur": str(e), "variables": None}
+        return {"status": "error", "fichier": file,"data": None, "erreur": str(e), "variables": None, "ocr_calls": context.ocr_calls if context else 0}
+
+def extraire_donnees_pdf(file, known_ids=None, source=None, validate_only=False):
+    """
+    Extract the data from every page of a PDF, one invoice per page. The pages are rasterized
+    one at a time at the resolution of the template and processed concurrently.
 
-def extraire_donnees(file):
+    Args:
+        file (str | bytes): the path of the PDF or its content.
+        known_ids (set): the ids of the invoices already in the database, to skip them without OCR.
+        source (str): the name of the PDF, used in the results.
+        validate_only (bool): only check the pages, see extraire_donnees.
+
+    Returns:
+        dict: the data of all the pages, in dataframes like extraire_donnees, and the status of each page.
+            The status is "error" as soon as one page is in error.
+    """
+    source = source or (file if isinstance(file, str) else "document.pdf")
+    try:
+        template = get_template()
+        results = map_pages(file, template.dpi, lambda context: extraire_donnees(context, known_ids=known_ids, validate_only=validate_only), source=source)
+    except Exception as e:
+        return {"status": "error", "fichier": source, "data": None, "erreur": str(e), "ocr_calls": 0, "pages": []}
+
+    pages = [{"fichier": result["fichier"], "status": result["status"], "erreur": result["erreur"]} for result in results]
+    ocr_calls = sum(result.get("ocr_calls", 0) for result in results)
+    erreurs = [f"{result['fichier']} : {result['erreur']}" for result in results if result["status"] == "error"]
+    if not results:
+        erreurs.append("Le PDF ne contient aucune page")
+    if validate_only:
+        status = "error" if erreurs else "success"
+        return {"status": status, "fichier": source, "data": None, "erreur": ', '.join(erreurs) or None, "erreurs": erreurs, "ocr_calls": ocr_calls, "pages": pages}
+    if erreurs:
+        return {"status": "error", "fichier": source, "data": None, "erreur": ', '.join(erreurs), "ocr_calls": ocr_calls, "pages": pages}
+
+    successes = [result["data"] for result in results if result["status"] == "success"]
+    if not successes:
+        return {"status": "duplicate", "fichier": source, "data": None, "erreur": None, "ocr_calls": ocr_calls, "pages": pages}
+    retour = tuple(pd.concat(frames, ignore_index=True) for frames in zip(*successes))
+    return {"status": "success", "fichier": source, "data": retour, "erreur": None, "ocr_calls": ocr_calls, "pages": pages}
+
+def extraire_donnees(file, known_ids=None, validate_only=False, concurrent=False):
     """
     Extract the data from the image and return it in dataframes.
 
     Args:
-        file (str): the path of the file to extract the data from.
+        file (str | ImageContext): the path of the file to extract the data from, or its already decoded context.
+            A PDF is handled by extraire_donnees_pdf, one invoice per page.
+        known_ids (set): the ids of the invoices already in the database, to skip them without OCR.
+        validate_only (bool): only check the invoice: the list of the errors is returned in "erreurs",
+            without building the dataframes.
+        concurrent (bool): read the QR code and the regions of an image at the same time (see extract_data_raw).
+            The pages of a PDF are already processed at the same time, so their regions are not.
 
     Returns:
         dict: the data extracted from the image, in dataframes: client, facture, produit, achat , the status, the errors and the file name.
     """
-    raw_data = extract_data_raw(file)
-    if raw_data["status"] == "error":
+    if is_pdf(file):
+        return extraire_donnees_pdf(file, known_ids=known_ids, validate_only=validate_only)
+    raw_data = extract_data_raw(file, known_ids=known_ids, concurrent=concurrent)
+    if validate_only:
+        erreurs = raw_data.get("erreurs") or ([raw_data["erreur"]] if raw_data["erreur"] else [])
+        return {"status": raw_data["status"], "fichier": raw_data["fichier"], "data": None, "erreur": raw_data["erreur"], "erreurs": erreurs, "ocr_calls": raw_data["ocr_calls"]}
+    if raw_data["status"] != "success":
         return raw_data
 
     variables = raw_data["variables"]
@@ -277,50 +794,9 @@ def extraire_donnees(file):
     })
 
     retour =  df_client, df_facture, df_produit, df_achat
-    return {"status": "success", "fichier": file, "data": retour, "erreur": None}
+    return {"status": "success", "fichier": raw_data["fichier"], "data": retour, "erreur": None, "ocr_calls": raw_data["ocr_calls"]}
 
 
 if __name__ == "__main__":
-    from app.app.utils.database import add_data
-    load_dotenv()
-    blob_keys = os.getenv("AZURE_BLOB_KEYS")
-    all_files = get_all_files(blob_keys)
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise ValueError("DATABASE_URL environment variable not set")
-    engine = create_engine(database_url)
-    start_time = time.time()
-    all_errors = []
-    
-    print("Début du traitement")
-
-    for i, filename in enumerate(all_files, start=1):
-        chemin = f"data/files/{filename.split('_')[1]}/{filename}"
-        extract = extraire_donnees(chemin)
-        status = extract["status"]
-        file = extract["fichier"]
-        erreur = extract["erreur"]
-        data = extract["data"]
-        if erreur:
-            print(f"Echec du fichier : {file}, erreur : {erreur}")
-            all_errors.append({
-                "time": datetime.datetime.now(),
-                "fichier": filename,
-                "erreur": erreur
-            })
-        if data:
-            df_client, df_facture, df_produit, df_achat = data
-            add_data(engine, "client", df_client)
-            add_data(engine, "facture", df_facture)
-            add_data(engine, "produit", df_produit)
-            add_data(engine,  "achat", df_achat)
-            
-        if i % 100 == 0:
-            elapsed_time = time.time() - start_time
-            print(f"{i} fichiers traités en {elapsed_time:.2f} secondes")
-
-    print("\nTraitement terminé")
-    if all_errors:
-        df_errors = pd.DataFrame(all_errors)
-        add_data(engine, "log", df_errors)
-        print(f"Nombre d'erreurs : {len(df_errors)}")
+    from app.app.utils.batch import main
+    main()
@@ -7,23 +7,91 @@ import sys
 import sys
 import os
 import json
+import hashlib
+import threading
+import time
+import zipfile
+import pandas as pd
 from datetime import timedelta
 from typing import Optional
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app.app.utils.database import create_tables, add_user, add_data, engine, add_log
-from app.app.utils.extract_data import extraire_donnees
+from app.app.utils.extract_data import extraire_donnees, extraire_donnees_pdf
+from app.app.utils.image_context import ImageContext
+from app.app.utils.monitoring import stage_timers
+from app.app.utils.pdf import is_pdf
 from app.app.auth import auth
 from app.app.auth.auth import authenticate_user, create_access_token, get_current_active_user, get_current_user
 from app.app.auth.models import User
 from app.app.auth.models import Token
 
+# Les envois sont lus par morceaux, sans passer par le disque
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", 20)) * 1024 * 1024
+# Limites d'un envoi de plusieurs factures (/process/batch), archives zip décompressées comprises
+UPLOAD_MAX_TOTAL_BYTES = int(os.getenv("UPLOAD_MAX_TOTAL_MB", 1024)) * 1024 * 1024
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", 1000))
+# Conservation optionnelle des factures reçues, sous un nom dérivé de leur contenu
+KEEP_UPLOADS = os.getenv("KEEP_UPLOADS", "0") == "1"
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "temp/uploads")
+UPLOAD_RETENTION = float(os.getenv("UPLOAD_RETENTION_HOURS", 24)) * 3600
+_last_sweep = 0.0
+
+async def read_uploaded_file(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> bytes:
+    """Reads the uploaded file by chunks into memory."""
+    buffer = bytearray()
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes // (1024 * 1024)} MB)")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read file: {str(e)}")
+    return bytes(buffer)
+
+def sweep_uploads(directory: Optional[str] = None, retention: float = UPLOAD_RETENTION) -> int:
+    """Deletes the kept uploads older than the retention time and returns the number of deleted files."""
+    directory = directory or UPLOAD_DIR
+    deleted = 0
+    limit = time.time() - retention
+    for entry in os.scandir(directory) if os.path.isdir(directory) else []:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < limit:
+                os.remove(entry.path)
+                deleted += 1
+        except FileNotFoundError:
+            pass
+    return deleted
+
+def store_upload(content: bytes, filename: str, directory: Optional[str] = None) -> str:
+    """Writes the content of an upload to a content-addressed file, sweeping the old uploads from time to time."""
+    global _last_sweep
+    directory = directory or UPLOAD_DIR
+    os.makedirs(directory, exist_ok=True)
+    extension = os.path.splitext(filename or "")[1].lower()
+    if not extension[1:].isalnum():
+        extension = ""
+    file_location = os.path.join(directory, hashlib.sha256(content).hexdigest() + extension)
+    if os.path.exists(file_location):
+        os.utime(file_location)
+    else:
+        # Écriture atomique : deux envois simultanés du même fichier ne se gênent pas
+        tmp_location = f"{file_location}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_location, "wb") as f:
+            f.write(content)
+        os.replace(tmp_location, file_location)
+    if time.time() - _last_sweep > 600:
+        _last_sweep = time.time()
+        sweep_uploads(directory)
+    return file_location
+
 async def save_uploaded_file(file: UploadFile) -> str:
-    """Saves the uploaded file to a temporary location."""
-    os.makedirs("temp", exist_ok=True)
-    file_location = f"temp/{file.filename}"
+    """Saves the uploaded file under a content-addressed name and returns its location."""
+    content = await read_uploaded_file(file)
     try:
-        with open(file_location, "wb") as f:
-            f.write(file.file.read())
+        file_location = store_upload(content, file.filename)
         print(f"File saved at {file_location}")
         return file_location
     except Exception as e:
@@ -38,13 +106,97 @@ def add_data_to_database(engine, extract_result: dict):
     """Adds the extracted data to the database."""
     if extract_result["status"] == "success":
         df_client, df_facture, df_produit, df_achat = extract_result["data"]
-        add_data(engine, "client", df_client)
-        add_data(engine, "facture", df_facture)
-        add_data(engine, "produit", df_produit)
-        add_data(engine, "achat", df_achat)
+        with stage_timers.time("db"):
+            for table_name, df in zip(TABLE_KEYS, (df_client, df_facture, df_produit, df_achat)):
+                with stage_timers.time(f"db:{table_name}"):
+                    add_data(engine, table_name, df)
     else:
         raise HTTPException(status_code=400, detail=extract_result["erreur"])
 
+def process_uploaded_file(engine, content: bytes, filename: str, validate_only: bool = False) -> dict:
+    """Extracts the data of an uploaded file, adds it to the database and returns it in JSON format (run by the OCR workers).
+    With validate_only, only the list of the errors is returned and nothing is added to the database."""
+    if KEEP_UPLOADS:
+        store_upload(content, filename)
+    # Une seule facture attendue par le client : ses régions sont lues en même temps
+    extract_result = extract_data_from_bytes(content, filename, validate_only=validate_only, concurrent=True)
+    if validate_only:
+        return {"status": extract_result["status"], "erreur": extract_result["erreur"], "data": {"erreurs": extract_result["erreurs"]}}
+    if "erreur" in extract_result and extract_result["erreur"]:
+        return {"status": "error", "erreur": extract_result["erreur"], "data": None}
+    add_data_to_database(engine, extract_result)
+    data = convert_dataframes_to_json(extract_result)
+    return {"status": "success", "erreur": None, "data": data}
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".pdf")
+
+# Clés des tables, pour dédoublonner les données d'un lot avant de les enregistrer
+TABLE_KEYS = {
+    "client": ["id_client"],
+    "facture": ["id_facture"],
+    "produit": ["id_produit"],
+    "achat": ["id_produit", "id_client", "id_facture"],
+}
+
+def _read_limited(stream, max_bytes: int) -> bytes:
+    """Reads a file, or a member of a zip archive, raising a 413 error above max_bytes."""
+    content = stream.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes // (1024 * 1024)} MB)")
+    return content
+
+def iter_uploaded_files(files, max_bytes: int = UPLOAD_MAX_BYTES, max_total_bytes: int = UPLOAD_MAX_TOTAL_BYTES,
+                        max_files: int = UPLOAD_MAX_FILES):
+    """Yields the (filename, content) of the uploaded images and PDF, those of the zip archives included.
+    Each file is limited to max_bytes, and all of them to max_total_bytes and max_files: a 413 error is raised
+    above a limit. The members of the archives are decompressed one at a time, their declared size is not trusted."""
+    count = 0
+    total = 0
+
+    def read(filename, stream):
+        nonlocal count, total
+        count += 1
+        if count > max_files:
+            raise HTTPException(status_code=413, detail=f"Too many files (max {max_files})")
+        content = _read_limited(stream, max_bytes)
+        total += len(content)
+        if total > max_total_bytes:
+            raise HTTPException(status_code=413, detail=f"Files too large (max {max_total_bytes // (1024 * 1024)} MB in total)")
+        return filename, content
+
+    for file in files:
+        if file.filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(file.file) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and member.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        with archive.open(member) as stream:
+                            yield read(os.path.basename(member.filename), stream)
+        else:
+            yield read(file.filename, file.file)
+
+def extract_data_from_bytes(content: bytes, filename: str, validate_only: bool = False, concurrent: bool = False) -> dict:
+    """Extracts data from the content of an image or PDF file, without writing the image to disk.
+    With concurrent, the regions of an image are OCR-ed at the same time (OCR_REGION_THREADS)."""
+    if is_pdf(content):
+        return extraire_donnees_pdf(content, source=filename, validate_only=validate_only)
+    try:
+        context = ImageContext.from_bytes(content, source=filename)
+    except ValueError as e:
+        return {"status": "error", "fichier": filename, "data": None, "erreur": str(e), "erreurs": [str(e)]}
+    return extraire_donnees(context, validate_only=validate_only, concurrent=concurrent)
+
+def add_batch_to_database(engine, extract_results: list):
+    """Adds the extracted data of several invoices to the database, with one write per table."""
+    tables = [[], [], [], []]
+    for extract_result in extract_results:
+        for frames, df in zip(tables, extract_result["data"]):
+            frames.append(df)
+    with stage_timers.time("db_batch"):
+        for (table_name, keys), frames in zip(TABLE_KEYS.items(), tables):
+            if frames:
+                with stage_timers.time(f"db_batch:{table_name}"):
+                    add_data(engine, table_name, pd.concat(frames, ignore_index=True).drop_duplicates(subset=keys))
+
 def convert_dataframes_to_json(extract_result: dict) -> Optional[dict]:
     """Converts the extracted dataframes to JSON format."""
     if extract_result["status"] == "success":
@@ -0,0 +1,245 @@
+import hashlib
+import threading
+import cv2
+import numpy as np
+from app.app.utils.monitoring import stage_timers
+
+# Objets et buffers réutilisés d'une facture à l'autre, un jeu par thread
+# (les objets CLAHE d'OpenCV ne sont pas thread-safe)
+_local = threading.local()
+
+
+def get_clahe(clip_limit=2.0, tile_grid_size=(10, 10)):
+    """
+    Get the CLAHE object of the current thread for the given parameters, created only once.
+
+    Args:
+        clip_limit (float): the contrast limit of the CLAHE.
+        tile_grid_size (tuple): the size of the grid of the CLAHE.
+
+    Returns:
+        cv2.CLAHE: the CLAHE object.
+    """
+    cache = getattr(_local, "clahe", None)
+    if cache is None:
+        cache = _local.clahe = {}
+    key = (float(clip_limit), tuple(tile_grid_size))
+    clahe = cache.get(key)
+    if clahe is None:
+        clahe = cache[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tuple(tile_grid_size))
+    return clahe
+
+
+def scratch_buffer(key, shape, dtype=np.uint8):
+    """
+    Get a scratch buffer of the current thread, reused as long as the shape does not change.
+
+    The content of the buffer is overwritten by the next call with the same key,
+    so it must be consumed (by the OCR engine for example) before that.
+
+    Args:
+        key (str): the name of the buffer (for example the region name).
+        shape (tuple): the shape of the buffer.
+        dtype (np.dtype): the type of the buffer.
+
+    Returns:
+        np.ndarray: the buffer.
+    """
+    buffers = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    buffer = buffers.get(key)
+    if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+        buffer = buffers[key] = np.empty(shape, dtype=dtype)
+    return buffer
+
+
+class ImageContext:
+    """
+    Image of one invoice, decoded only once and shared by all the extraction stages.
+    """
+
+    def __init__(self, image, source=None, digest=None):
+        """
+        Initialize the context from a decoded image.
+
+        Args:
+            image (np.ndarray): the decoded image, in grayscale or BGR.
+            source (str): the path or name of the image, used in the results.
+            digest (str): the SHA-256 of the content of the image file, if known.
+        """
+        if image is None:
+            raise ValueError(f"Impossible de lire l'image : {source}")
+        if image.ndim == 3:
+            # Une seule conversion en niveaux de gris pour toute la facture
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+        self.gray = image
+        self.source = source
+        self.digest = digest
+        # Textes déjà reconnus, par région : une seule passe OCR par région et par facture
+        self.ocr_texts = {}
+        self.ocr_calls = 0
+        # Mode "layout" : mots reconnus sur la page entière, puis mots de chaque région (avec leur confiance)
+        self.page_words = None
+        self.ocr_words = {}
+        # Contenu des QR codes déjà décodés, par région
+        self.qrcodes = {}
+        # Pool des appels OCR simultanés de la facture (None : les régions sont lues l'une après l'autre)
+        self.executor = None
+
+    @classmethod
+    def from_path(cls, path):
+        """
+        Decode the image at the given path.
+
+        Args:
+            path (str): the path of the image.
+
+        Returns:
+            ImageContext: the context of the image.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        return cls.from_bytes(data, source=path)
+
+    @classmethod
+    def from_bytes(cls, data, source=None):
+        """
+        Decode an image from an encoded buffer (PNG, JPEG...).
+
+        Args:
+            data (bytes): the content of the image file.
+            source (str): the path or name of the image.
+
+        Returns:
+            ImageContext: the context of the image.
+        """
+        with stage_timers.time("decode"):
+            buffer = np.frombuffer(data, dtype=np.uint8)
+            # IMREAD_ANYCOLOR garde les images déjà en niveaux de gris sans conversion
+            image = cv2.imdecode(buffer, cv2.IMREAD_ANYCOLOR) if buffer.size else None
+            return cls(image, source=source, digest=hashlib.sha256(data).hexdigest())
+
+    @classmethod
+    def ensure(cls, image):
+        """
+        Get a context from a path or an existing context.
+
+        Args:
+            image (str | ImageContext): the path of the image or its context.
+
+        Returns:
+            ImageContext: the context of the image.
+        """
+        if isinstance(image, cls):
+            return image
+        return cls.from_path(image)
+
+    @property
+    def shape(self):
+        return self.gray.shape
+
+    def roi(self, box):
+        """
+        Get a view (without copy) of a region of the image.
+
+        Args:
+            box (tuple): the region (x, y, w, h) in pixels of the original image.
+
+        Returns:
+            np.ndarray: the view of the region.
+        """
+        x, y, w, h = box
+        return self.gray[y:y+h, x:x+w]
+
+    def ink_box(self, box, margin=10, min_contrast=32, min_pixels=2):
+        """
+        Shrink a region to the bounding box of its ink, from the projection profiles of the
+        binarized region (number of ink pixels of each row and column).
+
+        Args:
+            box (tuple): the region (x, y, w, h) in pixels of the original image.
+            margin (int): the white margin kept around the ink, in pixels.
+            min_contrast (int): the minimum difference between the darkest and the lightest
+                pixel of a region with ink.
+            min_pixels (int): the minimum number of ink pixels of a row or column, to ignore isolated specks.
+
+        Returns:
+            tuple: the shrunk region (x, y, w, h), None if the region has no ink.
+        """
+        roi = self.roi(box)
+        if roi.size == 0 or int(roi.max()) - int(roi.min()) < min_contrast:
+            return None
+        _, ink = cv2.threshold(roi, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        rows = np.flatnonzero(np.count_nonzero(ink, axis=1) >= min_pixels)
+        columns = np.flatnonzero(np.count_nonzero(ink, axis=0) >= min_pixels)
+        if not len(rows) or not len(columns):
+            return None
+        height, width = roi.shape
+        top, bottom = max(rows[0] - margin, 0), min(rows[-1] + 1 + margin, height)
+        left, right = max(columns[0] - margin, 0), min(columns[-1] + 1 + margin, width)
+        x, y = box[0], box[1]
+        return (int(x + left), int(y + top), int(right - left), int(bottom - top))
+
+    def ink_rows(self, boxes, min_pixels=2, max_gap=2, min_height=4, min_contrast=32):
+        """
+        Find the lines of text of regions side by side (the columns of a table), from the
+        projection profile of their ink on the vertical axis: a line is found once for all the columns.
+
+        Args:
+            boxes (list): the regions (x, y, w, h), with the same y and h.
+            min_pixels (int): the minimum number of ink pixels of a row of pixels.
+            max_gap (int): the maximum number of blank rows of pixels inside a line (the dots of the "i").
+            min_height (int): the minimum height of a line, to ignore the horizontal rules.
+            min_contrast (int): the minimum difference between the darkest and the lightest
+                pixel of a region with ink.
+
+        Returns:
+            list: the (top, bottom) of the lines, in pixels of the original image.
+        """
+        y, h = boxes[0][1], boxes[0][3]
+        if any((box[1], box[3]) != (y, h) for box in boxes):
+            raise ValueError("Les colonnes doivent avoir la même hauteur")
+        profile = np.zeros(min(h, self.gray.shape[0] - y), dtype=np.int64)
+        for box in boxes:
+            roi = self.roi(box)
+            if roi.size == 0 or int(roi.max()) - int(roi.min()) < min_contrast:
+                continue
+            _, ink = cv2.threshold(roi, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+            profile += np.count_nonzero(ink, axis=1)
+        lines = []
+        for row in np.flatnonzero(profile >= min_pixels):
+            if lines and row - lines[-1][1] <= max_gap:
+                lines[-1][1] = row + 1
+            else:
+                lines.append([row, row + 1])
+        return [(int(y + top), int(y + bottom)) for top, bottom in lines if bottom - top >= min_height]
+
+    def scaled_roi(self, box, scale_factor, key=None, interpolation=cv2.INTER_LINEAR):
+        """
+        Get a region of the image enlarged by the given factor.
+
+        Only the region (and a margin of one pixel) is resized, so the result is the
+        same as resizing the whole image and cropping afterwards.
+
+        Args:
+            box (tuple): the region (x, y, w, h) in pixels of the original image.
+            scale_factor (float): the scale factor.
+            key (str): the name of the scratch buffer to reuse, if any.
+            interpolation (int): the OpenCV interpolation.
+
+        Returns:
+            np.ndarray: the enlarged region.
+        """
+        if scale_factor == 1:
+            return self.roi(box)
+        x, y, w, h = box
+        height, width = self.gray.shape
+        x0, y0 = max(x - 1, 0), max(y - 1, 0)
+        x1, y1 = min(x + w + 1, width), min(y + h + 1, height)
+        new_size = (int((x1 - x0) * scale_factor), int((y1 - y0) * scale_factor))
+        dst = scratch_buffer(key, (new_size[1], new_size[0])) if key else None
+        enlarged = cv2.resize(self.gray[y0:y1, x0:x1], new_size, dst=dst, interpolation=interpolation)
+        left, top = int((x - x0) * scale_factor), int((y - y0) * scale_factor)
+        right, bottom = int(min(x + w, width) * scale_factor) - int(x0 * scale_factor), int(min(y + h, height) * scale_factor) - int(y0 * scale_factor)
+        return enlarged[top:bottom, left:right]
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+from app.app.utils.ocr_backends import reserve_engines
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are waiting for the OCR workers"""
+
+
+class JobManager:
+    """
+    Run the OCR jobs on a bounded pool of threads, outside of the event loop.
+    Tesseract runs in C (or in a subprocess) and releases the GIL, so threads are enough.
+    The results are kept in memory for `ttl` seconds: the job ids are only valid in the
+    uvicorn worker that created them.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32, ttl: float = 3600, max_jobs: int = 1000):
+        """
+        Initialize the job manager
+
+        Args:
+            workers: Number of OCR threads
+            max_pending: Maximum number of jobs waiting or running at the same time
+            ttl: Time in seconds a finished job is kept
+            max_jobs: Maximum number of jobs kept in memory
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
+        # Un moteur Tesseract par thread OCR : les factures ne s'attendent pas pour un moteur libre
+        reserve_engines("ocr", workers)
+        self.jobs: Dict[str, Dict[str, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, func, *args) -> str:
+        """
+        Submit a job to the OCR workers
+
+        Args:
+            func: Function returning the result dict ({"status", "erreur", "data"})
+            *args: Arguments of the function
+
+        Returns:
+            The id of the job
+
+        Raises:
+            QueueFullError: If `max_pending` jobs are already waiting
+        """
+        with self.lock:
+            self._sweep()
+            if self.pending >= self.max_pending:
+                raise QueueFullError(f"Trop de traitements en attente ({self.pending}), réessayez plus tard")
+            self.pending += 1
+            job_id = uuid.uuid4().hex
+            job = {"job_id": job_id, "status": "pending", "created_at": time.time(), "finished_at": None, "result": None}
+            self.jobs[job_id] = job
+            job["future"] = self.executor.submit(self._run, job, func, *args)
+        return job_id
+
+    def run(self, func, *args):
+        """
+        Run a function on the OCR workers, without keeping a job (used by the batch endpoint).
+        The function counts as a pending job until it ends, so the batches and the single
+        invoices share the `max_pending` bound.
+
+        Args:
+            func: Function to run
+            *args: Arguments of the function
+
+        Returns:
+            An asyncio future of the result
+
+        Raises:
+            QueueFullError: If `max_pending` jobs are already waiting
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise QueueFullError(f"Trop de traitements en attente ({self.pending}), réessayez plus tard")
+            self.pending += 1
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self._release)
+        return asyncio.wrap_future(future)
+
+    def _release(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def _run(self, job, func, *args):
+        job["status"] = "running"
+        try:
+            result = func(*args)
+        except Exception as e:
+            logger.exception(f"Erreur du traitement {job['job_id']}")
+            result = {"status": "error", "erreur": str(e), "data": None}
+        with self.lock:
+            job["result"] = result
+            job["status"] = result.get("status", "success")
+            job["finished_at"] = time.time()
+            self.pending -= 1
+        return result
+
+    def _sweep(self):
+        # Supprime les traitements terminés trop anciens (appelé avec le verrou)
+        now = time.time()
+        for job_id in list(self.jobs):
+            job = self.jobs[job_id]
+            finished = job["finished_at"] is not None
+            if finished and (now - job["finished_at"] > self.ttl or len(self.jobs) > self.max_jobs):
+                del self.jobs[job_id]
+
+    def get(self, job_id: str):
+        """
+        Get the state of a job
+
+        Args:
+            job_id: The id of the job
+
+        Returns:
+            The job ({"job_id", "status", "erreur", "data"}), None if the job is unknown
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            result = job["result"] or {}
+            return {
+                "job_id": job_id,
+                "status": job["status"],
+                "erreur": result.get("erreur"),
+                "data": result.get("data"),
+            }
+
+    async def wait(self, job_id: str, timeout: float):
+        """
+        Wait for the end of a job without blocking the event loop
+
+        Args:
+            job_id: The id of the job
+            timeout: Maximum time to wait in seconds
+
+        Returns:
+            The job (see `get`), still "pending" or "running" if the timeout expired
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if timeout > 0 and not job["future"].done():
+            # asyncio.wait n'annule pas le traitement quand le délai expire
+            await asyncio.wait({asyncio.wrap_future(job["future"])}, timeout=timeout)
+        return self.get(job_id)
+
+    def get_statistics(self):
+        """
+        Get the statistics of the OCR workers
+
+        Returns:
+            The number of workers, of pending jobs and of jobs kept in memory
+        """
+        with self.lock:
+            return {"workers": self.workers, "pending": self.pending, "max_pending": self.max_pending, "jobs": len(self.jobs)}
+
+
+job_manager = JobManager(
+    workers=int(os.getenv("OCR_WORKERS", 2)),
+    max_pending=int(os.getenv("OCR_MAX_PENDING", 32)),
+    ttl=float(os.getenv("OCR_JOB_TTL", 3600)),
+)
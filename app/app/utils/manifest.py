@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import time
+
+
+class Manifest:
+    """
+    Local record of the invoices of a batch run: status, hash, duration and error of each file,
+    written as the files are processed so an interrupted run can be resumed.
+    """
+
+    def __init__(self, path):
+        """
+        Open (or create) the manifest.
+
+        Args:
+            path (str): the path of the SQLite file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "filename TEXT PRIMARY KEY, path TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', "
+            "sha256 TEXT, duration REAL, error TEXT, updated_at REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_status ON files (status)")
+        self.connection.commit()
+
+    def add_files(self, files):
+        """
+        Add new files to the manifest, as pending. Files already known are kept as they are.
+
+        Args:
+            files (iterable): the (filename, path) of the files.
+
+        Returns:
+            int: the number of new files.
+        """
+        before = self.connection.total_changes
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO files (filename, path, updated_at) VALUES (?, ?, ?)",
+            ((filename, path, time.time()) for filename, path in files),
+        )
+        self.connection.commit()
+        return self.connection.total_changes - before
+
+    def files_to_process(self, retry_failed=False, only_failed=False):
+        """
+        Get the files still to process.
+
+        Args:
+            retry_failed (bool): whether to include the files that failed.
+            only_failed (bool): whether to return only the files that failed.
+
+        Returns:
+            list: the (filename, path) of the files.
+        """
+        if only_failed:
+            statuses = ("error",)
+        elif retry_failed:
+            statuses = ("pending", "error")
+        else:
+            statuses = ("pending",)
+        placeholders = ", ".join("?" for _ in statuses)
+        return self.connection.execute(
+            f"SELECT filename, path FROM files WHERE status IN ({placeholders}) ORDER BY filename", statuses
+        ).fetchall()
+
+    def record(self, filename, status, sha256=None, duration=None, error=None):
+        """
+        Record the result of a file.
+
+        Args:
+            filename (str): the name of the file.
+            status (str): the status of the extraction ("success" or "error").
+            sha256 (str): the hash of the content of the file.
+            duration (float): the duration of the extraction in seconds.
+            error (str): the error, if any.
+        """
+        self.connection.execute(
+            "UPDATE files SET status = ?, sha256 = ?, duration = ?, error = ?, updated_at = ? WHERE filename = ?",
+            (status, sha256, duration, error, time.time(), filename),
+        )
+        self.connection.commit()
+
+    def summary(self):
+        """
+        Count the files by status.
+
+        Returns:
+            dict: the number of files of each status.
+        """
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+    def close(self):
+        self.connection.close()
@@ -1,7 +1,9 @@
 import time
 import threading
 import logging
+from bisect import bisect_left
 from collections import deque, defaultdict
+from contextlib import contextmanager
 from typing import Dict, List, Deque, Any
 
 logger = logging.getLogger(__name__)
@@ -153,4 +155,92 @@ class APIMonitor:
         return ", ".join(parts)
 
 # Create a global monitor instance
-monitor = APIMonitor()
\ No newline at end of file
+monitor = APIMonitor()
+
+class StageTimers:
+    """Always-on timers of the stages of the OCR pipeline (decode, preprocessing, OCR, qrcode, database...)"""
+
+    # Bornes des intervalles de l'histogramme, en secondes
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+
+    def __init__(self):
+        """
+        Initialize the stage timers
+        """
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, Any]] = defaultdict(
+            lambda: {"count": 0, "total_time": 0.0, "max_time": 0.0, "buckets": [0] * (len(self.BUCKETS) + 1)}
+        )
+
+    def record(self, stage: str, duration: float) -> None:
+        """
+        Record the duration of one run of a stage
+
+        Args:
+            stage: Name of the stage
+            duration: Duration in seconds
+        """
+        with self.lock:
+            data = self.stages[stage]
+            data["count"] += 1
+            data["total_time"] += duration
+            data["max_time"] = max(data["max_time"], duration)
+            data["buckets"][bisect_left(self.BUCKETS, duration)] += 1
+
+    @contextmanager
+    def time(self, stage: str):
+        """
+        Time the enclosed block as one run of a stage
+
+        Args:
+            stage: Name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def _percentile(self, data: Dict[str, Any], percentile: float) -> float:
+        # Borne supérieure de l'intervalle qui contient le percentile
+        rank = percentile * data["count"]
+        seen = 0
+        for bound, count in zip(self.BUCKETS, data["buckets"]):
+            seen += count
+            if seen >= rank:
+                return min(bound, data["max_time"])
+        return data["max_time"]
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """
+        Get the statistics of each stage
+
+        Returns:
+            Dictionary with the count, total, mean, max, p50 and p95 times and the histogram of each stage
+        """
+        with self.lock:
+            return {
+                stage: {
+                    "count": data["count"],
+                    "total_time": data["total_time"],
+                    "avg_time": data["total_time"] / data["count"],
+                    "max_time": data["max_time"],
+                    "p50_time": self._percentile(data, 0.5),
+                    "p95_time": self._percentile(data, 0.95),
+                    "histogram": {
+                        **{f"<={bound}s": count for bound, count in zip(self.BUCKETS, data["buckets"])},
+                        f">{self.BUCKETS[-1]}s": data["buckets"][-1],
+                    },
+                }
+                for stage, data in sorted(self.stages.items())
+            }
+
+    def reset(self) -> None:
+        """
+        Reset the timers
+        """
+        with self.lock:
+            self.stages.clear()
+
+# Create a global stage timers instance
+stage_timers = StageTimers()
@@ -0,0 +1,485 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+import numpy as np
+import pytesseract
+
+try:
+    import tesserocr # type: ignore
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class OCRWord:
+    """
+    One word recognized by a page-level OCR pass.
+
+    Attributes:
+        text (str): the text of the word.
+        confidence (float): the confidence of Tesseract, from 0 to 100.
+        box (tuple): the box (x, y, w, h) of the word in pixels of the OCR-ed image.
+        line (tuple): the (block, paragraph, line) numbers of the line of the word.
+    """
+    text: str
+    confidence: float
+    box: tuple
+    line: tuple
+
+
+class OCRBackend:
+    """Interface of the OCR engines used by the extraction"""
+
+    name = "base"
+    # Vrai pour les moteurs qui reconnaissent un lot d'images en un seul appel du modèle
+    batching = False
+
+    def image_to_string(self, image, psm=6, whitelist=None):
+        """
+        Recognize the text of a preprocessed image.
+
+        Args:
+            image (np.ndarray): the image, in grayscale (uint8).
+            psm (int): the Tesseract page segmentation mode.
+            whitelist (str): the allowed characters, if any.
+
+        Returns:
+            str: the recognized text.
+        """
+        raise NotImplementedError
+
+    def recognize_batch(self, images, psm=6, whitelist=None):
+        """
+        Recognize the text of several preprocessed images, e.g. all the regions of an invoice.
+        The engines that run a batch faster than its images one by one override it.
+
+        Args:
+            images (list): the images, in grayscale (uint8).
+            psm (int): the Tesseract page segmentation mode.
+            whitelist (str): the allowed characters, if any.
+
+        Returns:
+            list: the recognized texts, in the order of the images.
+        """
+        return [self.image_to_string(image, psm=psm, whitelist=whitelist) for image in images]
+
+    def image_to_data(self, image, psm=3):
+        """
+        Recognize the words of a whole page, with their boxes and confidences.
+
+        Args:
+            image (np.ndarray): the image, in grayscale (uint8).
+            psm (int): the Tesseract page segmentation mode.
+
+        Returns:
+            list: the OCRWord of the page, in reading order.
+        """
+        raise NotImplementedError
+
+    def version(self):
+        """
+        Get the version of the engine, used to invalidate the stored results.
+
+        Returns:
+            str: the name and the version of the engine.
+        """
+        return self.name
+
+    def reserve(self, threads):
+        """
+        Make sure `threads` threads can run the OCR at the same time. Only the engines with a
+        fixed pool (tesserocr) need it: the other ones serve any number of threads.
+
+        Args:
+            threads (int): the number of threads of the process that may run the OCR at the same time.
+        """
+
+
+class PytesseractBackend(OCRBackend):
+    """Tesseract through pytesseract: one `tesseract` process per call"""
+
+    name = "pytesseract"
+    _version = None
+
+    def image_to_string(self, image, psm=6, whitelist=None):
+        config = f"--psm {psm}"
+        if whitelist:
+            config += f" -c tessedit_char_whitelist={whitelist}"
+        return pytesseract.image_to_string(image, config=config)
+
+    def image_to_data(self, image, psm=3):
+        data = pytesseract.image_to_data(image, config=f"--psm {psm}", output_type=pytesseract.Output.DICT)
+        return [
+            OCRWord(
+                text=text,
+                confidence=float(conf),
+                box=(data["left"][i], data["top"][i], data["width"][i], data["height"][i]),
+                line=(data["block_num"][i], data["par_num"][i], data["line_num"][i]),
+            )
+            for i, (text, conf) in enumerate(zip(data["text"], data["conf"]))
+            if text.strip() and float(conf) >= 0
+        ]
+
+    def version(self):
+        # Lancer `tesseract --version` une seule fois
+        if self._version is None:
+            self._version = f"{self.name}-{pytesseract.get_tesseract_version()}"
+        return self._version
+
+
+class TesserocrBackend(OCRBackend):
+    """
+    Tesseract through its C API (tesserocr): the engines are created once per process,
+    the language model is loaded once and the images are passed as raw buffers.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, lang="eng", pool_size=1):
+        """
+        Initialize the pool of engines.
+
+        Args:
+            lang (str): the Tesseract language.
+            pool_size (int): the number of engines, i.e. the number of threads able to run OCR at the same time.
+        """
+        if tesserocr is None:
+            raise ImportError("tesserocr n'est pas installé")
+        self.lang = lang
+        self.pool_size = 0
+        self._engines = queue.Queue()
+        self._lock = threading.Lock()
+        self.reserve(pool_size)
+
+    def reserve(self, threads):
+        # Le pool ne fait que grandir : les moteurs prêtés restent valides
+        with self._lock:
+            while self.pool_size < threads:
+                self._engines.put(tesserocr.PyTessBaseAPI(lang=self.lang))
+                self.pool_size += 1
+
+    @contextmanager
+    def engine(self):
+        """Borrow an engine of the pool for the duration of the block"""
+        api = self._engines.get()
+        try:
+            yield api
+        finally:
+            self._engines.put(api)
+
+    def image_to_string(self, image, psm=6, whitelist=None):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        with self.engine() as api:
+            api.SetPageSegMode(psm)
+            api.SetVariable("tessedit_char_whitelist", whitelist or "")
+            api.SetImageBytes(image.tobytes(), width, height, 1, width)
+            return api.GetUTF8Text()
+
+    def image_to_data(self, image, psm=3):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        words = []
+        block = paragraph = line = 0
+        with self.engine() as api:
+            api.SetPageSegMode(psm)
+            api.SetVariable("tessedit_char_whitelist", "")
+            api.SetImageBytes(image.tobytes(), width, height, 1, width)
+            api.Recognize()
+            iterator = api.GetIterator()
+            level = tesserocr.RIL.WORD
+            # Même numérotation des lignes que `tesseract ... tsv`
+            for word in tesserocr.iterate_level(iterator, level):
+                if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block, paragraph, line = block + 1, 0, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    paragraph, line = paragraph + 1, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                text = word.GetUTF8Text(level)
+                bounding_box = word.BoundingBox(level)
+                if not text or not text.strip() or bounding_box is None:
+                    continue
+                x0, y0, x1, y1 = bounding_box
+                words.append(OCRWord(text=text, confidence=word.Confidence(level), box=(x0, y0, x1 - x0, y1 - y0), line=(block, paragraph, line)))
+        return words
+
+    def version(self):
+        return f"{self.name}-{tesserocr.tesseract_version().splitlines()[0]}"
+
+
+class BatchingBackend(OCRBackend):
+    """
+    Base of the deep-learning recognizers: the images sent by all the threads of the process
+    (the regions of several invoices) are gathered into batches, recognized by one call of
+    the model. A call waits at most `max_wait` seconds for other images to fill its batch.
+    The Tesseract parameters (psm, whitelist) are ignored.
+    """
+
+    batching = True
+
+    def __init__(self, batch_size=16, max_wait=0.02, threads=2):
+        """
+        Initialize the batching thread.
+
+        Args:
+            batch_size (int): the maximum number of images per batch.
+            max_wait (float): the maximum time in seconds to wait for a batch to fill.
+            threads (int): the number of threads of the inference (torch).
+        """
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.threads = threads
+        self.batches = 0
+        self.images = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+        self._thread.start()
+
+    def _predict(self, images):
+        """
+        Recognize a batch of images with the model.
+
+        Args:
+            images (list): the images, in grayscale (uint8).
+
+        Returns:
+            list: the recognized texts, in the order of the images.
+        """
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            images, futures = zip(*batch)
+            try:
+                texts = self._predict(list(images))
+                self.batches += 1
+                self.images += len(images)
+                for future, text in zip(futures, texts):
+                    future.set_result(text)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+
+    def recognize_batch(self, images, psm=6, whitelist=None):
+        futures = []
+        for image in images:
+            future = Future()
+            self._queue.put((image, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def image_to_string(self, image, psm=6, whitelist=None):
+        return self.recognize_batch([image])[0]
+
+
+def _set_torch_threads(threads):
+    # Budget fixe de threads : plusieurs processus OCR ne se disputent pas les cœurs
+    import torch # type: ignore
+    torch.set_num_threads(threads)
+    return torch
+
+
+def lines_to_text(words):
+    """
+    Rebuild a text from recognized words: the words are grouped into lines by the vertical
+    position of their center, the lines are sorted from top to bottom and their words from left to right.
+
+    Args:
+        words (list): the (text, (x0, y0, x1, y1)) of the words, in any unit.
+
+    Returns:
+        str: the text, one line per line of words.
+    """
+    lines = []
+    for text, (x0, y0, x1, y1) in sorted(words, key=lambda word: (word[1][1] + word[1][3]) / 2):
+        center, height = (y0 + y1) / 2, y1 - y0
+        if lines and abs(center - lines[-1][0]) < height / 2:
+            lines[-1][1].append((x0, text))
+        else:
+            lines.append([center, [(x0, text)]])
+    return "\n".join(" ".join(text for _, text in sorted(line)) for _, line in lines)
+
+
+class DoctrBackend(BatchingBackend):
+    """python-doctr (detection + recognition, torch on CPU), images recognized by batches"""
+
+    name = "doctr"
+
+    def __init__(self, det_arch="db_resnet50", reco_arch="crnn_vgg16_bn", **kwargs):
+        """
+        Load the model once per process.
+
+        Args:
+            det_arch (str): the text detection architecture.
+            reco_arch (str): the text recognition architecture.
+            **kwargs: the batching parameters, see BatchingBackend.
+        """
+        # Imports tardifs : torch n'est chargé que si ce moteur est choisi
+        try:
+            from doctr.models import ocr_predictor # type: ignore
+            import doctr # type: ignore
+        except ImportError as e:
+            raise ImportError(f"python-doctr n'est pas installé ({e})")
+        _set_torch_threads(kwargs.get("threads", 2))
+        self.det_arch = det_arch
+        self.reco_arch = reco_arch
+        self.doctr_version = doctr.__version__
+        self.model = ocr_predictor(det_arch, reco_arch, pretrained=True)
+        super().__init__(**kwargs)
+
+    def _predict(self, images):
+        # doctr attend des images couleur (H, W, 3)
+        pages = [np.ascontiguousarray(np.repeat(image[:, :, None], 3, axis=2)) for image in images]
+        result = self.model(pages)
+        return [
+            lines_to_text([
+                (word.value, (word.geometry[0][0], word.geometry[0][1], word.geometry[1][0], word.geometry[1][1]))
+                for block in page.blocks for line in block.lines for word in line.words
+            ])
+            for page in result.pages
+        ]
+
+    def version(self):
+        return f"{self.name}-{self.doctr_version}-{self.det_arch}-{self.reco_arch}"
+
+
+class EasyOCRBackend(BatchingBackend):
+    """easyocr (torch on CPU), images recognized by batches"""
+
+    name = "easyocr"
+
+    def __init__(self, lang="en", **kwargs):
+        """
+        Load the model once per process.
+
+        Args:
+            lang (str): the easyocr language.
+            **kwargs: the batching parameters, see BatchingBackend.
+        """
+        try:
+            import easyocr # type: ignore
+        except ImportError as e:
+            raise ImportError(f"easyocr n'est pas installé ({e})")
+        _set_torch_threads(kwargs.get("threads", 2))
+        self.easyocr_version = easyocr.__version__
+        self.reader = easyocr.Reader([lang], gpu=False)
+        super().__init__(**kwargs)
+
+    def _predict(self, images):
+        # readtext_batched exige des images de même taille : chaque taille forme un sous-lot
+        texts = [None] * len(images)
+        by_shape = {}
+        for index, image in enumerate(images):
+            by_shape.setdefault(image.shape, []).append(index)
+        for indexes in by_shape.values():
+            results = self.reader.readtext_batched([images[index] for index in indexes], batch_size=len(indexes))
+            for index, words in zip(indexes, results):
+                texts[index] = lines_to_text([
+                    (text, (min(x for x, _ in box), min(y for _, y in box), max(x for x, _ in box), max(y for _, y in box)))
+                    for box, text, _ in words
+                ])
+        return texts
+
+    def version(self):
+        return f"{self.name}-{self.easyocr_version}"
+
+
+BACKENDS = {
+    "pytesseract": PytesseractBackend,
+    "tesserocr": TesserocrBackend,
+    "doctr": DoctrBackend,
+    "easyocr": EasyOCRBackend,
+}
+
+# Un moteur par processus (les moteurs ne survivent pas à un fork)
+_instances = {}
+# Threads de chaque pool du processus qui lancent l'OCR (OCR, régions, pages des PDF)
+_reservations = {}
+_lock = threading.Lock()
+
+
+def _reserved_threads(pid):
+    # Appelé avec le verrou
+    return sum(threads for (owner, _), threads in _reservations.items() if owner == pid)
+
+
+def reserve_engines(pool, threads):
+    """
+    Declare a thread pool of the current process that runs the OCR, so the engines of the process
+    serve all the threads of all the pools at the same time instead of making them wait for a free engine.
+    The engines already created grow at once, the next ones are created with the reserved size.
+
+    Args:
+        pool (str): the name of the pool.
+        threads (int): the number of threads of the pool.
+
+    Returns:
+        int: the number of threads reserved by all the pools of the process.
+    """
+    pid = os.getpid()
+    with _lock:
+        _reservations[(pid, pool)] = threads
+        total = _reserved_threads(pid)
+        backends = [backend for (owner, _), backend in _instances.items() if owner == pid]
+    for backend in backends:
+        backend.reserve(total)
+    return total
+
+
+def get_backend(name=None):
+    """
+    Get the OCR engine of the current process, created on first use.
+
+    Args:
+        name (str): the name of the backend ("tesserocr", "pytesseract", "doctr", "easyocr" or "auto").
+            Defaults to the OCR_BACKEND environment variable, then "auto".
+
+    Returns:
+        OCRBackend: the OCR engine.
+    """
+    name = name or os.getenv("OCR_BACKEND", "auto")
+    key = (os.getpid(), name)
+    with _lock:
+        backend = _instances.get(key)
+        if backend is None:
+            backend = _instances[key] = _create_backend(name)
+            backend.reserve(_reserved_threads(os.getpid()))
+    return backend
+
+
+def _create_backend(name):
+    if name == "auto":
+        try:
+            return _create_backend("tesserocr")
+        except Exception as e:
+            logger.info(f"tesserocr indisponible ({e}), utilisation de pytesseract")
+            return PytesseractBackend()
+    if name not in BACKENDS:
+        raise ValueError(f"Moteur OCR inconnu : {name}")
+    if name == "tesserocr":
+        return TesserocrBackend(pool_size=int(os.getenv("OCR_ENGINE_POOL", 1)))
+    if issubclass(BACKENDS[name], BatchingBackend):
+        return BACKENDS[name](
+            batch_size=int(os.getenv("OCR_BATCH_SIZE", 16)),
+            max_wait=float(os.getenv("OCR_BATCH_WAIT_MS", 20)) / 1000,
+            threads=int(os.getenv("OCR_DL_THREADS", 2)),
+        )
+    return BACKENDS[name]()
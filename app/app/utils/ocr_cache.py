@@ -0,0 +1,160 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class OCRCache:
+    """
+    Persistent cache of the OCR results, keyed by the content of the image and the versions
+    of the template and of the OCR engine. The least recently used entries are evicted
+    when the cache is full.
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=256 * 1024 * 1024):
+        """
+        Open (or create) the cache.
+
+        Args:
+            path (str): the path of the SQLite file.
+            max_entries (int): the maximum number of results kept.
+            max_bytes (int): the maximum total size of the results kept.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ocr_cache_last_access ON ocr_cache (last_access)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(digest, template, backend):
+        """
+        Build the key of an invoice.
+
+        Args:
+            digest (str): the hash of the content of the image.
+            template (InvoiceTemplate): the template used for the extraction.
+            backend (OCRBackend): the OCR engine used for the extraction.
+
+        Returns:
+            str: the key.
+        """
+        return f"{digest}:{template.name}-{template.version}:{backend.version()}"
+
+    def get(self, key):
+        """
+        Get a stored result.
+
+        Args:
+            key (str): the key of the invoice.
+
+        Returns:
+            dict: the stored result, or None if the invoice is not in the cache.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE ocr_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        """
+        Store a result, evicting the least recently used results if the cache is full.
+
+        Args:
+            key (str): the key of the invoice.
+            value (dict): the result to store.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()
+        while entries > self.max_entries or size > self.max_bytes:
+            # Suppression par lots des entrées les moins récemment utilisées
+            excess = max(entries - self.max_entries, 1)
+            rows = self.connection.execute(
+                "SELECT key, size FROM ocr_cache ORDER BY last_access LIMIT ?", (excess,)
+            ).fetchall()
+            if not rows:
+                break
+            self.connection.executemany("DELETE FROM ocr_cache WHERE key = ?", [(row[0],) for row in rows])
+            self.evictions += len(rows)
+            entries -= len(rows)
+            size -= sum(row[1] for row in rows)
+
+    def clear(self):
+        """Remove all the stored results"""
+        with self.lock:
+            self.connection.execute("DELETE FROM ocr_cache")
+            self.connection.commit()
+
+    def stats(self):
+        """
+        Get the statistics of the cache.
+
+        Returns:
+            dict: the hits, misses, hit rate, evictions, number of entries and size of the cache.
+        """
+        with self.lock:
+            entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups * 100) if lookups > 0 else 0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": size,
+            }
+
+
+# Une connexion par processus (les connexions SQLite ne survivent pas à un fork)
+_caches = {}
+_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Get the OCR cache of the current process, configured by the environment variables
+    OCR_CACHE (1 to enable it), OCR_CACHE_PATH, OCR_CACHE_MAX_ENTRIES and OCR_CACHE_MAX_MB.
+    The cache is disabled by default (tests, scripts): the API and the batch command enable it.
+
+    Returns:
+        OCRCache: the cache, or None if it is disabled.
+    """
+    if os.getenv("OCR_CACHE", "0") != "1":
+        return None
+    with _lock:
+        cache = _caches.get(os.getpid())
+        if cache is None:
+            cache = _caches[os.getpid()] = OCRCache(
+                os.getenv("OCR_CACHE_PATH", "temp/ocr_cache.sqlite"),
+                max_entries=int(os.getenv("OCR_CACHE_MAX_ENTRIES", 10000)),
+                max_bytes=int(os.getenv("OCR_CACHE_MAX_MB", 256)) * 1024 * 1024,
+            )
+    return cache
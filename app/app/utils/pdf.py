@@ -0,0 +1,163 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import numpy as np
+from app.app.utils.image_context import ImageContext
+from app.app.utils.monitoring import stage_timers
+from app.app.utils.ocr_backends import reserve_engines
+
+try:
+    from pdf2image import convert_from_path, pdfinfo_from_path # type: ignore
+except ImportError:  # pragma: no cover - dépendance optionnelle (nécessite poppler-utils)
+    convert_from_path = pdfinfo_from_path = None
+
+PDF_MAGIC = b"%PDF"
+
+
+def is_pdf(file):
+    """
+    Check whether a file is a PDF, from the extension of its path or from the start of its content.
+
+    Args:
+        file (str | bytes): the path of the file or its content.
+
+    Returns:
+        bool: True for a PDF.
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return bytes(file[:4]) == PDF_MAGIC
+    return isinstance(file, str) and file.lower().endswith(".pdf")
+
+
+@contextmanager
+def pdf_path(file):
+    """
+    Get a path to the PDF, writing its content once to a temporary file when it is given in memory
+    (poppler only reads files, and each page is rasterized by its own call).
+
+    Args:
+        file (str | bytes): the path of the PDF or its content.
+
+    Yields:
+        str: the path of the PDF.
+    """
+    if isinstance(file, str):
+        yield file
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        tmp.write(file)
+        tmp.flush()
+        yield tmp.name
+
+
+def file_digest(file):
+    """
+    Get the SHA-256 of a file, read by chunks.
+
+    Args:
+        file (str | bytes): the path of the file or its content.
+
+    Returns:
+        str: the SHA-256 of the content.
+    """
+    if not isinstance(file, str):
+        return hashlib.sha256(file).hexdigest()
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def count_pages(path):
+    """
+    Get the number of pages of a PDF, without rasterizing it.
+
+    Args:
+        path (str): the path of the PDF.
+
+    Returns:
+        int: the number of pages.
+    """
+    if pdfinfo_from_path is None:
+        raise ImportError("pdf2image ou poppler-utils n'est pas installé")
+    return int(pdfinfo_from_path(path)["Pages"])
+
+
+def render_page(path, page, dpi, source=None, digest=None):
+    """
+    Rasterize one page of a PDF, in grayscale, at the resolution of the template.
+
+    Args:
+        path (str): the path of the PDF.
+        page (int): the number of the page, from 1.
+        dpi (int): the resolution of the rasterization.
+        source (str): the name of the PDF, used in the results.
+        digest (str): the SHA-256 of the PDF, to identify the page in the OCR cache.
+
+    Returns:
+        ImageContext: the context of the page.
+    """
+    if convert_from_path is None:
+        raise ImportError("pdf2image ou poppler-utils n'est pas installé")
+    with stage_timers.time("pdf_render"):
+        # Une seule page à la fois : la mémoire ne dépend pas du nombre de pages
+        images = convert_from_path(path, dpi=dpi, first_page=page, last_page=page, grayscale=True)
+        image = np.asarray(images[0])
+    page_digest = hashlib.sha256(f"{digest}:{page}:{dpi}".encode()).hexdigest() if digest else None
+    return ImageContext(image, source=f"{source or path}#page={page}", digest=page_digest)
+
+
+# Pool partagé par les PDF, séparé du pool des traitements de l'API pour éviter
+# qu'un traitement attende des pages qui attendent elles-mêmes un thread libre
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_page_executor():
+    """
+    Get the thread pool of the PDF pages of the current process, sized by the
+    PDF_PAGE_WORKERS environment variable (2 by default), with one OCR engine per thread.
+
+    Returns:
+        ThreadPoolExecutor: the thread pool.
+    """
+    with _executors_lock:
+        executor = _executors.get(os.getpid())
+        if executor is None:
+            workers = int(os.getenv("PDF_PAGE_WORKERS", 2))
+            executor = _executors[os.getpid()] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf")
+            # Un moteur Tesseract par page traitée en même temps
+            reserve_engines("pdf", workers)
+    return executor
+
+
+def map_pages(file, dpi, func, source=None):
+    """
+    Rasterize the pages of a PDF and run a function on each of them, concurrently.
+    Each page is rasterized by the task that processes it, so only the pages being
+    processed are in memory.
+
+    Args:
+        file (str | bytes): the path of the PDF or its content.
+        dpi (int): the resolution of the rasterization.
+        func (callable): the function run on the ImageContext of each page.
+        source (str): the name of the PDF, used in the results.
+
+    Returns:
+        list: the results of the function, in the order of the pages.
+    """
+    digest = file_digest(file)
+    source = source or (file if isinstance(file, str) else "document.pdf")
+    with pdf_path(file) as path:
+        executor = get_page_executor()
+        futures = [
+            executor.submit(lambda page: func(render_page(path, page, dpi, source, digest)), page)
+            for page in range(1, count_pages(path) + 1)
+        ]
+        # Toutes les pages doivent être terminées avant de supprimer le fichier temporaire
+        wait(futures)
+    return [future.result() for future in futures]
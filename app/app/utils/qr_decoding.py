@@ -0,0 +1,232 @@
+import logging
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass
+import cv2
+from app.app.utils.image_context import get_clahe
+
+try:
+    from pyzbar import pyzbar # type: ignore
+except ImportError:  # pragma: no cover - dépendance optionnelle (nécessite libzbar0)
+    pyzbar = None
+
+logger = logging.getLogger(__name__)
+
+
+class QRDecoder:
+    """Interface of the qrcode decoders"""
+
+    name = "base"
+
+    def decode(self, image):
+        """
+        Decode the qrcode of an image.
+
+        Args:
+            image (np.ndarray): the image, in grayscale (uint8).
+
+        Returns:
+            str: the content of the qrcode, None if no qrcode was decoded.
+        """
+        raise NotImplementedError
+
+
+class OpenCVDecoder(QRDecoder):
+    """cv2.QRCodeDetector, one detector per thread"""
+
+    name = "opencv"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def decode(self, image):
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = self._local.detector = cv2.QRCodeDetector()
+        data, _, _ = detector.detectAndDecode(image)
+        return data or None
+
+
+class ZbarDecoder(QRDecoder):
+    """zbar through pyzbar (the library installed with zbar-tools)"""
+
+    name = "zbar"
+
+    def __init__(self):
+        if pyzbar is None:
+            raise ImportError("pyzbar ou libzbar0 n'est pas installé")
+
+    def decode(self, image):
+        symbols = pyzbar.decode(image, symbols=[pyzbar.ZBarSymbol.QRCODE])
+        return symbols[0].data.decode("utf-8") if symbols else None
+
+
+QR_DECODERS = {
+    "opencv": OpenCVDecoder,
+    "zbar": ZbarDecoder,
+}
+
+_decoders = {}
+_decoders_lock = threading.Lock()
+
+
+def get_decoders(names=None):
+    """
+    Get the chain of qrcode decoders, tried in order at each step of the ladder.
+
+    Args:
+        names (str): the names of the decoders separated by commas. Defaults to the
+            QR_DECODERS environment variable, then "opencv". Unavailable decoders are skipped.
+
+    Returns:
+        tuple: the decoders.
+    """
+    # OpenCV par défaut : zbar n'a pas encore été mesuré plus rapide à taux de décodage égal
+    names = names or os.getenv("QR_DECODERS", "opencv")
+    with _decoders_lock:
+        if names not in _decoders:
+            chain = []
+            for name in (name.strip() for name in names.split(",")):
+                if name not in QR_DECODERS:
+                    raise ValueError(f"Décodeur de QR code inconnu : {name}")
+                try:
+                    chain.append(QR_DECODERS[name]())
+                except ImportError as e:
+                    logger.info(f"Décodeur {name} indisponible : {e}")
+            if not chain:
+                raise ValueError(f"Aucun décodeur de QR code disponible parmi : {names}")
+            _decoders[names] = tuple(chain)
+    return _decoders[names]
+
+
+@dataclass(frozen=True)
+class QRRung:
+    """
+    One step of the qrcode decoding ladder.
+
+    Attributes:
+        name (str): the name of the step, used in the statistics.
+        scale (float): the scale factor applied to the qrcode region.
+        preprocessing (str): "gray" (no preprocessing), "clahe" or "sharpen".
+        padding (int): the width of the white border (quiet zone) added around the region, in pixels.
+        page_size (bool): resize the region to 3 times the size of the whole page, like the
+            first version of decode_qrcode (slow, only kept as a last resort).
+    """
+    name: str
+    scale: float = 1
+    preprocessing: str = "gray"
+    padding: int = 0
+    page_size: bool = False
+
+
+# Du moins coûteux au plus coûteux : la plupart des factures se décodent sur les premiers échelons
+QR_LADDER = (
+    QRRung("native", padding=20),
+    QRRung("x1.5", scale=1.5),
+    QRRung("x2", scale=2, padding=20),
+    QRRung("x4_sharpen", scale=4, preprocessing="sharpen"),
+    QRRung("x6_clahe", scale=6, preprocessing="clahe"),
+    QRRung("page_size", preprocessing="clahe", page_size=True),
+)
+
+
+class QRLadderStats:
+    """Count which step of the ladder decoded each qrcode"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.successes = Counter()
+        self.decoders = Counter()
+        self.failures = 0
+
+    def record(self, rung, decoder=None):
+        """
+        Record the result of a decoding.
+
+        Args:
+            rung (str): the name of the step that decoded the qrcode, None if no step did.
+            decoder (str): the name of the decoder that decoded the qrcode.
+        """
+        with self.lock:
+            if rung is None:
+                self.failures += 1
+            else:
+                self.successes[rung] += 1
+                if decoder:
+                    self.decoders[decoder] += 1
+
+    def get_statistics(self):
+        """
+        Get the statistics of the ladder.
+
+        Returns:
+            dict: the number of decodings, failures, successes of each step and of each decoder.
+        """
+        with self.lock:
+            total = sum(self.successes.values()) + self.failures
+            return {
+                "total": total,
+                "failures": self.failures,
+                "successes": {rung.name: self.successes[rung.name] for rung in QR_LADDER if self.successes[rung.name]},
+                "decoders": dict(self.decoders),
+            }
+
+
+qr_stats = QRLadderStats()
+
+
+def prepare_rung(roi, rung, page_shape=None):
+    """
+    Build the image of one step of the ladder.
+
+    Args:
+        roi (np.ndarray): the qrcode region, in grayscale.
+        rung (QRRung): the step of the ladder.
+        page_shape (tuple): the shape of the whole page, needed by the "page_size" steps.
+
+    Returns:
+        np.ndarray: the image to decode.
+    """
+    image = roi
+    if rung.padding:
+        image = cv2.copyMakeBorder(image, rung.padding, rung.padding, rung.padding, rung.padding, cv2.BORDER_CONSTANT, value=255)
+    if rung.preprocessing == "clahe":
+        image = get_clahe(2.0, (10, 10)).apply(image)
+    if rung.page_size:
+        image = cv2.resize(image, (page_shape[1] * 3, page_shape[0] * 3), interpolation=cv2.INTER_LINEAR_EXACT)
+    elif rung.scale != 1:
+        image = cv2.resize(image, None, fx=rung.scale, fy=rung.scale, interpolation=cv2.INTER_LINEAR)
+    if rung.preprocessing == "sharpen":
+        # Masque flou : récupère les modules des QR codes flous une fois agrandis
+        image = cv2.addWeighted(image, 2.0, cv2.GaussianBlur(image, (0, 0), 2 * rung.scale), -1.0, 0)
+    return image
+
+
+def decode_ladder(roi, page_shape=None, ladder=QR_LADDER, decoders=None):
+    """
+    Decode a qrcode, trying the steps of the ladder in order until one succeeds.
+    At each step, the decoders of the chain are tried in order.
+
+    Args:
+        roi (np.ndarray): the qrcode region, in grayscale.
+        page_shape (tuple): the shape of the whole page, needed by the "page_size" steps
+            (skipped without it).
+        ladder (tuple): the steps to try.
+        decoders (tuple): the decoders to try, defaults to the configured chain.
+
+    Returns:
+        tuple: the content of the qrcode (None if not decoded) and the name of the step that decoded it.
+    """
+    decoders = decoders or get_decoders()
+    for rung in ladder:
+        if rung.page_size and page_shape is None:
+            continue
+        image = prepare_rung(roi, rung, page_shape)
+        for decoder in decoders:
+            data = decoder.decode(image)
+            if data:
+                qr_stats.record(rung.name, decoder.name)
+                return data, rung.name
+    qr_stats.record(None)
+    return None, None
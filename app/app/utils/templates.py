@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, replace
+
+
+@dataclass(frozen=True)
+class RegionSpec:
+    """
+    Declaration of one region of an invoice layout and of the way it is OCR-ed.
+
+    Attributes:
+        name (str): the name of the region, used as key of the extracted texts.
+        box (tuple): the region (x, y, w, h) in pixels of the original image.
+        psm (int): the Tesseract page segmentation mode.
+        whitelist (str): the allowed characters, None to allow everything.
+        scale (float): the scale factor applied before the OCR.
+        preprocessing (tuple): the names of the preprocessing steps, applied in order.
+        clahe_clip_limit (float): the contrast limit of the "clahe" step.
+        clahe_tile_grid_size (tuple): the grid size of the "clahe" step.
+        autocrop (bool): shrink the region to the bounding box of its ink before the OCR,
+            and skip the OCR of a region without ink.
+    """
+    name: str
+    box: tuple
+    psm: int = 6
+    whitelist: str = None
+    scale: float = 2
+    preprocessing: tuple = ("clahe", "otsu")
+    clahe_clip_limit: float = 2.0
+    clahe_tile_grid_size: tuple = (10, 10)
+    autocrop: bool = False
+
+
+@dataclass(frozen=True)
+class PreprocessingLevel:
+    """
+    One level of the preprocessing cascade: the scale and the preprocessing steps given to
+    the regions of a stage whose checks failed at the previous level.
+
+    Attributes:
+        name (str): the name of the level, used in the statistics.
+        scale (float): the scale factor applied before the OCR.
+        preprocessing (tuple): the names of the preprocessing steps, applied in order.
+    """
+    name: str
+    scale: float = 2
+    preprocessing: tuple = ("clahe", "otsu")
+
+    def apply(self, region):
+        """
+        Get a region with the parameters of the level.
+
+        Args:
+            region (RegionSpec): the region.
+
+        Returns:
+            RegionSpec: the region at this level.
+        """
+        return replace(region, scale=self.scale, preprocessing=self.preprocessing)
+
+
+# Du moins coûteux au plus coûteux : le deuxième niveau est le prétraitement fixe du modèle "facture"
+PREPROCESSING_CASCADE = (
+    PreprocessingLevel("native", scale=1, preprocessing=("otsu",)),
+    PreprocessingLevel("x2_clahe", scale=2, preprocessing=("clahe", "otsu")),
+    PreprocessingLevel("x3_denoise_deskew", scale=3, preprocessing=("deskew", "denoise", "clahe", "otsu")),
+)
+
+
+@dataclass(frozen=True)
+class InvoiceTemplate:
+    """
+    Layout of an invoice: its OCR regions and the position of its QR code.
+
+    Attributes:
+        name (str): the name of the template.
+        version (str): the version of the template, to change whenever the regions or their parameters change.
+        regions (tuple): the RegionSpec of the template.
+        qrcode_box (tuple): the region (x, y, w, h) of the QR code.
+        dpi (int): the resolution of the images the regions are defined for, used to rasterize the PDF pages.
+        mode (str): "regions" to OCR each region separately, "layout" to OCR the whole page once and
+            assign the recognized words to the regions by their boxes (one OCR call per invoice).
+        layout_psm (int): the Tesseract page segmentation mode of the "layout" mode.
+        cascade (tuple): the PreprocessingLevel tried in order by the "regions" mode: all the regions
+            start at the first level, and only the regions of a stage whose checks fail go to the
+            next one. Empty to use the parameters of each region.
+        line_items (tuple): the names of the regions of the item columns to OCR line by line: the lines
+            are found once across the columns and each cell is OCR-ed as a single line, so the
+            columns stay aligned. Empty to OCR each column as a whole ("regions" mode only).
+        line_psm (int): the Tesseract page segmentation mode of the cells of the lines.
+    """
+    name: str
+    version: str
+    regions: tuple
+    qrcode_box: tuple = (530, 5, 180, 180)
+    dpi: int = 100
+    mode: str = "regions"
+    layout_psm: int = 3
+    cascade: tuple = ()
+    line_items: tuple = ()
+    line_psm: int = 7
+
+    def region(self, name):
+        """
+        Get a region of the template by its name.
+
+        Args:
+            name (str): the name of the region.
+
+        Returns:
+            RegionSpec: the region.
+        """
+        for region in self.regions:
+            if region.name == name:
+                return region
+        raise KeyError(f"Région inconnue pour le modèle {self.name} : {name}")
+
+    def with_level(self, level, names=None):
+        """
+        Get the template with some regions at a level of the preprocessing cascade.
+
+        Args:
+            level (PreprocessingLevel): the level.
+            names (tuple): the names of the regions to change, None for all of them.
+
+        Returns:
+            InvoiceTemplate: the template with the changed regions.
+        """
+        return replace(self, regions=tuple(
+            level.apply(region) if names is None or region.name in names else region for region in self.regions
+        ))
+
+    @property
+    def boxes(self):
+        """dict: the box of each region, by name"""
+        return {region.name: region.box for region in self.regions}
+
+
+TEMPLATES = {}
+
+# Réglages des régions trouvés par benchmarks.tune_preprocessing, appliqués aux modèles à leur enregistrement.
+# Rangés avec le modèle de clustering dans le paquet, copié dans l'image Docker, quel que soit le dossier courant
+TEMPLATE_OVERRIDES = os.getenv(
+    "OCR_TEMPLATE_OVERRIDES",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "template_overrides.json"),
+)
+# Paramètres d'une région modifiables par le fichier (les listes JSON sont converties en tuples)
+TUNABLE_FIELDS = ("psm", "scale", "preprocessing", "clahe_clip_limit", "clahe_tile_grid_size")
+_overrides = None
+
+
+def load_overrides(path=None):
+    """
+    Read the region overrides of the templates, once.
+
+    Args:
+        path (str): the JSON file, defaults to TEMPLATE_OVERRIDES. A missing file means no overrides.
+
+    Returns:
+        dict: the overrides of each region, by template and region name.
+    """
+    global _overrides
+    if path is not None:
+        with open(path) as f:
+            return json.load(f)
+    if _overrides is None:
+        _overrides = load_overrides(TEMPLATE_OVERRIDES) if os.path.exists(TEMPLATE_OVERRIDES) else {}
+    return _overrides
+
+
+def apply_overrides(template, overrides):
+    """
+    Change the parameters of the regions of a template. The version of the template gets a suffix
+    derived from the overrides, so the cached results of the previous parameters are not reused.
+
+    Args:
+        template (InvoiceTemplate): the template.
+        overrides (dict): the parameters of each region to change, by region name.
+
+    Returns:
+        InvoiceTemplate: the template with the changed regions, the same template without overrides.
+    """
+    if not overrides:
+        return template
+    regions = []
+    for region in template.regions:
+        fields = overrides.get(region.name, {})
+        unknown = set(fields) - set(TUNABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Paramètres inconnus pour la région {region.name} : {sorted(unknown)}")
+        regions.append(replace(region, **{
+            name: tuple(value) if isinstance(value, list) else value for name, value in fields.items()
+        }))
+    digest = hashlib.sha256(json.dumps(overrides, sort_keys=True).encode()).hexdigest()[:8]
+    return replace(template, regions=tuple(regions), version=f"{template.version}+{digest}")
+
+
+def register_template(template):
+    """
+    Register an invoice template so it can be selected by its name, with its overrides if any.
+
+    Args:
+        template (InvoiceTemplate): the template to register.
+
+    Returns:
+        InvoiceTemplate: the registered template.
+    """
+    template = apply_overrides(template, load_overrides().get(template.name))
+    TEMPLATES[template.name] = template
+    return template
+
+
+def get_template(name=None):
+    """
+    Get a registered template.
+
+    Args:
+        name (str): the name of the template, defaults to the OCR_TEMPLATE environment variable, then "facture".
+
+    Returns:
+        InvoiceTemplate: the template.
+    """
+    name = name or os.getenv("OCR_TEMPLATE", "facture")
+    if name not in TEMPLATES:
+        raise ValueError(f"Modèle de facture inconnu : {name}")
+    return TEMPLATES[name]
+
+
+# Les factures font 850 x 1100 pixels : une page Letter à 100 DPI
+DEFAULT_TEMPLATE = register_template(InvoiceTemplate(
+    name="facture",
+    version="1",
+    regions=(
+        RegionSpec("Products", (20, 180, 420, 900)),
+        # Le filtre de caractères "0123456789Eurox." n'a jamais été appliqué (le résultat
+        # de cet appel était écrasé) : il n'est pas activé pour garder les mêmes résultats
+        RegionSpec("Quantities_and_prices", (510, 180, 280, 900)),
+        RegionSpec("Qrcode", (530, 5, 180, 180)),
+        RegionSpec("bloc", (10, 10, 520, 180)),
+    ),
+))
+
+# Même géométrie, une seule passe OCR sur la page entière
+LAYOUT_TEMPLATE = register_template(replace(DEFAULT_TEMPLATE, name="facture_layout", mode="layout"))
+
+# Même géométrie, prétraitement progressif : rapide d'abord, renforcé pour les régions rejetées
+CASCADE_TEMPLATE = register_template(replace(DEFAULT_TEMPLATE, name="facture_cascade", cascade=PREPROCESSING_CASCADE))
+
+# Même géométrie, articles lus ligne par ligne : produit et quantité/prix alignés par leur position
+LINES_TEMPLATE = register_template(replace(DEFAULT_TEMPLATE, name="facture_lines", line_items=("Products", "Quantities_and_prices")))
+
+# Même géométrie, régions recadrées sur leur encre : les zones des articles sont surtout vides,
+# seules les lignes écrites passent par l'OCR et une région vide n'y passe pas
+AUTOCROP_TEMPLATE = register_template(replace(DEFAULT_TEMPLATE, name="facture_autocrop", regions=tuple(
+    replace(region, autocrop=region.name in ("bloc", "Products", "Quantities_and_prices")) for region in DEFAULT_TEMPLATE.regions
+)))
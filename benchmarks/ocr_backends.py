@@ -0,0 +1,98 @@
+"""
+Compare the OCR backends (pytesseract, tesserocr, doctr, easyocr) on the test invoices.
+With --threads N, N invoices are processed at the same time, so the batching backends
+recognize the regions of several invoices in each batch.
+
+Usage:
+    python -m benchmarks.ocr_backends [--files "data/test_files/*.png"] [--repeat 3] [--threads 4]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils.extract_data import process_image, predefined_regions
+from app.app.utils.image_context import ImageContext
+from app.app.utils.ocr_backends import BACKENDS, get_backend
+
+
+def benchmark_backend(name, paths, repeat, threads=1):
+    """
+    Run the region OCR of every invoice with the given backend.
+
+    Args:
+        name (str): the name of the backend.
+        paths (list): the paths of the invoices.
+        repeat (int): the number of runs over the invoices.
+        threads (int): the number of invoices processed at the same time.
+
+    Returns:
+        dict: the timings and the texts of the last run.
+    """
+    start = time.perf_counter()
+    backend = get_backend(name)
+    init_time = time.perf_counter() - start
+
+    timings = []
+    texts = {}
+
+    def run(context):
+        start = time.perf_counter()
+        texts[context.source] = process_image(context, predefined_regions, backend=backend)
+        timings.append(time.perf_counter() - start)
+
+    wall_time = 0.0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in range(repeat):
+            # Contextes neufs à chaque passe : les textes déjà reconnus ne sont pas réutilisés
+            contexts = [ImageContext.from_path(path) for path in paths]
+            start = time.perf_counter()
+            list(executor.map(run, contexts))
+            wall_time += time.perf_counter() - start
+    timings.sort()
+    return {
+        "backend": backend.version(),
+        "init_time": init_time,
+        "invoices": len(timings),
+        "total_time": wall_time,
+        "mean": sum(timings) / len(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "texts": texts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des moteurs OCR")
+    parser.add_argument("--files", default="data/test_files/*.png", help="motif des factures à traiter")
+    parser.add_argument("--repeat", type=int, default=3, help="nombre de passes sur les factures")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), help="moteurs à comparer")
+    parser.add_argument("--threads", type=int, default=1, help="nombre de factures traitées en même temps")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.files))
+    if not paths:
+        sys.exit(f"Aucun fichier pour {args.files}")
+
+    results = {}
+    for name in args.backends:
+        try:
+            results[name] = benchmark_backend(name, paths, args.repeat, args.threads)
+        except Exception as e:
+            print(f"{name} : indisponible ({e})")
+
+    print(f"{'moteur':<30} {'init (s)':>9} {'moyenne (s)':>12} {'p50 (s)':>9} {'p95 (s)':>9} {'factures/s':>11}")
+    for result in results.values():
+        print(f"{result['backend']:<30} {result['init_time']:>9.3f} {result['mean']:>12.3f} {result['p50']:>9.3f} {result['p95']:>9.3f} {result['invoices'] / result['total_time']:>11.2f}")
+
+    if len(results) > 1:
+        reference, *others = results.values()
+        for other in others:
+            identical = sum(reference["texts"][source] == other["texts"][source] for source in reference["texts"])
+            print(f"Textes identiques {reference['backend']} / {other['backend']} : {identical}/{len(reference['texts'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Compare the OCR modes of the templates on the test invoices: one OCR call per region ("regions")
+or one OCR pass on the whole page with the words assigned to the regions ("layout").
+
+Usage:
+    python -m benchmarks.ocr_modes [--templates facture facture_layout] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils.extract_data import extract_data_raw
+from app.app.utils.image_context import ImageContext
+from app.app.utils.templates import get_template
+from benchmarks.pipeline import DEFAULT_FILES, expected_status, summarize
+
+
+def benchmark_template(name, paths, repeat):
+    """
+    Extract every invoice with the given template, without the OCR cache.
+
+    Args:
+        name (str): the name of the template.
+        paths (list): the paths of the invoices.
+        repeat (int): the number of runs over the invoices.
+
+    Returns:
+        dict: the timings, the OCR calls, the accuracy and the results of the last run.
+    """
+    template = get_template(name)
+    timings = []
+    ocr_calls = 0
+    results = {}
+    for _ in range(repeat):
+        for path in paths:
+            # Contexte neuf à chaque passe : aucun texte déjà reconnu n'est réutilisé
+            context = ImageContext.from_path(path)
+            start = time.perf_counter()
+            results[path] = extract_data_raw(context, template=template, use_cache=False)
+            timings.append(time.perf_counter() - start)
+            ocr_calls += results[path]["ocr_calls"]
+    correct = sum(result["status"] == expected_status(path) for path, result in results.items())
+    confidences = [
+        value for result in results.values() if result["variables"] and result["variables"].get("confidences")
+        for value in result["variables"]["confidences"].values()
+    ]
+    return {
+        "template": f"{template.name} ({template.mode})",
+        "timings": summarize(timings),
+        "ocr_calls": ocr_calls / len(timings),
+        "accuracy": correct / len(results),
+        "confidence": sum(confidences) / len(confidences) if confidences else None,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des modes OCR des modèles de facture")
+    parser.add_argument("--files", nargs="+", default=DEFAULT_FILES, help="motifs des factures à traiter")
+    parser.add_argument("--templates", nargs="+", default=["facture", "facture_layout"], help="modèles à comparer")
+    parser.add_argument("--repeat", type=int, default=3, help="nombre de passes sur les factures")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.files for path in glob.glob(pattern)})
+    if not paths:
+        sys.exit(f"Aucun fichier pour {args.files}")
+
+    runs = [benchmark_template(name, paths, args.repeat) for name in args.templates]
+    print(f"{'modèle':<26} {'moyenne (ms)':>13} {'p95 (ms)':>9} {'appels OCR':>11} {'précision':>10} {'confiance':>10}")
+    for run in runs:
+        confidence = f"{run['confidence']:.1f}" if run["confidence"] is not None else "-"
+        print(f"{run['template']:<26} {run['timings']['mean'] * 1000:>13.1f} {run['timings']['p95'] * 1000:>9.1f} {run['ocr_calls']:>11.2f} {run['accuracy']:>10.1%} {confidence:>10}")
+
+    reference, *others = runs
+    for other in others:
+        same_status = sum(reference["results"][path]["status"] == other["results"][path]["status"] for path in paths)
+        print(f"Même statut {reference['template']} / {other['template']} : {same_status}/{len(paths)}")
+        for path in paths:
+            if reference["results"][path]["status"] != other["results"][path]["status"]:
+                print(f"  {path} : {reference['results'][path]['erreur']} / {other['results'][path]['erreur']}")
+
+
+if __name__ == "__main__":
+    main()
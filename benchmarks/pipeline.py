@@ -0,0 +1,244 @@
+"""
+Benchmark of the whole extraction pipeline on the test invoices: time and CPU of each stage,
+invoices per second with 1 to N worker processes, peak memory and OK/BAD classification accuracy.
+The results are written as JSON, to compare a change of the pipeline with a previous baseline.
+
+Usage:
+    python -m benchmarks.pipeline [--template facture] [--workers 1 2 4] [--repeat 2] [--output benchmarks/baseline.json]
+                                  [--baseline old.json]
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Le cache OCR fausserait les mesures : chaque facture doit repasser par tout le pipeline
+os.environ["OCR_CACHE"] = "0"
+from app.app.utils.batch import iter_results
+from app.app.utils.extract_data import READ_REGIONS, decode_qrcode, extract_data_raw, process_image
+from app.app.utils.image_context import ImageContext
+from app.app.utils.ocr_backends import get_backend
+from app.app.utils.templates import get_template
+
+DEFAULT_FILES = ["data/test_files/FAC*_OK.png", "data/test_files/FAC*_BAD.png", "temp/FAC*_OK.png", "temp/FAC*_BAD.png"]
+STAGES = ("decode", "qrcode", "ocr", "parsing")
+
+
+def cpu_time():
+    """
+    Get the CPU time of the process and of its finished children (the `tesseract` processes of pytesseract).
+
+    Returns:
+        float: the CPU time in seconds.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def expected_status(path):
+    """
+    Get the expected status of a test invoice from its name (FAC1_OK.png, FAC5_BAD.png).
+
+    Args:
+        path (str): the path of the invoice.
+
+    Returns:
+        str: "success" for an OK invoice, "error" for a BAD one.
+    """
+    return "success" if os.path.basename(path).rsplit(".", 1)[0].endswith("_OK") else "error"
+
+
+def summarize(timings):
+    """
+    Summarize a list of durations.
+
+    Args:
+        timings (list): the durations in seconds.
+
+    Returns:
+        dict: the total, mean, p50 and p95 of the durations.
+    """
+    timings = sorted(timings)
+    return {
+        "total": sum(timings),
+        "mean": sum(timings) / len(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+def benchmark_stages(paths, repeat, template):
+    """
+    Run the extraction of every invoice stage by stage, in the current process.
+    The context keeps the qrcode and the OCR texts, so extract_data_raw only does the parsing and
+    the checks at the end, with the same template and without the OCR cache. With a preprocessing
+    cascade, the "ocr" stage reads the first level, as extract_data_raw does: only the regions
+    escalated to the next levels are OCR-ed during the "parsing" stage.
+
+    Args:
+        paths (list): the paths of the invoices.
+        repeat (int): the number of runs over the invoices.
+        template (InvoiceTemplate): the template to measure.
+
+    Returns:
+        tuple: the wall and CPU time of each stage, the status of each invoice and the number of
+            OCR calls made during the "parsing" stage.
+    """
+    backend = get_backend()
+    first_level = template.with_level(template.cascade[0]) if template.cascade and template.mode == "regions" else template
+    wall = {stage: [] for stage in STAGES}
+    cpu = {stage: [] for stage in STAGES}
+    statuses = {}
+    parsing_ocr_calls = 0
+
+    def timed(stage, func, *args):
+        start_wall, start_cpu = time.perf_counter(), cpu_time()
+        try:
+            return func(*args)
+        finally:
+            wall[stage].append(time.perf_counter() - start_wall)
+            cpu[stage].append(cpu_time() - start_cpu)
+
+    for _ in range(repeat):
+        for path in paths:
+            try:
+                context = timed("decode", ImageContext.from_path, path)
+                try:
+                    timed("qrcode", decode_qrcode, context, template.qrcode_box)
+                except Exception:
+                    # QR code illisible : l'erreur est remontée par extract_data_raw
+                    pass
+                timed("ocr", process_image, context, first_level, 2, backend, READ_REGIONS)
+                ocr_calls = context.ocr_calls
+                result = timed("parsing", extract_data_raw, context, template, False)
+                # Seules les régions relues aux niveaux suivants de la cascade passent encore par l'OCR
+                parsing_ocr_calls += context.ocr_calls - ocr_calls
+                statuses[path] = result["status"]
+            except Exception as e:
+                statuses[path] = f"exception: {e}"
+    return {stage: summarize(wall[stage]) for stage in STAGES if wall[stage]}, \
+           {stage: summarize(cpu[stage]) for stage in STAGES if cpu[stage]}, statuses, parsing_ocr_calls
+
+
+def benchmark_throughput(paths, workers, repeat):
+    """
+    Extract the invoices with the batch worker pool.
+
+    Args:
+        paths (list): the paths of the invoices.
+        workers (int): the number of worker processes.
+        repeat (int): the number of runs over the invoices.
+
+    Returns:
+        dict: the number of invoices, the duration and the invoices per second.
+    """
+    tasks = [(os.path.basename(path), path) for _ in range(repeat) for path in paths]
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_results(iter(tasks), workers=workers, max_in_flight=workers * 2, max_tasks_per_child=None))
+    duration = time.perf_counter() - start
+    return {"workers": workers, "invoices": count, "duration": duration, "invoices_per_second": count / duration}
+
+
+def accuracy(statuses):
+    """
+    Compare the status of each invoice with the expected one.
+
+    Args:
+        statuses (dict): the status of each invoice, by path.
+
+    Returns:
+        dict: the accuracy and the misclassified invoices.
+    """
+    wrong = {path: status for path, status in statuses.items() if status != expected_status(path)}
+    return {
+        "accuracy": 1 - len(wrong) / len(statuses),
+        "ok_files": sum(expected_status(path) == "success" for path in statuses),
+        "bad_files": sum(expected_status(path) == "error" for path in statuses),
+        "misclassified": wrong,
+    }
+
+
+def compare(result, baseline):
+    """
+    Print the changes of throughput and accuracy against a previous run.
+
+    Args:
+        result (dict): the results of this run.
+        baseline (dict): the results of the previous run.
+    """
+    print(f"\nComparaison avec {baseline['date']} :")
+    previous = {run["workers"]: run for run in baseline["throughput"]}
+    for run in result["throughput"]:
+        if run["workers"] in previous:
+            change = run["invoices_per_second"] / previous[run["workers"]]["invoices_per_second"] - 1
+            print(f"  {run['workers']} processus : {run['invoices_per_second']:.2f} factures/s ({change:+.1%})")
+    print(f"  précision : {result['accuracy']['accuracy']:.1%} (avant : {baseline['accuracy']['accuracy']:.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du pipeline d'extraction")
+    parser.add_argument("--files", nargs="+", default=DEFAULT_FILES, help="motifs des factures à traiter")
+    parser.add_argument("--template", default=os.getenv("OCR_TEMPLATE", "facture"), help="modèle de facture à mesurer")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, os.cpu_count()], help="nombres de processus à mesurer")
+    parser.add_argument("--repeat", type=int, default=2, help="nombre de passes sur les factures")
+    parser.add_argument("--output", default="benchmarks/baseline.json", help="fichier JSON des résultats")
+    parser.add_argument("--baseline", help="résultats JSON d'une exécution précédente à comparer")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.files for path in glob.glob(pattern)})
+    if not paths:
+        sys.exit(f"Aucun fichier pour {args.files}")
+    template = get_template(args.template)
+    # Les processus de traitement lisent le modèle dans l'environnement
+    os.environ["OCR_TEMPLATE"] = template.name
+
+    stages_wall, stages_cpu, statuses, parsing_ocr_calls = benchmark_stages(paths, args.repeat, template)
+    print(f"{'étape':<10} {'moyenne (ms)':>13} {'p50 (ms)':>9} {'p95 (ms)':>9} {'CPU (ms)':>9}")
+    for stage, timings in stages_wall.items():
+        print(f"{stage:<10} {timings['mean'] * 1000:>13.1f} {timings['p50'] * 1000:>9.1f} {timings['p95'] * 1000:>9.1f} {stages_cpu[stage]['mean'] * 1000:>9.1f}")
+    if parsing_ocr_calls:
+        print(f"Appels OCR pendant l'étape parsing (régions relues par la cascade) : {parsing_ocr_calls}")
+
+    throughput = []
+    for workers in sorted(set(args.workers)):
+        run = benchmark_throughput(paths, workers, args.repeat)
+        throughput.append(run)
+        print(f"{workers} processus : {run['invoices_per_second']:.2f} factures/s")
+
+    result = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {"platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "backend": get_backend().version(),
+        "template": f"{template.name}-{template.version}",
+        "files": len(paths),
+        "repeat": args.repeat,
+        "stages_wall": stages_wall,
+        "stages_cpu": stages_cpu,
+        "parsing_ocr_calls": parsing_ocr_calls,
+        "throughput": throughput,
+        # ru_maxrss est en kilo-octets sous Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_rss_workers_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "accuracy": accuracy(statuses),
+    }
+    print(f"Mémoire max : {result['peak_rss_mb']:.0f} Mo (processus principal), {result['peak_rss_workers_mb']:.0f} Mo (processus de traitement)")
+    print(f"Précision OK/BAD : {result['accuracy']['accuracy']:.1%} ({len(result['accuracy']['misclassified'])} factures mal classées)")
+    for path, status in result["accuracy"]["misclassified"].items():
+        print(f"  {path} : {status}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Résultats enregistrés dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the qrcode decoders (OpenCV vs zbar) on the test invoices: decode rate, step of the ladder and latency.
+
+Usage:
+    python -m benchmarks.qr_decoders [--files "data/test_files/*.png" "temp/FAC*.png"] [--repeat 5]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils.image_context import ImageContext
+from app.app.utils.qr_decoding import QR_DECODERS, decode_ladder, get_decoders
+from app.app.utils.templates import DEFAULT_TEMPLATE
+
+
+def benchmark_decoders(names, contexts, repeat):
+    """
+    Decode the qrcode of every invoice with the given chain of decoders.
+
+    Args:
+        names (str): the names of the decoders, separated by commas.
+        contexts (list): the decoded invoices.
+        repeat (int): the number of runs over the invoices.
+
+    Returns:
+        dict: the decode rate, the steps used and the latencies.
+    """
+    decoders = get_decoders(names)
+    timings = []
+    rungs = Counter()
+    decoded = 0
+    for _ in range(repeat):
+        for context in contexts:
+            start = time.perf_counter()
+            data, rung = decode_ladder(context.roi(DEFAULT_TEMPLATE.qrcode_box), context.shape, decoders=decoders)
+            timings.append(time.perf_counter() - start)
+            decoded += data is not None
+            rungs[rung or "échec"] += 1
+    timings.sort()
+    return {
+        "decoders": ",".join(decoder.name for decoder in decoders),
+        "decode_rate": decoded / len(timings) * 100,
+        "mean": sum(timings) / len(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "rungs": dict(rungs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des décodeurs de QR code")
+    parser.add_argument("--files", nargs="+", default=["data/test_files/*.png", "temp/FAC*.png"], help="motifs des factures à traiter")
+    parser.add_argument("--repeat", type=int, default=5, help="nombre de passes sur les factures")
+    parser.add_argument("--chains", nargs="+", default=[*QR_DECODERS, "zbar,opencv"], help="chaînes de décodeurs à comparer")
+    args = parser.parse_args()
+
+    paths = sorted(path for pattern in args.files for path in glob.glob(pattern))
+    contexts = [ImageContext.from_path(path) for path in paths]
+    if not contexts:
+        sys.exit(f"Aucun fichier pour {args.files}")
+
+    print(f"{'décodeurs':<15} {'décodés (%)':>12} {'moyenne (ms)':>13} {'p50 (ms)':>9} {'p95 (ms)':>9}  échelons")
+    for names in args.chains:
+        try:
+            result = benchmark_decoders(names, contexts, args.repeat)
+        except ValueError as e:
+            print(f"{names:<15} indisponible ({e})")
+            continue
+        print(f"{result['decoders']:<15} {result['decode_rate']:>12.1f} {result['mean'] * 1000:>13.1f} {result['p50'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f}  {result['rungs']}")
+
+
+if __name__ == "__main__":
+    main()
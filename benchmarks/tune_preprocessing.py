@@ -0,0 +1,195 @@
+"""
+Tune the preprocessing of the regions of a template on the labelled test invoices (FAC1_OK.png,
+FAC5_BAD.png): each region is swept in turn over the scale, the preprocessing steps, the CLAHE
+parameters and the Tesseract psm, the other regions keeping their current parameters. Each
+configuration is measured by the OK/BAD accuracy of the extraction and the OCR time of the region.
+The fastest configuration of the Pareto front that keeps the accuracy of the current parameters is
+written to the overrides of the template (app/app/models/template_overrides.json), loaded with the template.
+
+Usage:
+    python -m benchmarks.tune_preprocessing [--template facture] [--regions Products bloc] [--scales 1 1.5 2]
+                                            [--psms 4 6] [--output app/app/models/template_overrides.json] [--report tuning.json]
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import sys
+import time
+from dataclasses import replace
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils.extract_data import extract_data_raw
+from app.app.utils.image_context import ImageContext
+from app.app.utils.templates import TEMPLATE_OVERRIDES, TUNABLE_FIELDS, get_template
+from benchmarks.pipeline import DEFAULT_FILES, expected_status
+
+# Le texte OCR du QR code n'est utilisé par aucun contrôle : seules les régions lues sont réglées
+DEFAULT_REGIONS = ("bloc", "Products", "Quantities_and_prices")
+PREPROCESSINGS = (("otsu",), ("clahe", "otsu"))
+CLAHE_CLIP_LIMITS = (1.0, 2.0, 4.0)
+CLAHE_TILE_GRID_SIZES = ((8, 8), (10, 10), (16, 16))
+
+
+def candidates(region, scales, psms):
+    """
+    List the configurations of a region to measure, the current one first.
+    The CLAHE parameters only vary when the "clahe" step is used.
+
+    Args:
+        region (RegionSpec): the region.
+        scales (list): the scale factors to try.
+        psms (list): the Tesseract page segmentation modes to try.
+
+    Returns:
+        list: the RegionSpec to measure.
+    """
+    configurations = [region]
+    for scale, psm, preprocessing in itertools.product(scales, psms, PREPROCESSINGS):
+        clahe = itertools.product(CLAHE_CLIP_LIMITS, CLAHE_TILE_GRID_SIZES) if "clahe" in preprocessing \
+            else [(region.clahe_clip_limit, region.clahe_tile_grid_size)]
+        for clip_limit, tile_grid_size in clahe:
+            candidate = replace(region, scale=scale, psm=psm, preprocessing=preprocessing,
+                                clahe_clip_limit=clip_limit, clahe_tile_grid_size=tile_grid_size)
+            if candidate not in configurations:
+                configurations.append(candidate)
+    return configurations
+
+
+def measure(template, contexts, repeat, name):
+    """
+    Extract every invoice with a template and measure the accuracy and the time.
+    The contexts keep the texts of the regions already read with the same parameters,
+    so only the region being tuned goes through the OCR.
+
+    Args:
+        template (InvoiceTemplate): the template to measure.
+        contexts (dict): the decoded invoices, by path.
+        repeat (int): the number of runs (the text of the tuned region is read again at each run).
+        name (str): the name of the tuned region.
+
+    Returns:
+        dict: the accuracy and the mean time per invoice.
+    """
+    timings = []
+    correct = 0
+    for _ in range(repeat):
+        for path, context in contexts.items():
+            context.ocr_texts.pop(template.region(name), None)
+            start = time.perf_counter()
+            result = extract_data_raw(context, template=template, use_cache=False)
+            timings.append(time.perf_counter() - start)
+            correct += result["status"] == expected_status(path)
+    return {"accuracy": correct / len(timings), "time": sum(timings) / len(timings)}
+
+
+def pareto_front(results):
+    """
+    Keep the configurations that no other one beats on both accuracy and time.
+
+    Args:
+        results (list): the measures, with their "accuracy" and "time".
+
+    Returns:
+        list: the measures of the Pareto front, from the fastest to the slowest.
+    """
+    front = []
+    for result in sorted(results, key=lambda result: (result["time"], -result["accuracy"])):
+        if not front or result["accuracy"] > front[-1]["accuracy"]:
+            front.append(result)
+    return front
+
+
+def describe(region):
+    """
+    Get the tunable parameters of a region, as written in the overrides.
+
+    Args:
+        region (RegionSpec): the region.
+
+    Returns:
+        dict: the parameters, with lists instead of tuples.
+    """
+    return {name: list(value) if isinstance(value, tuple) else value for name, value in
+            ((name, getattr(region, name)) for name in TUNABLE_FIELDS)}
+
+
+def tune_region(template, name, contexts, scales, psms, repeat):
+    """
+    Sweep the parameters of one region of the template.
+
+    Args:
+        template (InvoiceTemplate): the template, with the regions already tuned.
+        name (str): the name of the region to tune.
+        contexts (dict): the decoded invoices, by path.
+        scales (list): the scale factors to try.
+        psms (list): the Tesseract page segmentation modes to try.
+        repeat (int): the number of runs of each configuration.
+
+    Returns:
+        tuple: the best region, the measures of all the configurations and the Pareto front.
+    """
+    # Première passe hors mesure : les textes des autres régions sont lus une fois pour toutes
+    measure(template, contexts, 1, name)
+    results = []
+    for candidate in candidates(template.region(name), scales, psms):
+        regions = tuple(candidate if region.name == name else region for region in template.regions)
+        result = measure(replace(template, regions=regions), contexts, repeat, name)
+        result["region"] = candidate
+        results.append(result)
+        print(f"  {describe(candidate)} : précision {result['accuracy']:.1%}, {result['time'] * 1000:.1f} ms")
+    baseline = results[0]
+    front = pareto_front(results)
+    # Le plus rapide qui garde la précision des paramètres actuels
+    best = next(result for result in front if result["accuracy"] >= baseline["accuracy"])
+    return best["region"], results, front
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Réglage du prétraitement des régions d'un modèle de facture")
+    parser.add_argument("--files", nargs="+", default=DEFAULT_FILES, help="motifs des factures étiquetées (_OK / _BAD)")
+    parser.add_argument("--template", default="facture", help="modèle à régler")
+    parser.add_argument("--regions", nargs="+", default=list(DEFAULT_REGIONS), help="régions à régler, dans l'ordre")
+    parser.add_argument("--scales", nargs="+", type=float, default=[1, 1.5, 2, 3], help="facteurs d'agrandissement à essayer")
+    parser.add_argument("--psms", nargs="+", type=int, default=[4, 6], help="modes de segmentation Tesseract à essayer")
+    parser.add_argument("--repeat", type=int, default=1, help="nombre de passes par configuration")
+    parser.add_argument("--output", default=TEMPLATE_OVERRIDES, help="fichier JSON des réglages des modèles")
+    parser.add_argument("--report", help="fichier JSON de toutes les mesures et des fronts de Pareto")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.files for path in glob.glob(pattern)})
+    if not paths:
+        sys.exit(f"Aucun fichier pour {args.files}")
+    contexts = {path: ImageContext.from_path(path) for path in paths}
+
+    template = get_template(args.template)
+    report = {"template": template.name, "files": len(paths), "regions": {}}
+    for name in args.regions:
+        print(f"Région {name} :")
+        best, results, front = tune_region(template, name, contexts, args.scales, args.psms, args.repeat)
+        template = replace(template, regions=tuple(best if region.name == name else region for region in template.regions))
+        print(f"  retenu : {describe(best)}")
+        report["regions"][name] = {
+            "best": describe(best),
+            "results": [dict(result, region=describe(result["region"])) for result in results],
+            "pareto_front": [dict(result, region=describe(result["region"])) for result in front],
+        }
+
+    # Les réglages des autres modèles du fichier sont gardés
+    overrides = {}
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            overrides = json.load(f)
+    overrides.setdefault(args.template, {}).update({name: report["regions"][name]["best"] for name in args.regions})
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(overrides, f, indent=2)
+    print(f"Réglages enregistrés dans {args.output}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
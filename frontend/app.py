@@ -70,7 +70,7 @@ def upload():
             try:
                 # Send the file to the API
                 with open(file_path, "rb") as f:
-                    response = requests.post(f"{FASTAPI_URL}/process", files={"file": (file.filename, f)}, headers=headers)
+                    response = requests.post(f"{FASTAPI_URL}/process", files={"file": (file.filename, f)}, params={"wait": "true"}, headers=headers)
                 if response.status_code == 401:
                     return redirect(url_for("logout"))
                 response.raise_for_status()
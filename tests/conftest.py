@@ -0,0 +1,46 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Lu à l'import des modèles : les tests utilisent les paramètres du code, pas les réglages du poste
+os.environ["OCR_TEMPLATE_OVERRIDES"] = os.path.join(os.path.dirname(__file__), "missing_template_overrides.json")
+import types
+import pytest
+from app.app.utils import ocr_backends, ocr_cache
+
+
+@pytest.fixture(autouse=True)
+def no_ocr_cache(monkeypatch):
+    # Les tests ne lisent ni n'écrivent le cache OCR partagé du poste de développement
+    monkeypatch.setenv("OCR_CACHE", "0")
+    monkeypatch.setattr(ocr_cache, "_caches", {})
+
+
+@pytest.fixture
+def fake_tesserocr(monkeypatch):
+    # Moteurs tesserocr factices (tesserocr n'est pas installé partout) : `recognize` est appelé à chaque OCR
+    fake = types.SimpleNamespace(recognize=lambda: None)
+
+    class PyTessBaseAPI:
+        def __init__(self, lang="eng"):
+            self.lang = lang
+
+        def SetPageSegMode(self, psm):
+            pass
+
+        def SetVariable(self, name, value):
+            pass
+
+        def SetImageBytes(self, data, width, height, bytes_per_pixel, bytes_per_line):
+            pass
+
+        def GetUTF8Text(self):
+            fake.recognize()
+            return "texte"
+
+    fake.PyTessBaseAPI = PyTessBaseAPI
+    monkeypatch.setattr(ocr_backends, "tesserocr", fake)
+    monkeypatch.setattr(ocr_backends, "_instances", {})
+    monkeypatch.setattr(ocr_backends, "_reservations", {})
+    monkeypatch.setenv("OCR_BACKEND", "tesserocr")
+    monkeypatch.delenv("OCR_ENGINE_POOL", raising=False)
+    return fake
@@ -1,6 +1,7 @@
 from fastapi.testclient import TestClient
 from app.app import main
 import os
+import json
 from fastapi import status
 
 client = TestClient(main)
@@ -17,8 +18,34 @@ def test_process():
         response = client.post(
             "/process",
             files={"file": ("FAC2_OK.png", file)},
+            params={"wait": "true"},
         )
     assert response.status_code == status.HTTP_200_OK
     assert response.json()["erreur"] is None
     assert response.json()["status"] == "success"
     assert response.json()["data"] is not None
+
+def test_process_job():
+    file_path = os.path.abspath("temp/FAC2_OK.png")
+    with open(file_path, "rb") as file:
+        response = client.post(
+            "/process",
+            files={"file": ("FAC2_OK.png", file)},
+        )
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    job_id = response.json()["job_id"]
+
+    response = client.get(f"/jobs/{job_id}", params={"wait": 60})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] == "success"
+    assert response.json()["data"] is not None
+
+def test_process_batch():
+    files = []
+    for name in ["FAC2_OK.png", "FAC5_BAD.png"]:
+        with open(os.path.abspath(f"temp/{name}"), "rb") as file:
+            files.append(("files", (name, file.read())))
+    response = client.post("/process/batch", files=files)
+    assert response.status_code == status.HTTP_200_OK
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert {line["fichier"]: line["status"] for line in lines} == {"FAC2_OK.png": "success", "FAC5_BAD.png": "error"}
@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils import batch
+from app.app.utils.batch import file_path, iter_results, process_file
+
+
+def test_file_path():
+    assert file_path("FAC_2018_0001-654.png") == "data/files/2018/FAC_2018_0001-654.png"
+
+def test_process_file_error():
+    result = process_file(("FAC_2018_9999.png", "data/files/2018/FAC_2018_9999.png"))
+    assert result["status"] == "error"
+    assert result["filename"] == "FAC_2018_9999.png"
+    assert result["sha256"] is None
+    assert result["duration"] >= 0
+
+def test_iter_results_returns_every_file():
+    tasks = [(f"FAC_2018_{i:04}.png", f"data/files/2018/FAC_2018_{i:04}.png") for i in range(6)]
+    results = list(iter_results(iter(tasks), workers=2, max_in_flight=2, max_tasks_per_child=2))
+    assert sorted(result["filename"] for result in results) == [filename for filename, _ in tasks]
+
+def test_iter_results_consumer_error():
+    # Le consommateur échoue en cours de route : le pool est arrêté au lieu de bloquer
+    tasks = [(f"FAC_2018_{i:04}.png", f"data/files/2018/FAC_2018_{i:04}.png") for i in range(20)]
+    results = iter_results(iter(tasks), workers=2, max_in_flight=2, max_tasks_per_child=None)
+    with pytest.raises(RuntimeError):
+        for i, result in enumerate(results):
+            if i == 1:
+                raise RuntimeError("échec de l'enregistrement")
+    results.close()
+
+def test_main_applies_cpu_budget_first(mocker, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["batch", "--workers", "3"])
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    mocker.patch.object(batch, "load_dotenv")
+    apply_cpu_budget = mocker.patch.object(batch, "apply_cpu_budget")
+    # Le budget est appliqué avant tout le reste, même si le traitement s'arrête aussitôt
+    with pytest.raises(ValueError, match="DATABASE_URL"):
+        batch.main()
+    apply_cpu_budget.assert_called_once_with(processes=3)
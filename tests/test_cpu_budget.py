@@ -0,0 +1,57 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import cv2
+import pytest
+from app.app.utils import cpu_budget
+from app.app.utils.cpu_budget import BLAS_VARIABLES, apply_cpu_budget, get_cpu_allocation, plan_cpu_budget
+
+
+@pytest.fixture
+def clean_env(monkeypatch):
+    # apply_cpu_budget définit les variables avec setdefault : l'environnement entier est restauré après le test
+    environ = dict(os.environ)
+    for variable in ("OMP_THREAD_LIMIT", "OCR_WORKERS", "OCR_REGION_THREADS", "PDF_PAGE_WORKERS", "OCR_ENGINE_POOL", *BLAS_VARIABLES):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setattr(cpu_budget, "_allocation", None)
+    threads = cv2.getNumThreads()
+    yield monkeypatch
+    cv2.setNumThreads(threads)
+    os.environ.clear()
+    os.environ.update(environ)
+
+
+def test_plan_cpu_budget():
+    plan = plan_cpu_budget(8, processes=4)
+    assert plan["cpus_per_process"] == 2
+    assert (plan["ocr_workers"], plan["ocr_region_threads"], plan["pdf_page_workers"]) == (1, 0, 1)
+    assert (plan["omp_thread_limit"], plan["opencv_threads"]) == (1, 1)
+    # Au moins un cœur par processus
+    assert plan_cpu_budget(2, processes=4)["cpus_per_process"] == 1
+
+def test_plan_cpu_budget_pools():
+    # Les pools d'un processus se partagent ses cœurs
+    plan = plan_cpu_budget(16, processes=1, region_threads=4)
+    assert (plan["ocr_workers"], plan["ocr_region_threads"], plan["pdf_page_workers"]) == (9, 4, 3)
+    # Un moteur Tesseract par thread des trois pools
+    assert plan["ocr_engine_pool"] == 16
+    # Les threads de régions ne prennent pas plus de la moitié des cœurs
+    plan = plan_cpu_budget(4, processes=1, region_threads=8)
+    assert (plan["ocr_workers"], plan["ocr_region_threads"], plan["pdf_page_workers"]) == (1, 2, 1)
+
+def test_apply_cpu_budget(clean_env):
+    clean_env.setenv("OCR_WORKERS", "3")
+    apply_cpu_budget(8, processes=2)
+
+    assert os.environ["OMP_THREAD_LIMIT"] == "1"
+    assert os.environ["OPENBLAS_NUM_THREADS"] == "4"
+    # Un réglage explicite est gardé
+    assert os.environ["OCR_WORKERS"] == "3"
+    assert os.environ["PDF_PAGE_WORKERS"] == "1"
+    # Moteurs dimensionnés sur les pools effectifs, réglage à la main compris
+    assert os.environ["OCR_ENGINE_POOL"] == "4"
+    allocation = get_cpu_allocation()
+    assert allocation["planned"]["cpus_per_process"] == 4
+    assert allocation["effective"]["opencv_threads"] == 1
+    assert allocation["effective"]["ocr_workers"] == "3"
+    assert allocation["effective"]["ocr_engine_pool"] == 4
@@ -0,0 +1,19 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dateparser import parse
+from app.app.utils.dates import parse_date
+
+
+def test_same_result_as_dateparser():
+    for text in ["2019-03-03", "2019-03-03 20:16:00", "1985-01-16", "3 mars 2019"]:
+        assert parse_date(text) == parse(text, languages=["fr", "en"])
+
+def test_invalid_date():
+    assert parse_date("1984-02-31") is None
+
+def test_memoized():
+    parse_date.cache_clear()
+    parse_date("2020-05-17")
+    parse_date("2020-05-17")
+    assert parse_date.cache_info().hits == 1
@@ -2,7 +2,14 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import pandas as pd
-from app.app.utils.extract_data import extraire_donnees
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.app.utils import extract_data
+from app.app.utils.extract_data import READ_REGIONS, cascade_stats, decode_qrcode, extract_data_raw, extraire_donnees, ocr_template_region
+from app.app.utils.image_context import ImageContext
+from app.app.utils.monitoring import StageTimers
+from app.app.utils.ocr_backends import OCRBackend, get_backend
+from app.app.utils.templates import AUTOCROP_TEMPLATE, CASCADE_TEMPLATE, DEFAULT_TEMPLATE
 
 
 def test_file1():
@@ -101,3 +108,116 @@ def test_invoice11():
 def test_invoice12():
     invoice = extraire_donnees("data/test_files/FAC12_BAD.png")
     assert invoice['status']!="success"
+
+def test_known_invoice_skips_ocr(mocker):
+    mocker.patch("app.app.utils.extract_data.get_cache", return_value=None)
+    process_image = mocker.patch("app.app.utils.extract_data.process_image")
+    invoice = extract_data_raw("data/test_files/FAC1_OK.png", known_ids={"2018-0019"})
+    assert invoice["status"] == "duplicate"
+    assert invoice["variables"]["fac"] == "2018-0019"
+    assert invoice["ocr_calls"] == 0
+    process_image.assert_not_called()
+
+def test_qrcode_decoded_once():
+    context = ImageContext.from_path("data/test_files/FAC1_OK.png")
+    genre, birthdate, datetime_qr, fac = decode_qrcode(context)
+    assert (genre, fac) == ("M", "2018-0019")
+    assert decode_qrcode(context) is context.qrcodes[DEFAULT_TEMPLATE.qrcode_box]
+
+def test_pdf_one_invoice_per_page(mocker):
+    # Une page par facture : chaque page est traitée comme l'image correspondante
+    pages = ["data/test_files/FAC1_OK.png", "data/test_files/FAC2_OK.png"]
+    mocker.patch("app.app.utils.extract_data.map_pages", side_effect=lambda file, dpi, func, source: [func(ImageContext.from_path(page)) for page in pages])
+    extract = extraire_donnees("scans/lot.pdf")
+    assert extract["status"] == "success"
+    assert [page["status"] for page in extract["pages"]] == ["success", "success"]
+    df_client, df_facture, df_produit, df_achat = extract["data"]
+    assert len(df_facture) == 2
+
+def test_rejected_before_ocr():
+    # Date de naissance invalide dans le QR code : la facture est rejetée sans OCR
+    invoice = extract_data_raw("data/test_files/FAC12_BAD.png", use_cache=False)
+    assert invoice["status"] == "error"
+    assert invoice["erreurs"] == ["Date de naissance non détectée"]
+    assert invoice["ocr_calls"] == 0
+
+def test_validate_only(mocker):
+    mocker.patch("app.app.utils.extract_data.get_cache", return_value=None)
+    invoice = extraire_donnees("data/test_files/FAC12_BAD.png", validate_only=True)
+    assert invoice["status"] == "error"
+    assert invoice["erreurs"] == ["Date de naissance non détectée"]
+    assert invoice["data"] is None
+
+def test_cascade_escalates_failed_stage(mocker):
+    context = ImageContext.from_path("data/test_files/FAC1_OK.png")
+    genre, birthdate, datetime_qr, fac = decode_qrcode(context)
+    bloc = f"INVOICE FAC/{fac.replace('-', '/')}\nIssue date {datetime_qr[:10]}\nBill to Jean Dupont\nEmail jean@exemple.fr\nAddress 1 rue de la Paix"
+
+    class ScaleBackend(OCRBackend):
+        # En-tête illisible au premier niveau (échelle 1), articles lisibles dès le premier niveau
+        def __init__(self):
+            self.widths = []
+
+        def image_to_string(self, image, psm=6, whitelist=None):
+            width = round(image.shape[1] / 10) * 10
+            self.widths.append(width)
+            return {520: "illisible", 1040: bloc, 420: "Pomme\nTOTAL", 280: "2 x 3.50 Euro\n7.00 Euro"}.get(width, "")
+
+    backend = ScaleBackend()
+    mocker.patch("app.app.utils.extract_data.get_backend", return_value=backend)
+    mocker.patch.object(cascade_stats, "attempts", cascade_stats.attempts.copy())
+    mocker.patch.object(cascade_stats, "failures", cascade_stats.failures.copy())
+
+    invoice = extract_data_raw(context, template=CASCADE_TEMPLATE, use_cache=False)
+    assert invoice["status"] == "success"
+    assert invoice["variables"]["nom_client"] == "Jean Dupont"
+    # En-tête relu au deuxième niveau, les articles restent au premier ; le QR code n'est pas lu par l'OCR
+    assert backend.widths == [520, 1040, 420, 280]
+    stats = cascade_stats.get_statistics()
+    assert stats["header"]["native"]["escalation_rate"] == 1
+    assert stats["header"]["x2_clahe"]["failures"] == 0
+    assert stats["items"] == {"native": {"attempts": 1, "failures": 0, "escalation_rate": 0}}
+
+def test_empty_region_skips_ocr(mocker):
+    # En-tête vide : aucun appel OCR pour cette région
+    mocker.patch("app.app.utils.extract_data.get_backend", side_effect=AssertionError("OCR appelé"))
+    context = ImageContext.from_path("data/test_files/FAC11_BAD.png")
+    assert ocr_template_region(context, AUTOCROP_TEMPLATE, "bloc") == ""
+    assert context.ocr_calls == 0
+
+def test_concurrent_regions(mocker):
+    class ThreadBackend(OCRBackend):
+        def __init__(self):
+            self.threads = []
+
+        def image_to_string(self, image, psm=6, whitelist=None):
+            self.threads.append(threading.current_thread().name)
+            return ""
+
+    backend = ThreadBackend()
+    mocker.patch("app.app.utils.extract_data.get_backend", return_value=backend)
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="region-test")
+    mocker.patch("app.app.utils.extract_data.get_region_executor", return_value=executor)
+    timers = mocker.patch("app.app.utils.extract_data.stage_timers", StageTimers())
+
+    invoice = extract_data_raw("data/test_files/FAC1_OK.png", use_cache=False, concurrent=True)
+    # Les régions des contrôles sont lues d'un coup sur le pool, avant les contrôles de l'en-tête vide ;
+    # la région du QR code n'est pas lue par l'OCR
+    assert invoice["status"] == "error"
+    assert len(backend.threads) == len(READ_REGIONS)
+    assert all(name.startswith("region-test") for name in backend.threads)
+    # Chaque région garde son propre temps
+    stages = timers.get_statistics()
+    assert all(stages[f"ocr:{name}"]["count"] == 1 for name in READ_REGIONS)
+    assert "ocr:batch" not in stages and "ocr:Qrcode" not in stages
+    executor.shutdown()
+
+def test_region_threads_reserve_engines(mocker, monkeypatch, fake_tesserocr):
+    monkeypatch.setenv("OCR_REGION_THREADS", "3")
+    mocker.patch.object(extract_data, "_region_executors", {})
+    backend = get_backend()
+    assert backend.pool_size == 1
+    executor = extract_data.get_region_executor()
+    # Un moteur par thread de régions : les régions d'une facture ne s'attendent pas
+    assert backend.pool_size == 3
+    executor.shutdown()
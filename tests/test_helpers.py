@@ -1,26 +1,45 @@
 import pytest
 from app.app.utils import helpers
 import os
-from unittest.mock import MagicMock, patch
+import hashlib
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi import HTTPException
 
 @pytest.mark.asyncio
-async def test_save_uploaded_file(tmp_path):
+async def test_save_uploaded_file(tmp_path, mocker):
+    mocker.patch("app.app.utils.helpers.UPLOAD_DIR", str(tmp_path))
     file = MagicMock()
     file.filename = "test.txt"
-    file.file.read.return_value = b"test content"  # Correctly mock file.read() to return bytes
+    file.read = AsyncMock(side_effect=[b"test ", b"content", b""])  # Lecture par morceaux
     file_location = await helpers.save_uploaded_file(file)
     assert os.path.exists(file_location)
-    assert os.path.basename(file_location) == "test.txt"
+    assert os.path.basename(file_location) == hashlib.sha256(b"test content").hexdigest() + ".txt"
 
 @pytest.mark.asyncio
 async def test_save_uploaded_file_error(mocker):
     file = MagicMock()
     file.filename = "test.txt"
-    file.file.read.side_effect = IOError("File read error")  # Simulate file read error
+    file.read = AsyncMock(side_effect=IOError("File read error"))  # Simulate file read error
 
-    with pytest.raises(Exception, match="Failed to save file: File read error"):
+    with pytest.raises(Exception, match="Failed to read file: File read error"):
         await helpers.save_uploaded_file(file)
 
+@pytest.mark.asyncio
+async def test_read_uploaded_file_too_large():
+    file = MagicMock()
+    file.read = AsyncMock(side_effect=[b"x" * 10, b"x" * 10, b""])
+
+    with pytest.raises(Exception, match="File too large"):
+        await helpers.read_uploaded_file(file, max_bytes=15)
+
+def test_sweep_uploads(tmp_path):
+    old_file = helpers.store_upload(b"old", "old.png", str(tmp_path))
+    new_file = helpers.store_upload(b"new", "new.png", str(tmp_path))
+    os.utime(old_file, (0, 0))
+    assert helpers.sweep_uploads(str(tmp_path), retention=3600) == 1
+    assert not os.path.exists(old_file)
+    assert os.path.exists(new_file)
+
 def test_extract_data_from_file(mocker):
     mock_file_location = "temp/test.txt"
     mock_extract_result = {"status": "success", "data": "mocked_data"}
@@ -87,3 +106,69 @@ def test_convert_dataframes_to_json_error():
     mock_extract_result = {"status": "error", "erreur": "Mocked error"}
     result = helpers.convert_dataframes_to_json(mock_extract_result)
     assert result is None
+
+def test_iter_uploaded_files(tmp_path):
+    import io
+    import zipfile
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("lot/FAC1.png", b"image 1")
+        zf.writestr("lot/notes.txt", b"ignored")
+    archive.seek(0)
+    zip_file = MagicMock()
+    zip_file.filename = "lot.zip"
+    zip_file.file = archive
+    image_file = MagicMock()
+    image_file.filename = "FAC2.png"
+    image_file.file.read.return_value = b"image 2"
+
+    assert list(helpers.iter_uploaded_files([zip_file, image_file])) == [("FAC1.png", b"image 1"), ("FAC2.png", b"image 2")]
+
+def test_iter_uploaded_files_limits():
+    import io
+    import zipfile
+    def zip_file(members):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, content in members:
+                zf.writestr(name, content)
+        archive.seek(0)
+        upload = MagicMock()
+        upload.filename = "lot.zip"
+        upload.file = archive
+        return upload
+
+    # Membre trop gros une fois décompressé
+    with pytest.raises(HTTPException) as e:
+        list(helpers.iter_uploaded_files([zip_file([("FAC1.png", b"0" * 100)])], max_bytes=50))
+    assert e.value.status_code == 413
+    # Trop de fichiers : les premiers sont tout de même lus
+    files = helpers.iter_uploaded_files([zip_file([(f"FAC{i}.png", b"image") for i in range(3)])], max_files=2)
+    assert next(files) == ("FAC0.png", b"image")
+    next(files)
+    with pytest.raises(HTTPException, match="Too many files"):
+        next(files)
+    # Taille totale
+    with pytest.raises(HTTPException, match="in total"):
+        list(helpers.iter_uploaded_files([zip_file([(f"FAC{i}.png", b"0" * 40) for i in range(3)])], max_bytes=50, max_total_bytes=100))
+
+def test_add_batch_to_database(mocker):
+    import pandas as pd
+    mock_engine = MagicMock()
+    mocker.patch("app.app.utils.helpers.add_data")
+    client = pd.DataFrame([{"id_client": "CLT_1"}])
+    extract_results = [
+        {"status": "success", "data": [client, pd.DataFrame([{"id_facture": f"FAC_{i}"}]), pd.DataFrame([{"id_produit": "P"}]),
+                                       pd.DataFrame([{"id_produit": "P", "id_client": "CLT_1", "id_facture": f"FAC_{i}"}])]}
+        for i in range(2)
+    ]
+
+    helpers.add_batch_to_database(mock_engine, extract_results)
+
+    # Une seule écriture par table, sans doublons
+    assert helpers.add_data.call_count == 4
+    tables = {call.args[1]: call.args[2] for call in helpers.add_data.call_args_list}
+    assert len(tables["client"]) == 1
+    assert len(tables["facture"]) == 2
+    assert len(tables["produit"]) == 1
+    assert len(tables["achat"]) == 2
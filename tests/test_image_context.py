@@ -0,0 +1,70 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import cv2
+import numpy as np
+import pytest
+from app.app.utils.image_context import ImageContext, get_clahe, scratch_buffer
+
+FILE = "data/test_files/FAC1_OK.png"
+
+
+def test_decode_once_in_grayscale():
+    context = ImageContext.from_path(FILE)
+    assert context.gray.ndim == 2
+    assert context.source == FILE
+    expected = cv2.cvtColor(cv2.imread(FILE), cv2.COLOR_BGR2GRAY)
+    assert np.array_equal(context.gray, expected)
+
+def test_from_bytes():
+    with open(FILE, "rb") as f:
+        context = ImageContext.from_bytes(f.read(), source="FAC1_OK.png")
+    assert np.array_equal(context.gray, ImageContext.from_path(FILE).gray)
+
+def test_roi_is_a_view():
+    context = ImageContext.from_path(FILE)
+    roi = context.roi((530, 5, 180, 180))
+    assert roi.shape == (180, 180)
+    assert np.shares_memory(roi, context.gray)
+
+def test_scaled_roi_matches_full_resize():
+    context = ImageContext.from_path(FILE)
+    box = (510, 180, 280, 900)
+    height, width = context.shape
+    full = cv2.resize(context.gray, (width * 2, height * 2), interpolation=cv2.INTER_LINEAR)
+    expected = full[360:360 + 1800, 1020:1020 + 560]
+    assert np.array_equal(context.scaled_roi(box, 2), expected)
+
+def test_clahe_and_buffers_are_reused():
+    assert get_clahe(2.0, (10, 10)) is get_clahe(2.0, (10, 10))
+    buffer = scratch_buffer("test", (10, 10))
+    assert scratch_buffer("test", (10, 10)) is buffer
+    assert scratch_buffer("test", (20, 10)) is not buffer
+
+def test_unreadable_image():
+    with pytest.raises(ValueError, match="bad.png"):
+        ImageContext.from_bytes(b"not an image", source="bad.png")
+
+def test_ink_box():
+    image = np.full((100, 200), 255, dtype=np.uint8)
+    image[40:50, 60:120] = 0
+    context = ImageContext(image)
+
+    assert context.ink_box((0, 0, 200, 100), margin=5) == (55, 35, 70, 20)
+    # Marge limitée à la région
+    assert context.ink_box((60, 40, 100, 60), margin=5) == (60, 40, 65, 15)
+    assert context.ink_box((0, 60, 200, 40)) is None
+
+def test_ink_rows():
+    image = np.full((100, 200), 255, dtype=np.uint8)
+    image[10:20, 10:50] = 0
+    image[12:20, 120:150] = 0
+    # Point du "i" séparé de 2 pixels, puis un trait horizontal trop fin pour une ligne
+    image[30:32, 10:20] = 0
+    image[34:44, 10:20] = 0
+    image[60:61, 0:200] = 0
+    context = ImageContext(image)
+
+    assert context.ink_rows([(0, 0, 100, 100), (100, 0, 100, 100)]) == [(10, 20), (30, 44)]
+    with pytest.raises(ValueError):
+        context.ink_rows([(0, 0, 100, 100), (100, 10, 100, 90)])
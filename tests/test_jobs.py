@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+from app.app.utils.jobs import JobManager, QueueFullError
+from app.app.utils.ocr_backends import get_backend
+
+
+@pytest.mark.asyncio
+async def test_wait_for_job():
+    manager = JobManager(workers=1)
+    job_id = manager.submit(lambda x: {"status": "success", "erreur": None, "data": x}, 42)
+    job = await manager.wait(job_id, timeout=5)
+    assert job == {"job_id": job_id, "status": "success", "erreur": None, "data": 42}
+    assert await manager.wait("inconnu", timeout=1) is None
+
+@pytest.mark.asyncio
+async def test_wait_timeout_and_queue_full():
+    manager = JobManager(workers=1, max_pending=1)
+    release = threading.Event()
+    job_id = manager.submit(lambda: release.wait() and {"status": "success", "erreur": None, "data": None})
+    assert (await manager.wait(job_id, timeout=0.05))["status"] in ("pending", "running")
+    with pytest.raises(QueueFullError):
+        manager.submit(lambda: None)
+    release.set()
+    assert (await manager.wait(job_id, timeout=5))["status"] == "success"
+
+@pytest.mark.asyncio
+async def test_job_exception():
+    manager = JobManager(workers=1)
+    job_id = manager.submit(lambda: 1 / 0)
+    job = await manager.wait(job_id, timeout=5)
+    assert job["status"] == "error"
+    assert job["erreur"] == "division by zero"
+
+@pytest.mark.asyncio
+async def test_run_shares_pending_bound():
+    manager = JobManager(workers=1, max_pending=1)
+    release = threading.Event()
+    result = manager.run(lambda: release.wait() and 42)
+    # Les factures d'un lot comptent parmi les traitements en attente
+    with pytest.raises(QueueFullError):
+        manager.submit(lambda: None)
+    with pytest.raises(QueueFullError):
+        manager.run(lambda: None)
+    release.set()
+    assert await result == 42
+    assert manager.pending == 0
+
+@pytest.mark.asyncio
+async def test_jobs_ocr_overlaps(fake_tesserocr):
+    # Les deux OCR doivent être en cours en même temps pour franchir la barrière
+    barrier = threading.Barrier(2, timeout=5)
+    fake_tesserocr.recognize = barrier.wait
+    manager = JobManager(workers=2)
+
+    def ocr():
+        text = get_backend().image_to_string(np.zeros((10, 10), dtype=np.uint8))
+        return {"status": "success", "erreur": None, "data": text}
+
+    job_ids = [manager.submit(ocr), manager.submit(ocr)]
+    for job_id in job_ids:
+        assert (await manager.wait(job_id, timeout=10))["status"] == "success"
@@ -0,0 +1,32 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils.manifest import Manifest
+
+FILES = [
+    ("FAC_2018_0001-654.png", "data/files/2018/FAC_2018_0001-654.png"),
+    ("FAC_2018_0002-114.png", "data/files/2018/FAC_2018_0002-114.png"),
+    ("FAC_2019_0001-200.png", "data/files/2019/FAC_2019_0001-200.png"),
+]
+
+
+def test_add_files_once(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    assert manifest.add_files(FILES) == 3
+    assert manifest.add_files(FILES[:1]) == 0
+    assert manifest.summary() == {"pending": 3}
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    manifest = Manifest(path)
+    manifest.add_files(FILES)
+    manifest.record(FILES[0][0], "success", "abc", 1.2)
+    manifest.record(FILES[1][0], "error", "def", 0.8, "Total non correct")
+    manifest.close()
+
+    # Reprise après interruption : seuls les fichiers non traités restent à faire
+    manifest = Manifest(path)
+    assert manifest.files_to_process() == [FILES[2]]
+    assert manifest.files_to_process(retry_failed=True) == [FILES[1], FILES[2]]
+    assert manifest.files_to_process(only_failed=True) == [FILES[1]]
+    assert manifest.summary() == {"success": 1, "error": 1, "pending": 1}
@@ -0,0 +1,29 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils.monitoring import StageTimers
+
+
+def test_stage_statistics():
+    timers = StageTimers()
+    for duration in [0.003] * 9 + [0.3]:
+        timers.record("ocr:bloc", duration)
+    stats = timers.get_statistics()["ocr:bloc"]
+    assert stats["count"] == 10
+    assert round(stats["total_time"], 3) == 0.327
+    assert stats["max_time"] == 0.3
+    assert stats["p50_time"] == 0.005
+    assert stats["p95_time"] == 0.3
+    assert stats["histogram"]["<=0.005s"] == 9
+    assert stats["histogram"]["<=0.5s"] == 1
+
+def test_time_block():
+    timers = StageTimers()
+    try:
+        with timers.time("db"):
+            raise ValueError("erreur")
+    except ValueError:
+        pass
+    assert timers.get_statistics()["db"]["count"] == 1
+    timers.reset()
+    assert timers.get_statistics() == {}
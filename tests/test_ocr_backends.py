@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+import pytest
+from app.app.utils import ocr_backends
+from app.app.utils.ocr_backends import BatchingBackend, PytesseractBackend, get_backend, lines_to_text
+
+
+class FakeBatchingBackend(BatchingBackend):
+    name = "fake-batch"
+
+    def __init__(self, **kwargs):
+        self.sizes = []
+        super().__init__(**kwargs)
+
+    def _predict(self, images):
+        self.sizes.append(len(images))
+        return [str(image[0, 0]) for image in images]
+
+
+def test_pytesseract_config(mocker):
+    image_to_string = mocker.patch("app.app.utils.ocr_backends.pytesseract.image_to_string", return_value="texte")
+    image = np.zeros((10, 10), dtype=np.uint8)
+
+    assert PytesseractBackend().image_to_string(image, psm=6, whitelist="0123456789") == "texte"
+    image_to_string.assert_called_once_with(image, config="--psm 6 -c tessedit_char_whitelist=0123456789")
+
+def test_get_backend_is_created_once():
+    assert get_backend("pytesseract") is get_backend("pytesseract")
+
+def test_get_backend_auto_fallback(mocker):
+    mocker.patch.object(ocr_backends, "tesserocr", None)
+    mocker.patch.dict(ocr_backends._instances, clear=True)
+    assert isinstance(get_backend("auto"), PytesseractBackend)
+
+def test_get_backend_unknown():
+    with pytest.raises(ValueError, match="inconnu"):
+        get_backend("inconnu")
+
+def test_recognize_batch_default(mocker):
+    backend = PytesseractBackend()
+    image_to_string = mocker.patch.object(backend, "image_to_string", side_effect=["a", "b"])
+    images = [np.zeros((10, 10), dtype=np.uint8)] * 2
+
+    assert backend.recognize_batch(images, psm=7) == ["a", "b"]
+    assert image_to_string.call_count == 2
+
+def test_batching_backend_gathers_threads():
+    backend = FakeBatchingBackend(batch_size=8, max_wait=0.5)
+    results = {}
+
+    def recognize(value):
+        images = [np.full((4, 4), value, dtype=np.uint8)] * 2
+        results[value] = backend.recognize_batch(images)
+
+    threads = [threading.Thread(target=recognize, args=(value,)) for value in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Les 8 images des 4 appels sont reconnues ensemble, chacune rendue à son appelant
+    assert backend.sizes == [8]
+    assert results == {value: [str(value)] * 2 for value in range(4)}
+    assert backend.image_to_string(np.full((4, 4), 9, dtype=np.uint8)) == "9"
+
+def test_batching_backend_error():
+    class FailingBackend(FakeBatchingBackend):
+        def _predict(self, images):
+            raise RuntimeError("modèle indisponible")
+
+    with pytest.raises(RuntimeError, match="modèle"):
+        FailingBackend(max_wait=0).recognize_batch([np.zeros((4, 4), dtype=np.uint8)])
+
+def test_lines_to_text():
+    words = [("Total", (0.1, 0.52, 0.2, 0.56)), ("Bill", (0.1, 0.1, 0.2, 0.14)), ("to", (0.25, 0.11, 0.3, 0.14))]
+    assert lines_to_text(words) == "Bill to\nTotal"
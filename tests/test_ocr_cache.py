@@ -0,0 +1,56 @@
+import datetime
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils import extract_data
+from app.app.utils.ocr_backends import OCRBackend
+from app.app.utils.ocr_cache import OCRCache
+from app.app.utils.templates import DEFAULT_TEMPLATE
+
+
+class FakeBackend(OCRBackend):
+    name = "fake"
+
+
+def test_get_put(tmp_path):
+    cache = OCRCache(str(tmp_path / "cache.sqlite"))
+    value = {"status": "success", "variables": {"birthdate": datetime.datetime(1985, 2, 24)}}
+
+    assert cache.get("a") is None
+    cache.put("a", value)
+    assert cache.get("a") == value
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["entries"] == 1
+
+def test_key_depends_on_versions():
+    key = OCRCache.make_key("abc", DEFAULT_TEMPLATE, FakeBackend())
+    assert key == f"abc:facture-{DEFAULT_TEMPLATE.version}:fake"
+
+def test_eviction(tmp_path):
+    cache = OCRCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    # "b" est l'entrée la moins récemment utilisée
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_extract_data_raw_uses_cache(tmp_path, mocker):
+    cache = OCRCache(str(tmp_path / "cache.sqlite"))
+    mocker.patch.object(extract_data, "get_cache", return_value=cache)
+    mocker.patch.object(extract_data, "get_backend", return_value=FakeBackend())
+    result = {"status": "error", "fichier": "FAC1_OK.png", "data": None, "erreur": "Nom non détecté", "variables": None, "ocr_calls": 4}
+    extract = mocker.patch.object(extract_data, "_extract_from_context", return_value=result)
+
+    first = extract_data.extract_data_raw("data/test_files/FAC1_OK.png")
+    second = extract_data.extract_data_raw("data/test_files/FAC1_OK.png")
+
+    assert extract.call_count == 1
+    assert first == result
+    assert second["erreur"] == "Nom non détecté"
+    assert second["fichier"] == "data/test_files/FAC1_OK.png"
+    assert second["ocr_calls"] == 0
@@ -0,0 +1,34 @@
+import os
+import sys
+import numpy as np
+from PIL import Image
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.app.utils import pdf
+from app.app.utils.ocr_backends import get_backend
+from app.app.utils.pdf import is_pdf, map_pages
+
+
+def test_is_pdf():
+    assert is_pdf(b"%PDF-1.4\n...")
+    assert not is_pdf(b"\x89PNG\r\n")
+    assert is_pdf("data/scanned_document.pdf")
+    assert not is_pdf("data/test_files/FAC1_OK.png")
+
+def test_map_pages_one_page_at_a_time(mocker):
+    mocker.patch.object(pdf, "pdfinfo_from_path", return_value={"Pages": 3})
+    convert = mocker.patch.object(pdf, "convert_from_path", side_effect=lambda path, dpi, first_page, last_page, grayscale: [Image.fromarray(np.full((10, 10), first_page, dtype=np.uint8))])
+
+    results = map_pages(b"%PDF-1.4 contenu", 100, lambda context: (context.source, int(context.gray[0, 0]), context.digest), source="lot.pdf")
+
+    assert [result[:2] for result in results] == [("lot.pdf#page=1", 1), ("lot.pdf#page=2", 2), ("lot.pdf#page=3", 3)]
+    assert len({result[2] for result in results}) == 3
+    assert all(call.kwargs["first_page"] == call.kwargs["last_page"] for call in convert.call_args_list)
+    assert all(call.kwargs["dpi"] == 100 for call in convert.call_args_list)
+
+def test_page_workers_reserve_engines(mocker, monkeypatch, fake_tesserocr):
+    monkeypatch.setenv("PDF_PAGE_WORKERS", "2")
+    mocker.patch.object(pdf, "_executors", {})
+    executor = pdf.get_page_executor()
+    # Les pages d'un PDF ne s'attendent pas pour un moteur libre
+    assert get_backend().pool_size == 2
+    executor.shutdown()
@@ -0,0 +1,31 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.pipeline import benchmark_stages
+from app.app.utils.extract_data import decode_qrcode
+from app.app.utils.image_context import ImageContext
+from app.app.utils.ocr_backends import OCRBackend
+from app.app.utils.templates import CASCADE_TEMPLATE, DEFAULT_TEMPLATE
+
+
+def test_parsing_stage_does_not_redo_the_ocr(mocker):
+    path = "data/test_files/FAC1_OK.png"
+    genre, birthdate, datetime_qr, fac = decode_qrcode(ImageContext.from_path(path))
+    bloc = f"INVOICE FAC/{fac.replace('-', '/')}\nIssue date {datetime_qr[:10]}\nBill to Jean Dupont\nEmail jean@exemple.fr\nAddress 1 rue de la Paix"
+
+    class WidthBackend(OCRBackend):
+        # Chaque région est reconnue à sa largeur, à l'échelle 1 comme à l'échelle 2 : facture lisible dès le premier niveau
+        def image_to_string(self, image, psm=6, whitelist=None):
+            width = round(image.shape[1] / 10) * 10
+            return {520: bloc, 1040: bloc, 420: "Pomme\nTOTAL", 840: "Pomme\nTOTAL",
+                    280: "2 x 3.50 Euro\n7.00 Euro", 560: "2 x 3.50 Euro\n7.00 Euro"}.get(width, "")
+
+    backend = WidthBackend()
+    mocker.patch("benchmarks.pipeline.get_backend", return_value=backend)
+    mocker.patch("app.app.utils.extract_data.get_backend", return_value=backend)
+
+    for template in (DEFAULT_TEMPLATE, CASCADE_TEMPLATE):
+        *_, statuses, parsing_ocr_calls = benchmark_stages([path], 1, template)
+        assert statuses[path] == "success"
+        # Toutes les régions sont lues dans l'étape ocr, au premier niveau de la cascade
+        assert parsing_ocr_calls == 0
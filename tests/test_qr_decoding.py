@@ -0,0 +1,53 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+import pytest
+from app.app.utils.image_context import ImageContext
+from app.app.utils.qr_decoding import QR_LADDER, OpenCVDecoder, QRDecoder, QRLadderStats, decode_ladder, get_decoders
+from app.app.utils.templates import DEFAULT_TEMPLATE
+
+
+def decode(filename):
+    context = ImageContext.from_path(f"data/test_files/{filename}")
+    return decode_ladder(context.roi(DEFAULT_TEMPLATE.qrcode_box), context.shape)
+
+def test_cheapest_step_first():
+    data, rung = decode("FAC1_OK.png")
+    assert data.startswith("INVOICE:FAC/2018/0019")
+    assert rung == QR_LADDER[0].name
+
+def test_blurred_qrcode_uses_a_later_step():
+    data, rung = decode("FAC4_OK.png")
+    assert data.startswith("INVOICE:FAC/2018/0019")
+    assert rung != QR_LADDER[0].name
+
+def test_no_qrcode():
+    assert decode_ladder(np.full((180, 180), 255, dtype=np.uint8), (1100, 850)) == (None, None)
+
+def test_no_page_shape():
+    # Sans la taille de la page, les échelons "page_size" sont sautés
+    assert decode_ladder(np.full((180, 180), 255, dtype=np.uint8)) == (None, None)
+
+def test_stats():
+    stats = QRLadderStats()
+    stats.record("native", "opencv")
+    stats.record("native", "zbar")
+    stats.record(None)
+    assert stats.get_statistics() == {"total": 3, "failures": 1, "successes": {"native": 2}, "decoders": {"opencv": 1, "zbar": 1}}
+
+def test_decoders_chain():
+    assert [decoder.name for decoder in get_decoders("opencv")] == ["opencv"]
+    with pytest.raises(ValueError, match="inconnu"):
+        get_decoders("inconnu")
+
+def test_fallback_to_next_decoder():
+    class NoDecoder(QRDecoder):
+        name = "none"
+
+        def decode(self, image):
+            return None
+
+    context = ImageContext.from_path("data/test_files/FAC1_OK.png")
+    data, rung = decode_ladder(context.roi(DEFAULT_TEMPLATE.qrcode_box), context.shape, decoders=(NoDecoder(), OpenCVDecoder()))
+    assert data.startswith("INVOICE:FAC/2018/0019")
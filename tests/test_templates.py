@@ -0,0 +1,123 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+from app.app.utils.extract_data import process_image, predefined_regions
+from app.app.utils.image_context import ImageContext
+from app.app.utils.ocr_backends import OCRBackend, OCRWord
+from app.app.utils import image_context, templates
+from app.app.utils.templates import CASCADE_TEMPLATE, DEFAULT_TEMPLATE, LAYOUT_TEMPLATE, LINES_TEMPLATE, PREPROCESSING_CASCADE, TEMPLATES, InvoiceTemplate, RegionSpec, get_template, register_template
+
+
+class FakeBackend(OCRBackend):
+    name = "fake"
+
+    def __init__(self):
+        self.calls = []
+
+    def image_to_string(self, image, psm=6, whitelist=None):
+        self.calls.append((image.shape, psm, whitelist))
+        return f" texte {len(self.calls)} \n"
+
+    def image_to_data(self, image, psm=3):
+        self.calls.append((image.shape, psm, None))
+        # Boîtes dans l'image agrandie 2 fois
+        return [
+            OCRWord("Bill", 96.0, (60, 200, 40, 20), (1, 1, 1)),
+            OCRWord("to", 90.0, (110, 200, 20, 20), (1, 1, 1)),
+            OCRWord("Apple", 80.0, (100, 500, 60, 20), (2, 1, 1)),
+            OCRWord("2", 70.0, (1100, 500, 10, 20), (2, 1, 1)),
+            OCRWord("Pear", 60.0, (100, 540, 60, 20), (2, 1, 2)),
+        ]
+
+
+def test_default_template():
+    assert get_template("facture") is DEFAULT_TEMPLATE
+    assert predefined_regions["Products"] == (20, 180, 420, 900)
+    assert DEFAULT_TEMPLATE.region("bloc").box == (10, 10, 520, 180)
+
+def test_unknown_template():
+    with pytest.raises(ValueError, match="inconnu"):
+        get_template("inconnu")
+
+def test_one_ocr_call_per_region():
+    backend = FakeBackend()
+    context = ImageContext.from_path("data/test_files/FAC1_OK.png")
+
+    texts = process_image(context, DEFAULT_TEMPLATE, backend=backend)
+    assert list(texts) == ["Products", "Quantities_and_prices", "Qrcode", "bloc"]
+    assert texts["Products"] == "texte 1"
+    assert len(backend.calls) == len(DEFAULT_TEMPLATE.regions)
+    assert context.ocr_calls == len(DEFAULT_TEMPLATE.regions)
+
+    # Les régions déjà reconnues ne repassent pas par le moteur
+    process_image(context, DEFAULT_TEMPLATE, backend=backend)
+    assert context.ocr_calls == len(DEFAULT_TEMPLATE.regions)
+
+def test_region_parameters(mocker):
+    mocker.patch.dict(TEMPLATES)
+    backend = FakeBackend()
+    template = register_template(InvoiceTemplate(
+        name="test",
+        version="1",
+        regions=(RegionSpec("Prix", (510, 180, 280, 900), psm=4, whitelist="0123456789", scale=1, preprocessing=("otsu",)),),
+    ))
+    process_image("data/test_files/FAC1_OK.png", template, backend=backend)
+    assert backend.calls == [((900, 280), 4, "0123456789")]
+
+def test_layout_mode_one_ocr_call():
+    backend = FakeBackend()
+    context = ImageContext.from_path("data/test_files/FAC1_OK.png")
+
+    texts = process_image(context, LAYOUT_TEMPLATE, backend=backend)
+    assert backend.calls == [((2200, 1700), LAYOUT_TEMPLATE.layout_psm, None)]
+    assert context.ocr_calls == 1
+    # Mots répartis dans les régions par leur boîte, une ligne de texte par ligne de Tesseract
+    assert texts["bloc"] == "Bill to"
+    assert texts["Products"] == "Apple\nPear"
+    assert texts["Quantities_and_prices"] == "2"
+    assert [word.confidence for word in context.ocr_words[LAYOUT_TEMPLATE.region("Products")]] == [80.0, 60.0]
+
+def test_template_with_level():
+    level = PREPROCESSING_CASCADE[0]
+    template = CASCADE_TEMPLATE.with_level(level, ("bloc",))
+    assert template.region("bloc").scale == 1
+    assert template.region("bloc").preprocessing == ("otsu",)
+    assert template.region("Products") == DEFAULT_TEMPLATE.region("Products")
+    # Le deuxième niveau reprend le prétraitement fixe du modèle par défaut
+    assert CASCADE_TEMPLATE.with_level(PREPROCESSING_CASCADE[1]).regions == DEFAULT_TEMPLATE.regions
+
+def test_line_items_aligned():
+    backend = FakeBackend()
+    context = ImageContext.from_path("data/test_files/FAC1_OK.png")
+
+    texts = process_image(context, LINES_TEMPLATE, backend=backend)
+    # 4 lignes (3 articles et le total) x 2 colonnes, une cellule par appel, puis le QR code et l'en-tête
+    assert [psm for _, psm, _ in backend.calls] == [7] * 8 + [6, 6]
+    assert texts["Products"] == "texte 1\ntexte 3\ntexte 5\ntexte 7"
+    assert texts["Quantities_and_prices"] == "texte 2\ntexte 4\ntexte 6\ntexte 8"
+    assert context.ocr_calls == 10
+
+def test_line_items_no_scratch_buffers():
+    context = ImageContext.from_path("data/test_files/FAC1_OK.png")
+    before = set(getattr(image_context._local, "buffers", {}))
+
+    process_image(context, LINES_TEMPLATE, backend=FakeBackend())
+    # Les cellules ne gardent pas de buffer par ligne du tableau
+    added = set(image_context._local.buffers) - before
+    assert not any(key.startswith(LINES_TEMPLATE.line_items) for key in added)
+
+def test_template_overrides(mocker, tmp_path):
+    path = tmp_path / "overrides.json"
+    path.write_text('{"test": {"Prix": {"scale": 1.5, "preprocessing": ["otsu"], "clahe_tile_grid_size": [8, 8]}}}')
+    mocker.patch.dict(TEMPLATES)
+    mocker.patch.object(templates, "_overrides", templates.load_overrides(str(path)))
+
+    template = register_template(InvoiceTemplate(name="test", version="1", regions=(RegionSpec("Prix", (0, 0, 10, 10)),)))
+    assert template.region("Prix") == RegionSpec("Prix", (0, 0, 10, 10), scale=1.5, preprocessing=("otsu",), clahe_tile_grid_size=(8, 8))
+    # Nouvelle version : les résultats en cache des anciens réglages ne sont pas repris
+    assert template.version.startswith("1+")
+    assert get_template("test") is template
+
+    with pytest.raises(ValueError, match="inconnus"):
+        templates.apply_overrides(template, {"Prix": {"box": [0, 0, 5, 5]}})
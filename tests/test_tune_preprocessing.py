@@ -0,0 +1,30 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.tune_preprocessing import CLAHE_CLIP_LIMITS, CLAHE_TILE_GRID_SIZES, candidates, pareto_front
+from app.app.utils.templates import RegionSpec
+
+
+def test_candidates():
+    region = RegionSpec("Prix", (0, 0, 10, 10), scale=2, psm=6, preprocessing=("otsu",))
+    configurations = candidates(region, scales=[1, 2], psms=[6])
+    # Paramètres actuels en premier, sans doublon
+    assert configurations[0] == region
+    assert len(configurations) == len(set(configurations))
+    # Par échelle : otsu seul, puis chaque couple de paramètres du CLAHE
+    assert len(configurations) == 2 * (1 + len(CLAHE_CLIP_LIMITS) * len(CLAHE_TILE_GRID_SIZES))
+    # Sans CLAHE, ses paramètres ne varient pas
+    assert {(candidate.clahe_clip_limit, candidate.clahe_tile_grid_size) for candidate in configurations
+            if "clahe" not in candidate.preprocessing} == {(region.clahe_clip_limit, region.clahe_tile_grid_size)}
+
+def test_pareto_front():
+    results = [
+        {"name": "lent", "accuracy": 1.0, "time": 0.3},
+        {"name": "rapide", "accuracy": 0.5, "time": 0.1},
+        {"name": "dominé", "accuracy": 0.5, "time": 0.2},
+        {"name": "moyen", "accuracy": 0.9, "time": 0.2},
+        {"name": "plus lent et moins précis", "accuracy": 0.9, "time": 0.4},
+    ]
+    # Du plus rapide au plus lent, chacun plus précis que le précédent
+    assert [result["name"] for result in pareto_front(results)] == ["rapide", "moyen", "lent"]
+    assert pareto_front([]) == []